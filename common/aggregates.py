@@ -0,0 +1,163 @@
+"""Precomputed counts of model tables grouped by a column.
+
+Every aggregate is a relation `<table>_count_by_<column>[_<bucket>]` with columns value and count.
+It is either a materialized view, refreshed with REFRESH MATERIALIZED VIEW CONCURRENTLY
+(see `RefreshScheduler`), or a summary table kept up to date by statement triggers.
+"""
+import threading
+import typing
+
+from psycopg import sql
+
+from common.logger import get_logger
+
+if typing.TYPE_CHECKING:
+    from common.tables import TableManager
+
+logger = get_logger('aggregates')
+
+BUCKETS = ('year', 'month', 'day')
+
+MATERIALIZED_VIEW_SQL = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS {aggregate} AS
+    SELECT {value} AS value, count(*) AS count FROM {table} GROUP BY 1;
+CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {aggregate} (value);
+"""
+
+# Statement triggers apply the whole statement as one grouped delta, so a COPY of a million rows
+# costs one upsert per distinct value. Writers of the same value serialize on its summary row.
+SUMMARY_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS {aggregate} (value {type} UNIQUE NULLS NOT DISTINCT, count bigint NOT NULL);
+
+CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE {aggregate};
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO {aggregate} AS a (value, count)
+        SELECT {value}, -count(*) FROM old_rows GROUP BY 1
+        ON CONFLICT (value) DO UPDATE SET count = a.count + EXCLUDED.count;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO {aggregate} AS a (value, count)
+        SELECT {value}, count(*) FROM new_rows GROUP BY 1
+        ON CONFLICT (value) DO UPDATE SET count = a.count + EXCLUDED.count;
+    END IF;
+    -- Only values removed by the statement can drop to zero; they are looked up by the unique index.
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM {aggregate} WHERE count = 0 AND value IN (SELECT {value} FROM old_rows);
+        DELETE FROM {aggregate} WHERE count = 0 AND value IS NULL;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS {insert_trigger} ON {table};
+DROP TRIGGER IF EXISTS {update_trigger} ON {table};
+DROP TRIGGER IF EXISTS {delete_trigger} ON {table};
+DROP TRIGGER IF EXISTS {truncate_trigger} ON {table};
+CREATE TRIGGER {insert_trigger} AFTER INSERT ON {table}
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION {function}();
+CREATE TRIGGER {update_trigger} AFTER UPDATE ON {table}
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION {function}();
+CREATE TRIGGER {delete_trigger} AFTER DELETE ON {table}
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION {function}();
+CREATE TRIGGER {truncate_trigger} AFTER TRUNCATE ON {table} FOR EACH STATEMENT EXECUTE FUNCTION {function}();
+
+-- Writes are blocked while the summary is filled, so no change falls between the fill and the triggers.
+LOCK TABLE {table} IN SHARE MODE;
+TRUNCATE {aggregate};
+INSERT INTO {aggregate} (value, count) SELECT {value}, count(*) FROM {table} GROUP BY 1;
+"""
+
+DROP_SQL = """
+DROP MATERIALIZED VIEW IF EXISTS {aggregate};
+DROP TRIGGER IF EXISTS {insert_trigger} ON {table};
+DROP TRIGGER IF EXISTS {update_trigger} ON {table};
+DROP TRIGGER IF EXISTS {delete_trigger} ON {table};
+DROP TRIGGER IF EXISTS {truncate_trigger} ON {table};
+DROP FUNCTION IF EXISTS {function}();
+DROP TABLE IF EXISTS {aggregate};
+"""
+
+COLUMN_TYPE_SQL = """
+SELECT format_type(atttypid, atttypmod) FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attname = %s;
+"""
+
+KIND_SQL = """SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);"""
+
+MATERIALIZED_VIEWS_SQL = """SELECT matviewname FROM pg_matviews WHERE matviewname LIKE %s ORDER BY 1;"""
+
+
+def aggregate_name(table_name: str, column: str, bucket: typing.Optional[str] = None) -> str:
+    return f'{table_name}_count_by_{column}' + (f'_{bucket}' if bucket else '')
+
+
+def value_expression(column: str, bucket: typing.Optional[str] = None) -> sql.Composable:
+    """Return the grouping expression, dates are truncated to the bucket."""
+    if bucket is None:
+        return sql.Identifier(column)
+    if bucket not in BUCKETS:
+        raise ValueError(f'Unknown bucket {bucket}, expected one of {BUCKETS}.')
+    return sql.SQL("""date_trunc({}, {})::date""").format(sql.Literal(bucket), sql.Identifier(column))
+
+
+def format_aggregate(
+        q: str,
+        table_name: str,
+        column: str,
+        bucket: typing.Optional[str] = None,
+        **kwargs: sql.Composable,
+) -> sql.Composed:
+    name = aggregate_name(table_name, column, bucket)
+    return sql.SQL(q).format(
+        table=sql.Identifier(table_name),
+        aggregate=sql.Identifier(name),
+        index=sql.Identifier(f'{name}_value_idx'),
+        function=sql.Identifier(f'{name}_maintain'),
+        insert_trigger=sql.Identifier(f'{name}_insert'),
+        update_trigger=sql.Identifier(f'{name}_update'),
+        delete_trigger=sql.Identifier(f'{name}_delete'),
+        truncate_trigger=sql.Identifier(f'{name}_truncate'),
+        value=value_expression(column, bucket),
+        **kwargs,
+    )
+
+
+class RefreshScheduler:
+    """Refresh materialized aggregates of tables every interval seconds on a background thread.
+
+    The table manager should have its own DataBaseClient, because refresh commits its connection.
+    """
+
+    def __init__(self, table_manager: 'TableManager', tables: list, interval: float = 60.0):
+        self.table_manager = table_manager
+        self.tables = tables
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='aggregates-refresh', daemon=True)
+
+    def start(self) -> 'RefreshScheduler':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self) -> 'RefreshScheduler':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            for table in self.tables:
+                try:
+                    self.table_manager.refresh_aggregates(table)
+                except Exception as err:
+                    # A failed refresh keeps serving the previous data, the next run retries.
+                    logger.error(f'Failed to refresh aggregates of {table.table_name}: {err}')
@@ -0,0 +1,109 @@
+"""Benchmark of row decoding modes of the table classes.
+
+Example:
+    python -m common.bench_decode --output bench_decode.json \
+        --dsn "host=localhost port=5432 dbname=test_db user=test_user password=test_password"
+"""
+import argparse
+import json
+import logging
+import time
+import typing
+from dataclasses import asdict, dataclass
+from datetime import date, timedelta
+from pathlib import Path
+
+from psycopg.rows import class_row
+
+from common.db_client import DataBaseClient
+from common.models import Person
+from common.tables import Persons
+
+CREATE_TABLE_SQL = """
+CREATE TEMPORARY TABLE bench_persons (
+    person_id integer PRIMARY KEY,
+    first_name varchar(128) NOT NULL,
+    birthday date NOT NULL
+);
+"""
+
+
+@dataclass
+class Measurement:
+    name: str
+    cpu_us_per_row: float
+    wall_ms_per_call: float
+
+
+def measure(name: str, rows: int, repeat: int, call: typing.Callable[[], typing.Any]) -> Measurement:
+    """Measure client CPU time per row, which is the decoding cost, and wall time of the call."""
+    call()
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    for _ in range(repeat):
+        call()
+    cpu = (time.process_time() - cpu_started) / repeat
+    wall = (time.perf_counter() - wall_started) / repeat
+    measurement = Measurement(name, cpu / rows * 1e6, wall * 1000)
+    print(f'{name:>28}: {measurement.cpu_us_per_row:7.3f} us/row cpu  {measurement.wall_ms_per_call:9.2f} ms/call wall')
+    return measurement
+
+
+def fresh_cursor_get(table: Persons, key: int) -> typing.Optional[Person]:
+    # Baseline of the previous implementation, which created a cursor per call.
+    with table.db_client.connection.cursor(row_factory=class_row(Person)) as cur:
+        return cur.execute("""SELECT * FROM bench_persons WHERE person_id = %s;""", (key,)).fetchone()
+
+
+def run(db_client: DataBaseClient, rows: int, repeat: int, gets: int) -> dict[str, Measurement]:
+    """Measure every decoding mode on a temporary table and return measurements by mode name."""
+    db_client.connection.execute(CREATE_TABLE_SQL)
+    text_table = Persons(db_client, 'bench_persons')
+    binary_table = Persons(db_client, 'bench_persons', binary=True)
+    birthday = date(1950, 1, 1)
+    text_table.insert_many(
+        Person(person_id, f'Person {person_id}', birthday + timedelta(days=person_id % 25_000))
+        for person_id in range(rows)
+    )
+    keys = list(range(rows))
+
+    print(f'bulk read of {rows} rows')
+    measurements = [
+        measure('text, Person objects', rows, repeat, lambda: text_table.select_many(keys)),
+        measure('binary, Person objects', rows, repeat, lambda: binary_table.select_many(keys)),
+        measure('binary, raw tuples', rows, repeat, lambda: binary_table.select_many_raw(keys)),
+    ]
+
+    print(f'{gets} point reads')
+    point_keys = range(gets)
+    measurements.append(
+        measure('fresh cursor per call', gets, 1, lambda: [fresh_cursor_get(text_table, key) for key in point_keys]),
+    )
+    measurements.append(measure('reused cursor', gets, 1, lambda: [text_table.get(key) for key in point_keys]))
+    text_table.close()
+    binary_table.close()
+    db_client.connection.execute("""DROP TABLE bench_persons;""")
+    db_client.connection.commit()
+    return {measurement.name: measurement for measurement in measurements}
+
+
+def main(argv: typing.Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog='python -m common.bench_decode', description=__doc__.splitlines()[0])
+    parser.add_argument('--dsn', required=True, help='Connection info.')
+    parser.add_argument('--rows', type=int, default=100_000, help='Rows selected per bulk read.')
+    parser.add_argument('--repeat', type=int, default=10, help='Bulk reads per mode.')
+    parser.add_argument('--gets', type=int, default=10_000, help='Point reads per cursor mode.')
+    parser.add_argument('--output', type=Path, help='JSON file to record measurements into.')
+    args = parser.parse_args(argv)
+    logging.getLogger('tables').setLevel(logging.WARNING)
+
+    db_client = DataBaseClient(args.dsn)
+    try:
+        measurements = run(db_client, args.rows, args.repeat, args.gets)
+    finally:
+        db_client.close()
+    if args.output:
+        args.output.write_text(json.dumps([asdict(measurement) for measurement in measurements.values()], indent=2))
+
+
+if __name__ == '__main__':
+    main()
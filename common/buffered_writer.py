@@ -0,0 +1,187 @@
+import collections
+import copy
+import threading
+import typing
+from dataclasses import dataclass, field
+
+from common.logger import get_logger
+from common.models import Person, PersonField
+from common.tables import ModelTable
+
+logger = get_logger('buffered_writer')
+
+ErrorCallback = typing.Callable[[BaseException, 'Batch'], None]
+
+
+class BufferFull(Exception):
+    """Raised when the buffer stays full longer than the put timeout."""
+
+
+@dataclass
+class Batch:
+    upserts: list[Person] = field(default_factory=list)
+    updates: dict[tuple[str, ...], list[tuple[int, list]]] = field(default_factory=dict)
+    deletes: list[int] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.upserts) + sum(map(len, self.updates.values())) + len(self.deletes)
+
+
+class BufferedPersonsWriter:
+    """Write-behind buffer which coalesces writes by person_id and flushes them in batches on a background thread.
+
+    Only the last state of every person_id is written: an insert followed by updates becomes one upsert,
+    repeated updates merge their fields, a delete discards the pending writes. Inserts are written as upserts.
+    The table should have its own DataBaseClient, because the writer commits its connection on every flush.
+    At most max_buffer person_ids are held in memory, pending and being flushed together.
+    """
+
+    def __init__(
+            self,
+            table: ModelTable,
+            max_buffer: int = 100_000,
+            flush_size: int = 10_000,
+            flush_interval: float = 1.0,
+            put_timeout: typing.Optional[float] = None,
+            on_error: typing.Optional[ErrorCallback] = None,
+    ):
+        self.table = table
+        self.max_buffer = max_buffer
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.on_error = on_error or self._log_error
+
+        self._buffer: collections.OrderedDict[int, tuple] = collections.OrderedDict()
+        self._condition = threading.Condition()
+        self._submitted = 0
+        self._flushed = 0
+        self._writing = 0
+        self._flush_requested = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='buffered-writer', daemon=True)
+        self._thread.start()
+
+    def insert(self, person: Person) -> None:
+        self._put(person.person_id, lambda pending: ('upsert', person))
+
+    def update(self, person_id: int, person_fields: list[PersonField | str], person_values: list[typing.Any]) -> None:
+        # Unknown fields are rejected here, otherwise they would be dropped or fail the whole flush.
+        changes = dict(zip(self.table.search_columns(person_fields), person_values))
+        if self.table.primary_key in changes:
+            raise ValueError('Buffered writer cannot change primary key, use table.update instead.')
+
+        def merge(pending: typing.Optional[tuple]) -> typing.Optional[tuple]:
+            if pending is None:
+                return 'update', changes
+            if pending[0] == 'upsert':
+                person = copy.copy(pending[1])
+                for name, value in changes.items():
+                    setattr(person, name, value)
+                return 'upsert', person
+            if pending[0] == 'update':
+                return 'update', {**pending[1], **changes}
+            # The row is going to be deleted, update of a deleted row changes nothing.
+            return pending
+
+        self._put(person_id, merge)
+
+    def delete(self, person_id: int) -> None:
+        self._put(person_id, lambda pending: ('delete',))
+
+    def _put(self, person_id: int, merge: typing.Callable[[typing.Optional[tuple]], tuple]) -> None:
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('Buffered writer is closed.')
+            if person_id not in self._buffer and self._size() >= self.max_buffer:
+                self._flush_requested = True
+                self._condition.notify_all()
+                ready = self._condition.wait_for(
+                    lambda: self._size() < self.max_buffer or self._closed, timeout=self.put_timeout,
+                )
+                if self._closed:
+                    raise RuntimeError('Buffered writer is closed.')
+                if not ready:
+                    raise BufferFull(f'Buffer of {self.max_buffer} writes is full.')
+            self._buffer[person_id] = merge(self._buffer.get(person_id))
+            self._submitted += 1
+            if len(self._buffer) >= self.flush_size:
+                self._condition.notify_all()
+
+    def _size(self) -> int:
+        return len(self._buffer) + self._writing
+
+    def flush(self, timeout: typing.Optional[float] = None) -> bool:
+        """Wait until all writes submitted before the call are committed or reported to on_error."""
+        with self._condition:
+            target = self._submitted
+            self._flush_requested = True
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: self._flushed >= target, timeout=timeout)
+
+    def close(self) -> None:
+        """Flush the buffer and stop the background thread."""
+        self.flush()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def __enter__(self) -> 'BufferedPersonsWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._closed or self._flush_requested or len(self._buffer) >= self.flush_size,
+                    timeout=self.flush_interval,
+                )
+                if self._closed and not self._buffer:
+                    return
+                buffer, self._buffer = self._buffer, collections.OrderedDict()
+                target = self._submitted
+                self._writing = len(buffer)
+                self._flush_requested = False
+
+            if buffer:
+                self._write(self._batch(buffer))
+            with self._condition:
+                self._flushed = target
+                self._writing = 0
+                self._condition.notify_all()
+
+    def _batch(self, buffer: dict[int, tuple]) -> Batch:
+        batch = Batch()
+        for person_id, pending in buffer.items():
+            if pending[0] == 'upsert':
+                batch.upserts.append(pending[1])
+            elif pending[0] == 'update':
+                columns = tuple(sorted(pending[1]))
+                values = [pending[1][column] for column in columns]
+                batch.updates.setdefault(columns, []).append((person_id, values))
+            else:
+                batch.deletes.append(person_id)
+        return batch
+
+    def _write(self, batch: Batch) -> None:
+        connection = self.table.db_client.connection
+        try:
+            if batch.deletes:
+                self.table.delete_many(batch.deletes)
+            if batch.upserts:
+                self.table.upsert_many(batch.upserts)
+            for columns, rows in batch.updates.items():
+                self.table.update_many(list(columns), rows)
+            connection.commit()
+        except Exception as err:
+            connection.rollback()
+            self.on_error(err, batch)
+        else:
+            logger.info(f'Flush {len(batch)} writes into {self.table.table_name}.')
+
+    def _log_error(self, error: BaseException, batch: Batch) -> None:
+        logger.error(f'Failed to flush {len(batch)} writes into {self.table.table_name}: {error}')
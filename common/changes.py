@@ -0,0 +1,224 @@
+import asyncio
+import select
+import threading
+import time
+import typing
+from dataclasses import dataclass
+
+import psycopg
+from psycopg import sql
+
+from common.db_client import DataBaseClient
+from common.logger import get_logger
+
+logger = get_logger('changes')
+
+# Seconds between checks of stop and timeout while waiting for notifications.
+POLL_INTERVAL = 0.5
+
+# Log ids are taken from a sequence at insert time, so transactions may commit them out of order.
+# Every change records the id of its transaction instead and notifies it, Postgres delivers one
+# notification per transaction at commit.
+INSTALL_SQL = """
+CREATE TABLE IF NOT EXISTS {log} (
+    log_id bigserial PRIMARY KEY,
+    xid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+    op char(1) NOT NULL,
+    person_id integer NOT NULL,
+    old_person_id integer,
+    changed_at timestamptz NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS {xid_index} ON {log} (xid);
+
+CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO {log} (op, person_id) VALUES ('D', OLD.person_id);
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO {log} (op, person_id, old_person_id) VALUES ('U', NEW.person_id, OLD.person_id);
+    ELSE
+        INSERT INTO {log} (op, person_id) VALUES ('I', NEW.person_id);
+    END IF;
+    PERFORM pg_notify({channel}, pg_current_xact_id()::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS {trigger} ON {table};
+CREATE TRIGGER {trigger} AFTER INSERT OR UPDATE OR DELETE ON {table}
+    FOR EACH ROW EXECUTE FUNCTION {function}();
+"""
+
+# Transactions older than xmin of the statement snapshot have all finished, so none of them can add
+# changes later. The snapshot row is joined, so xmin is returned even if there are no changes.
+REPLAY_SQL = """
+SELECT pg_snapshot_xmin(s.snapshot)::text::bigint, c.log_id, c.op, c.person_id, c.old_person_id, c.xid::text::bigint
+FROM (SELECT pg_current_snapshot() AS snapshot) s
+LEFT JOIN {log} c ON c.xid >= %s::text::xid8 AND c.xid::text::bigint <> ALL(%s::bigint[])
+ORDER BY c.log_id;
+"""
+
+UNINSTALL_SQL = """
+DROP TRIGGER IF EXISTS {trigger} ON {table};
+DROP FUNCTION IF EXISTS {function}();
+DROP TABLE IF EXISTS {log};
+"""
+
+
+@dataclass(frozen=True)
+class Change:
+    log_id: int
+    op: str
+    person_id: int
+    old_person_id: typing.Optional[int] = None
+    xid: int = 0
+
+
+class ChangeFeed:
+    """Push-based feed of row changes of a table.
+
+    Triggers write every change into a log table and notify the id of the changing transaction.
+    The feed is resumed by a transaction id `watermark`, every transaction before it is already consumed,
+    and by `seen` transactions after it, which committed before some older transaction finished.
+    Iteration replays committed changes after the watermark and replays again on every notification.
+    A consumer which stores `watermark` and `seen` resumes without gaps after restart,
+    changes of transactions after the watermark are delivered again if only `watermark` is stored.
+    `Change.log_id` orders changes in the log only and cannot be used to resume.
+
+    Iteration ends after `stop` is called from another thread or when no notification arrives
+    within `timeout` seconds, by default it waits forever.
+    """
+
+    def __init__(
+            self,
+            db_client: DataBaseClient,
+            table_name: str,
+            watermark: int = 0,
+            seen: typing.Iterable[int] = (),
+            timeout: typing.Optional[float] = None,
+    ):
+        self.db_client = db_client
+        self.table_name = table_name
+        self.watermark = watermark
+        self.seen = set(seen)
+        self.timeout = timeout
+        self.channel = f'{table_name}_changes'
+        self._stopped = threading.Event()
+
+    def _format(self, q: str) -> sql.Composed:
+        return sql.SQL(q).format(
+            table=sql.Identifier(self.table_name),
+            log=sql.Identifier(f'{self.table_name}_changes'),
+            xid_index=sql.Identifier(f'{self.table_name}_changes_xid_idx'),
+            function=sql.Identifier(f'{self.table_name}_notify_change'),
+            trigger=sql.Identifier(f'{self.table_name}_notify_change'),
+            channel=sql.Literal(self.channel),
+        )
+
+    def install(self) -> None:
+        """Create the change log table and the notify trigger."""
+        self._execute(INSTALL_SQL)
+        logger.info(f'Install change feed on {self.table_name}.')
+
+    def uninstall(self) -> None:
+        """Drop the notify trigger and the change log table."""
+        self._execute(UNINSTALL_SQL)
+        logger.info(f'Uninstall change feed from {self.table_name}.')
+
+    def prune(self, watermark: int) -> None:
+        """Delete changes of transactions before watermark which all consumers have already processed."""
+        self._execute("""DELETE FROM {log} WHERE xid < %s::text::xid8;""", (watermark,))
+        logger.info(f'Prune {self.table_name} changes before {watermark}.')
+
+    def stop(self) -> None:
+        """End iteration of the feed within POLL_INTERVAL, a stopped feed cannot be iterated again."""
+        self._stopped.set()
+
+    def _execute(self, q: str, params: typing.Optional[tuple] = None) -> None:
+        try:
+            with self.db_client.connection.cursor() as cur:
+                cur.execute(self._format(q), params)
+        except BaseException:
+            self.db_client.connection.rollback()
+            raise
+        else:
+            self.db_client.connection.commit()
+
+    def _pending(self, payload: str) -> bool:
+        # Changes of the notified transaction may be already replayed.
+        xid = int(payload)
+        return xid >= self.watermark and xid not in self.seen
+
+    def _replay(self, rows: list[tuple]) -> typing.Iterator[Change]:
+        """Yield replayed changes, the state is advanced right before the last change of a transaction is yielded."""
+        xmin = rows[0][0]
+        changes = [Change(*row[1:]) for row in rows if row[1] is not None]
+        last = {change.xid: change for change in changes}
+        for change in changes:
+            if last[change.xid] is change:
+                self.seen.add(change.xid)
+            if change is changes[-1]:
+                self._advance(xmin)
+            yield change
+        if not changes:
+            self._advance(xmin)
+
+    def _advance(self, xmin: int) -> None:
+        self.watermark = max(self.watermark, xmin)
+        self.seen = {xid for xid in self.seen if xid >= self.watermark}
+
+    def _deadline(self) -> typing.Optional[float]:
+        return None if self.timeout is None else time.monotonic() + self.timeout
+
+    def _expired(self, deadline: typing.Optional[float]) -> bool:
+        return self._stopped.is_set() or (deadline is not None and time.monotonic() >= deadline)
+
+    def _wait(self, conn: psycopg.Connection, payloads: list[str]) -> bool:
+        """Wait for notification payloads, return False if the feed is stopped or timed out."""
+        deadline = self._deadline()
+        while not payloads:
+            if self._expired(deadline):
+                return False
+            if select.select([conn], [], [], POLL_INTERVAL)[0]:
+                # Any query reads the received notifications and passes them to the notify handler.
+                conn.execute('SELECT 1;')
+        return not self._stopped.is_set()
+
+    def __iter__(self) -> typing.Iterator[Change]:
+        replay = self._format(REPLAY_SQL)
+        payloads: list[str] = []
+        with psycopg.connect(self.db_client.connection_info, autocommit=True) as conn:
+            conn.add_notify_handler(lambda notify: payloads.append(notify.payload))
+            # LISTEN before replaying the log, so no change can fall between them.
+            conn.execute(sql.SQL('LISTEN {};').format(sql.Identifier(self.channel)))
+            yield from self._replay(conn.execute(replay, (self.watermark, list(self.seen))).fetchall())
+            logger.info(f'Listen {self.channel} from watermark {self.watermark}.')
+            while self._wait(conn, payloads):
+                # The replay covers every notification received so far.
+                pending = any(self._pending(payload) for payload in payloads)
+                payloads.clear()
+                if pending:
+                    yield from self._replay(conn.execute(replay, (self.watermark, list(self.seen))).fetchall())
+
+    async def __aiter__(self) -> typing.AsyncIterator[Change]:
+        replay = self._format(REPLAY_SQL)
+        async with await psycopg.AsyncConnection.connect(self.db_client.connection_info, autocommit=True) as conn:
+            await conn.execute(sql.SQL('LISTEN {};').format(sql.Identifier(self.channel)))
+            cur = await conn.execute(replay, (self.watermark, list(self.seen)))
+            for change in self._replay(await cur.fetchall()):
+                yield change
+            logger.info(f'Listen {self.channel} from watermark {self.watermark}.')
+            notifies = conn.notifies()
+            deadline = self._deadline()
+            while not self._expired(deadline):
+                try:
+                    notify = await asyncio.wait_for(notifies.__anext__(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    # The generator is cancelled while waiting on the socket, so no notification is lost.
+                    notifies = conn.notifies()
+                    continue
+                deadline = self._deadline()
+                if self._pending(notify.payload):
+                    cur = await conn.execute(replay, (self.watermark, list(self.seen)))
+                    for change in self._replay(await cur.fetchall()):
+                        yield change
@@ -0,0 +1,335 @@
+"""Vectorized synthetic data generator for Persons/BetterPersons tables.
+
+Rows are generated with NumPy in column batches and encoded straight into binary COPY or csv bytes,
+no Person objects are created. Output is deterministic for the same seed, batch size and settings.
+
+Example:
+    python -m common.datagen --dsn "host=localhost port=5432 dbname=test_db user=test_user password=test_password" \
+        --table better_persons --rows 10000000 --null-rate 0.2
+    python -m common.datagen --table persons --rows 1000000 --output persons.csv
+"""
+import argparse
+import csv
+import io
+import struct
+import time
+import typing
+from dataclasses import MISSING, dataclass, fields
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+from psycopg import sql
+
+from common.db_client import DataBaseClient
+from common.logger import get_logger
+from common.models import BetterPerson, Person
+from common.tables import BetterPersons, ModelTable, Persons
+
+logger = get_logger('datagen')
+
+FORMATS = ('binary', 'csv')
+BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+BINARY_TRAILER = struct.pack('>h', -1)
+BINARY_NULL = struct.pack('>i', -1)
+PG_EPOCH = np.datetime64('2000-01-01', 'D')
+MAX_DIGITS = 19
+# person_id is an integer (int4) column, its binary COPY field is 4 bytes.
+MIN_ID, MAX_ID = -2 ** 31, 2 ** 31 - 1
+
+Batch = dict[str, np.ndarray]
+# Encoded column: byte matrix, length of every matrix row and index of the matrix row for every table row.
+Encoded = tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+@dataclass
+class Vocabulary:
+    """Words of a str field, sampled by weights. Default weights are Zipfian, the first word is the most frequent."""
+
+    words: list[str]
+    weights: typing.Optional[list[float]] = None
+
+    @property
+    def probabilities(self) -> np.ndarray:
+        weights = np.asarray(self.weights, dtype=float) if self.weights else 1 / np.arange(1, len(self.words) + 1)
+        return weights / weights.sum()
+
+
+VOCABULARIES = {
+    'first_name': Vocabulary([
+        'Liu', 'Sonya', 'Johnny', 'Kitana', 'Raiden', 'Scorpion', 'Sub-Zero', 'Jax', 'Kung', 'Mileena',
+        'Shang', 'Jade', 'Kano', 'Sindel', 'Baraka', 'Cassie', 'Jacqui', 'Kotal', 'Erron', 'Shao',
+    ]),
+    'family_name': Vocabulary([
+        'Kang', 'Blade', 'Cage', 'Lao', 'Briggs', 'Hasashi', 'Tsung', 'Kahn', 'Black', 'Takeda',
+    ]),
+    'birthplace': Vocabulary([
+        'Earthrealm', 'Outworld', 'Edenia', 'Netherrealm', 'Chaosrealm', 'Orderrealm', 'Seido', 'Zaterra',
+    ]),
+    'occupation': Vocabulary([
+        'Monk', 'Soldier', 'Actor', 'Assassin', 'Princess', 'Emperor', 'Sorcerer', 'Mercenary', 'Thunder God',
+    ]),
+    'hobby': Vocabulary([
+        'Karate', 'Kung Fu', 'Fans', 'Ice', 'Spears', 'Movies', 'Tea', 'Hats', 'Fatalities', 'Chess, blitz',
+    ]),
+}
+
+
+def _padded(items: list[bytes]) -> tuple[np.ndarray, np.ndarray]:
+    """Return items as rows of a zero padded byte matrix and their lengths."""
+    lengths = np.array([len(item) for item in items], dtype=np.int64)
+    matrix = np.zeros((len(items), max(lengths.max(initial=0), 1)), dtype=np.uint8)
+    for row, item in enumerate(items):
+        matrix[row, :len(item)] = np.frombuffer(item, dtype=np.uint8)
+    return matrix, lengths
+
+
+def _encode_int_binary(values: np.ndarray) -> Encoded:
+    matrix = np.empty((len(values), 8), dtype=np.uint8)
+    matrix[:, :4] = np.frombuffer(struct.pack('>i', 4), dtype=np.uint8)
+    matrix[:, 4:] = values.astype('>i4').view(np.uint8).reshape(-1, 4)
+    return matrix, np.full(len(values), 8, dtype=np.int64), np.arange(len(values))
+
+
+def _encode_int_csv(values: np.ndarray, separator: bytes) -> Encoded:
+    values = values.astype(np.int64)
+    digits = np.ones(len(values), dtype=np.int64)
+    for power in range(1, MAX_DIGITS):
+        digits += values >= 10 ** power
+    matrix = np.zeros((len(values), MAX_DIGITS + 1), dtype=np.uint8)
+    for position in range(int(digits.max(initial=1))):
+        power = digits - 1 - position
+        digit = values // 10 ** np.maximum(power, 0) % 10
+        matrix[:, position] = np.where(power >= 0, ord('0') + digit, 0)
+    matrix[np.arange(len(values)), digits] = ord(separator)
+    return matrix, digits + 1, np.arange(len(values))
+
+
+def _encode_date_csv(values: np.ndarray, separator: bytes) -> Encoded:
+    months = values.astype('datetime64[M]')
+    parts = (
+        (values.astype('datetime64[Y]').astype(np.int64) + 1970, 4),
+        (months.astype(np.int64) % 12 + 1, 2),
+        ((values - months).astype(np.int64) + 1, 2),
+    )
+    matrix = np.empty((len(values), 11), dtype=np.uint8)
+    position = 0
+    for part, width in parts:
+        for power in range(width - 1, -1, -1):
+            matrix[:, position] = ord('0') + part // 10 ** power % 10
+            position += 1
+        matrix[:, position] = ord('-')
+        position += 1
+    matrix[:, 10] = ord(separator)
+    return matrix, np.full(len(values), 11, dtype=np.int64), np.arange(len(values))
+
+
+def _csv_field(word: str) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='').writerow([word])
+    return buffer.getvalue().encode()
+
+
+def _assemble(prefix: bytes, columns: list[Encoded]) -> bytes:
+    """Concatenate encoded columns of every row into one buffer without a Python loop over rows.
+
+    Padded column matrices are stacked side by side and the padding is dropped with a boolean mask.
+    """
+    if not len(columns[0][2]):
+        return b''
+    rows = len(columns[0][2])
+    blocks = [np.broadcast_to(np.frombuffer(prefix, dtype=np.uint8), (rows, len(prefix)))]
+    keep = [np.ones((rows, len(prefix)), dtype=bool)]
+    for matrix, lengths, index in columns:
+        blocks.append(matrix[index])
+        keep.append(np.arange(matrix.shape[1]) < lengths[index][:, None])
+    return np.hstack(blocks)[np.hstack(keep)].tobytes()
+
+
+class PersonsGenerator:
+    """Generator of model rows in column batches.
+
+    person_id is unique and consecutive from start_id, birthday is drawn from a normal distribution of ages,
+    str fields are drawn from weighted vocabularies. Fields with defaults (optional BetterPerson fields)
+    are NULL with null_rate probability, in csv they are empty and get model defaults on import.
+    """
+
+    def __init__(
+            self,
+            model: type[Person] = Person,
+            seed: int = 0,
+            start_id: int = 1,
+            null_rate: float = 0.0,
+            vocabularies: typing.Optional[dict[str, Vocabulary]] = None,
+            age_mean: float = 40.0,
+            age_std: float = 15.0,
+            max_age: float = 100.0,
+            today: date = date(2023, 1, 1),
+    ):
+        self.model = model
+        self.columns = tuple(field.name for field in fields(model))
+        self.primary_key = self.columns[0]
+        self.types = typing.get_type_hints(model)
+        self.optional = {field.name for field in fields(model) if field.default is not MISSING}
+        self.vocabularies = {**VOCABULARIES, **(vocabularies or {})}
+        for name in self.columns[1:]:
+            if self.types[name] is not str and self.types[name] is not date:
+                raise ValueError(f'No generator for {model.__name__}.{name} of type {self.types[name]}.')
+            if self.types[name] is str and name not in self.vocabularies:
+                raise ValueError(f'No vocabulary for {model.__name__}.{name}.')
+        self.rng = np.random.default_rng(seed)
+        self.next_id = start_id
+        self.null_rate = null_rate
+        self.age_mean = age_mean
+        self.age_std = age_std
+        self.max_age = max_age
+        self.today = np.datetime64(today, 'D')
+
+        self._words = {}
+        for name in self.columns:
+            if self.types[name] is str:
+                words = [word.encode() for word in self.vocabularies[name].words]
+                self._words[name] = {
+                    'binary': _padded([struct.pack('>i', len(word)) + word for word in words] + [BINARY_NULL]),
+                    'csv': _padded([_csv_field(word) for word in self.vocabularies[name].words] + [b'']),
+                }
+
+    def _check_ids(self, rows: int) -> None:
+        """Raise ValueError if the next rows ids do not fit into the int4 primary key."""
+        if rows > 0 and (self.next_id < MIN_ID or self.next_id + rows - 1 > MAX_ID):
+            raise ValueError(
+                f'Ids {self.next_id}..{self.next_id + rows - 1} do not fit into integer {self.primary_key} '
+                f'[{MIN_ID}, {MAX_ID}].',
+            )
+
+    def batch(self, size: int) -> Batch:
+        """Return the next size rows as arrays: int64 ids, datetime64 dates, vocabulary indexes for str (-1 is NULL)."""
+        self._check_ids(size)
+        batch = {}
+        for name in self.columns:
+            if name == self.primary_key:
+                batch[name] = np.arange(self.next_id, self.next_id + size, dtype=np.int64)
+            elif self.types[name] is date:
+                ages = np.clip(self.rng.normal(self.age_mean, self.age_std, size), 0, self.max_age)
+                batch[name] = self.today - (ages * 365.25).astype('timedelta64[D]')
+            else:
+                vocabulary = self.vocabularies[name]
+                batch[name] = self.rng.choice(len(vocabulary.words), size, p=vocabulary.probabilities)
+                if name in self.optional and self.null_rate:
+                    batch[name][self.rng.random(size) < self.null_rate] = -1
+        self.next_id += size
+        return batch
+
+    def batches(self, rows: int, batch_size: int = 100_000) -> typing.Iterator[Batch]:
+        for start in range(0, rows, batch_size):
+            yield self.batch(min(batch_size, rows - start))
+
+    def encode(self, batch: Batch, fmt: str = 'binary') -> bytes:
+        """Encode the batch into rows of binary COPY or csv format without header."""
+        if fmt not in FORMATS:
+            raise ValueError(f'Unknown format {fmt}, expected one of {FORMATS}.')
+        columns = []
+        for number, name in enumerate(self.columns):
+            values = batch[name]
+            separator = b'\n' if number == len(self.columns) - 1 else b','
+            if self.types[name] is str:
+                matrix, lengths = self._words[name][fmt]
+                # -1 (NULL) indexes the last matrix row, which is the encoded NULL.
+                columns.append((matrix, lengths, values))
+                if fmt == 'csv':
+                    columns.append(_padded([separator]) + (np.zeros(len(values), dtype=np.int64),))
+            elif fmt == 'binary':
+                if self.types[name] is date:
+                    values = (values - PG_EPOCH).astype(np.int64)
+                columns.append(_encode_int_binary(values))
+            elif self.types[name] is date:
+                columns.append(_encode_date_csv(values, separator))
+            else:
+                columns.append(_encode_int_csv(values, separator))
+        prefix = struct.pack('>h', len(self.columns)) if fmt == 'binary' else b''
+        return _assemble(prefix, columns)
+
+    def header(self, fmt: str = 'binary') -> bytes:
+        return BINARY_HEADER if fmt == 'binary' else f'{",".join(self.columns)}\n'.encode()
+
+    def trailer(self, fmt: str = 'binary') -> bytes:
+        return BINARY_TRAILER if fmt == 'binary' else b''
+
+    def chunks(self, rows: int, fmt: str = 'binary', batch_size: int = 100_000) -> typing.Iterator[bytes]:
+        """Yield a complete binary COPY or csv stream of rows chunk by chunk."""
+        # All ids are checked before the header, so no partial stream is written.
+        self._check_ids(rows)
+        yield self.header(fmt)
+        for batch in self.batches(rows, batch_size):
+            yield self.encode(batch, fmt)
+        yield self.trailer(fmt)
+
+    def write_file(self, path: str | Path, rows: int, fmt: str = 'csv', batch_size: int = 100_000) -> int:
+        """Write rows into a csv file (see `TableManager.import_file`) or a binary COPY file."""
+        with open(path, 'wb') as file:
+            for chunk in self.chunks(rows, fmt, batch_size):
+                file.write(chunk)
+        logger.info(f'Generate {rows} {self.model.__name__} rows into {path}.')
+        return rows
+
+    def copy_into(self, table: ModelTable, rows: int, batch_size: int = 100_000) -> int:
+        """Stream rows into the table via binary COPY FROM STDIN and commit."""
+        if table.model is not self.model:
+            raise ValueError(f'Table {table.table_name} stores {table.model.__name__}, not {self.model.__name__}.')
+        q = """COPY {} ({}) FROM STDIN (FORMAT BINARY);"""
+        query = sql.SQL(q).format(
+            sql.Identifier(table.table_name),
+            sql.SQL(', ').join(map(sql.Identifier, self.columns)),
+        )
+
+        db_client = table.db_client
+        db_client.mark_write()
+        try:
+            with db_client.connection.cursor() as cur:
+                with cur.copy(query) as copy:
+                    for chunk in self.chunks(rows, 'binary', batch_size):
+                        copy.write(chunk)
+        except BaseException as err:
+            logger.error(f'Cannot generate rows into {table.table_name}.')
+            logger.error(err)
+            db_client.connection.rollback()
+            raise
+        else:
+            db_client.connection.commit()
+        logger.info(f'Generate {rows} {self.model.__name__} rows into {table.table_name}.')
+        return rows
+
+
+def parse_args(argv: typing.Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m common.datagen', description=__doc__.splitlines()[0])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--dsn', help='Connection info, rows are copied into the table.')
+    target.add_argument('--output', type=Path, help='File to write rows into.')
+    parser.add_argument('--format', choices=FORMATS, default='csv', help='Output file format.')
+    parser.add_argument('--table', choices=('persons', 'better_persons'), default='persons')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--batch-size', type=int, default=100_000)
+    parser.add_argument('--start-id', type=int, default=1)
+    parser.add_argument('--null-rate', type=float, default=0.0, help='NULL probability of optional fields.')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv: typing.Optional[list[str]] = None) -> None:
+    args = parse_args(argv)
+    model = BetterPerson if args.table == 'better_persons' else Person
+    generator = PersonsGenerator(model, seed=args.seed, start_id=args.start_id, null_rate=args.null_rate)
+    started = time.perf_counter()
+    if args.output:
+        generator.write_file(args.output, args.rows, args.format, args.batch_size)
+    else:
+        db_client = DataBaseClient(args.dsn)
+        table_class = BetterPersons if model is BetterPerson else Persons
+        generator.copy_into(table_class(db_client, args.table), args.rows, args.batch_size)
+        db_client.close()
+    seconds = time.perf_counter() - started
+    print(f'{args.rows} rows in {seconds:.2f}s, {args.rows / seconds:,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
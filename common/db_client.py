@@ -1,30 +1,302 @@
+import contextlib
+import itertools
+import threading
+import time
+import typing
+from dataclasses import dataclass
+
 import psycopg
-from psycopg import Connection, OperationalError
+from psycopg import Connection, Error, OperationalError
+from psycopg.pq import TransactionStatus
 
 from common.logger import get_logger
 
 logger = get_logger('db_client')
 
+REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END;
+"""
+
+# Sets the override or restores the session default, which includes timeouts of connection options.
+TIMEOUT_SETTINGS = ('statement_timeout', 'lock_timeout')
+SETTING_SQL = """SELECT set_config(name, coalesce(%s, reset_val), false) FROM pg_settings WHERE name = %s;"""
+
+
+class DataBaseTimeout(Exception):
+    """Raised when a query exceeds statement_timeout, lock_timeout or the client deadline."""
+
+
+@dataclass
+class Replica:
+    connection_info: str
+    connection: typing.Optional[Connection] = None
+    lag: float = 0.0
+    latency: float = 0.0
+    healthy: bool = False
+    checked_at: float = 0.0
+
 
 class DataBaseClient:
 
-    def __init__(self, connection_info: str):
+    def __init__(
+            self,
+            connection_info: str,
+            replicas: typing.Optional[list[str]] = None,
+            routing: str = 'round_robin',
+            max_lag: float = 5.0,
+            check_interval: float = 1.0,
+            sticky_window: float = 5.0,
+            statement_timeout: typing.Optional[float] = None,
+            lock_timeout: typing.Optional[float] = None,
+            deadline: typing.Optional[float] = None,
+    ):
+        self.statement_timeout = statement_timeout
+        self.lock_timeout = lock_timeout
+        self.deadline = deadline
+        self._deadline_at: typing.Optional[float] = None
+        self._overrides: dict[str, str] = {}
+        # Connections whose settings were made in an open transaction and are lost if it rolls back.
+        self._unsettled: set[Connection] = set()
         self.connection_info = connection_info
         self.connection = self.connect(connection_info)
 
+        if routing not in ('round_robin', 'least_latency'):
+            raise ValueError(f'Unknown routing {routing}, expected round_robin or least_latency.')
+        self.routing = routing
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.sticky_window = sticky_window
+        self.last_write = -sticky_window
+        self.replicas = [Replica(info) for info in replicas or []]
+        self._round_robin = itertools.cycle(range(len(self.replicas)))
+        # New replica connections of the monitor thread and `timeouts` apply overrides under the lock.
+        self._replicas_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._monitor: typing.Optional[threading.Thread] = None
+        if self.replicas:
+            # The first check runs before the client is used, so reads are routed from the start.
+            self._check_replicas()
+            self._monitor = threading.Thread(target=self._monitor_replicas, name='replicas-monitor', daemon=True)
+            self._monitor.start()
+
     def connect(self, connection_info: str) -> Connection:
         """Connect to a database server and return a new `Connection` instance."""
         # TODO: add check for connection errors for outer operations from other classes
         # TODO: add reconnection logic
         try:
-            connect = psycopg.connect(conninfo=self.connection_info)
+            connect = psycopg.connect(conninfo=self.connection_info, options=self.options)
             logger.info(f'Connect to {self.connection_info}.')
             return connect
         except OperationalError:
             logger.error(f'Cannot connect to {connection_info}.')
             raise
 
+    @property
+    def options(self) -> str:
+        """Server options which apply client timeouts (in seconds) to every session."""
+        options = []
+        if self.statement_timeout is not None:
+            options.append(f'-c statement_timeout={int(self.statement_timeout * 1000)}')
+        if self.lock_timeout is not None:
+            options.append(f'-c lock_timeout={int(self.lock_timeout * 1000)}')
+        return ' '.join(options)
+
+    @contextlib.contextmanager
+    def timeouts(
+            self,
+            statement_timeout: typing.Optional[float] = None,
+            lock_timeout: typing.Optional[float] = None,
+            deadline: typing.Optional[float] = None,
+    ) -> typing.Iterator[None]:
+        """Override timeouts (in seconds) for the calls made inside the block.
+
+        Settings are applied to the primary and the replica connections, so they hold for routed reads too.
+        A failed transaction is rolled back when the block exits, so the previous settings can be restored.
+        """
+        settings = {'statement_timeout': statement_timeout, 'lock_timeout': lock_timeout}
+        settings = {name: f'{int(value * 1000)}' for name, value in settings.items() if value is not None}
+        previous = self._overrides
+        with self._replicas_lock:
+            self._overrides = {**previous, **settings}
+            for connection in self._connections():
+                self._apply_overrides(connection, settings)
+
+        previous_deadline_at = self._deadline_at
+        if deadline is not None:
+            deadline_at = time.monotonic() + deadline
+            self._deadline_at = min(deadline_at, previous_deadline_at or deadline_at)
+        try:
+            yield
+        finally:
+            self._deadline_at = previous_deadline_at
+            with self._replicas_lock:
+                self._overrides = previous
+                for connection in self._connections():
+                    # Settings committed on entry survive the failed transaction, so they are always restored.
+                    if connection.info.transaction_status == TransactionStatus.INERROR:
+                        connection.rollback()
+                    self._apply_overrides(connection, settings)
+
+    def _apply_overrides(self, connection: Connection, names: typing.Iterable[str]) -> None:
+        status = connection.info.transaction_status
+        for name in names:
+            connection.execute(SETTING_SQL, (self._overrides.get(name), name))
+        if status == TransactionStatus.IDLE and not connection.autocommit:
+            # An open transaction would route the following reads to the primary.
+            connection.commit()
+        elif status != TransactionStatus.IDLE:
+            self._unsettled.add(connection)
+
+    def _settle_overrides(self) -> None:
+        """Apply current settings again on connections whose transaction with the settings has ended."""
+        for connection in list(self._unsettled):
+            if connection.closed or connection.info.transaction_status == TransactionStatus.IDLE:
+                self._unsettled.discard(connection)
+                if not connection.closed:
+                    self._apply_overrides(connection, TIMEOUT_SETTINGS)
+
+    def _connections(self) -> list[Connection]:
+        """Return the primary and the open replica connections."""
+        connections = [self.connection] + [replica.connection for replica in self.replicas]
+        return [
+            connection for connection in connections
+            if connection is not None and not connection.closed and not connection.broken
+        ]
+
+    @contextlib.contextmanager
+    def cancel_on_deadline(self) -> typing.Iterator[None]:
+        """Cancel running queries if the call outlives the per-call or client deadline."""
+        self._settle_overrides()
+        deadlines = [time.monotonic() + self.deadline] if self.deadline is not None else []
+        if self._deadline_at is not None:
+            deadlines.append(self._deadline_at)
+        if not deadlines:
+            yield
+            return
+
+        remaining = min(deadlines) - time.monotonic()
+        if remaining <= 0:
+            raise DataBaseTimeout('Deadline exceeded before the query was sent.')
+        timer = threading.Timer(remaining, self.cancel)
+        timer.daemon = True
+        timer.start()
+        try:
+            yield
+        finally:
+            timer.cancel()
+
+    def cancel(self) -> None:
+        """Cancel queries running on the primary and replica connections."""
+        logger.warning('Deadline exceeded, cancel running queries.')
+        for connection in self._connections():
+            connection.cancel()
+
+    def mark_write(self) -> None:
+        """Remember the write, so following reads of this session go to the primary."""
+        self.last_write = time.monotonic()
+
+    @property
+    def read_connection(self) -> Connection:
+        """Return a connection for read-only queries.
+
+        Reads go to the primary while it has an open transaction or for sticky_window seconds
+        after the last write (read-your-writes), and when no replica is healthy.
+        Replica health is checked by a background thread, so choosing a connection does not query servers.
+        """
+        self._settle_overrides()
+        if not self.replicas:
+            return self.connection
+        self.discard_broken_replicas()
+        if self.connection.info.transaction_status != TransactionStatus.IDLE:
+            return self.connection
+        if time.monotonic() - self.last_write < self.sticky_window:
+            return self.connection
+
+        replica = self._choose_replica()
+        if replica is None:
+            return self.connection
+        return replica.connection
+
+    def _choose_replica(self) -> typing.Optional[Replica]:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        if self.routing == 'least_latency':
+            return min(healthy, key=lambda replica: replica.latency)
+        for _ in self.replicas:
+            replica = self.replicas[next(self._round_robin)]
+            if replica.healthy:
+                return replica
+
+    def discard_broken_replicas(self) -> bool:
+        """Mark replicas whose connection was lost unhealthy, return True if there were any.
+
+        The monitor thread reconnects them, reads go to other replicas or the primary meanwhile.
+        """
+        discarded = False
+        for replica in self.replicas:
+            if replica.connection is not None and replica.connection.broken:
+                logger.warning(f'Lost connection to replica {replica.connection_info}.')
+                replica.healthy = False
+                replica.connection.close()
+                discarded = True
+        return discarded
+
+    def _monitor_replicas(self) -> None:
+        while not self._closed.wait(self.check_interval):
+            self._check_replicas()
+
+    def _check_replicas(self) -> None:
+        for replica in self.replicas:
+            try:
+                self._check_replica(replica)
+            except Exception as err:
+                # The monitor keeps running, the replica is not used until a check passes.
+                logger.error(f'Cannot check replica {replica.connection_info}: {err}')
+                replica.healthy = False
+
+    def _check_replica(self, replica: Replica) -> None:
+        """Measure replica lag and round trip latency and mark it healthy if lag is acceptable."""
+        replica.checked_at = time.monotonic()
+        try:
+            if replica.connection is None or replica.connection.closed:
+                # Replicas serve only reads, autocommit keeps them from holding snapshots open.
+                connection = psycopg.connect(
+                    conninfo=replica.connection_info,
+                    autocommit=True,
+                    options=self.options,
+                    cursor_factory=self.connection.cursor_factory,
+                )
+                logger.info(f'Connect to replica {replica.connection_info}.')
+                with self._replicas_lock:
+                    # A replica connected inside `timeouts` gets the active overrides.
+                    self._apply_overrides(connection, self._overrides)
+                    replica.connection = connection
+            started = time.perf_counter()
+            replica.lag = float(replica.connection.execute(REPLICA_LAG_SQL).fetchone()[0])
+            replica.latency = time.perf_counter() - started
+        except Error as err:
+            logger.warning(f'Replica {replica.connection_info} is unavailable: {err}')
+            replica.healthy = False
+            if replica.connection is not None and replica.connection.broken:
+                replica.connection.close()
+            return
+
+        replica.healthy = replica.lag <= self.max_lag
+        if not replica.healthy:
+            logger.warning(f'Replica {replica.connection_info} lags {replica.lag:.1f}s behind primary.')
+
     def close(self) -> None:
         """Close database connection."""
+        self._closed.set()
+        if self._monitor is not None:
+            self._monitor.join()
         self.connection.close()
         logger.info(f'Close connection {self.connection_info}.')
+        for replica in self.replicas:
+            if replica.connection is not None:
+                replica.connection.close()
+                logger.info(f'Close connection {replica.connection_info}.')
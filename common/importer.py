@@ -0,0 +1,164 @@
+import csv
+import json
+import typing
+from dataclasses import MISSING, dataclass, fields
+from datetime import date
+from pathlib import Path
+
+from common.logger import get_logger
+from common.models import Person
+
+logger = get_logger('importer')
+
+ProgressCallback = typing.Callable[['ImportReport'], None]
+
+FORMATS = ('csv', 'ndjson', 'parquet')
+
+# varchar(n) and char(n) store n in atttypmod together with the 4 byte length header.
+COLUMN_LENGTHS_SQL = """
+SELECT attname, atttypmod - 4 FROM pg_attribute
+WHERE attrelid = to_regclass(%s) AND atttypid IN ('varchar'::regtype, 'bpchar'::regtype) AND atttypmod > 0;
+"""
+
+# Rows are copied into a staging table first, so a duplicate primary key rejects its row instead of
+# failing the whole COPY. Repeated keys of the file are rejected after their first line, then the rest
+# is inserted and rows which conflict with the table are rejected.
+STAGING_SQL = """
+CREATE TEMPORARY TABLE {staging} (LIKE {table} INCLUDING DEFAULTS, line bigint NOT NULL) ON COMMIT DROP;
+"""
+
+COPY_STAGING_SQL = """COPY {staging} ({columns}, line) FROM STDIN;"""
+
+REJECT_REPEATED_SQL = """
+DELETE FROM {staging} s USING {staging} f WHERE {staged_key} = {first_key} AND s.line > f.line
+RETURNING s.line, {staged_columns};
+"""
+
+INSERT_STAGED_SQL = """
+WITH inserted AS (
+    INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} ON CONFLICT DO NOTHING RETURNING {key}
+)
+DELETE FROM {staging} s WHERE NOT EXISTS (SELECT FROM inserted i WHERE {inserted_key} = {staged_key})
+RETURNING s.line, {staged_columns};
+"""
+
+
+@dataclass
+class ImportReport:
+    read: int = 0
+    copied: int = 0
+    rejected: int = 0
+
+
+class RowRejected(ValueError):
+    """Raised when a raw row cannot be coerced into a model row."""
+
+    def __init__(self, reason: str, row: typing.Any = None):
+        super().__init__(reason)
+        self.row = row
+
+
+def read_rows(path: Path, fmt: str, batch_size: int = 10_000) -> typing.Iterator[tuple[int, dict | RowRejected]]:
+    """Yield line numbers and raw rows from the file one by one without loading it into memory.
+
+    Line numbers are physical lines of csv (the header is line 1) and ndjson files and row numbers of parquet.
+    Broken ndjson lines are yielded as RowRejected, so one line does not fail the whole import.
+    """
+    if fmt == 'csv':
+        with open(path, newline='', encoding='utf-8') as file:
+            reader = csv.DictReader(file)
+            for raw in reader:
+                yield reader.line_num, raw
+    elif fmt == 'ndjson':
+        with open(path, encoding='utf-8') as file:
+            for line_number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    raw = json.loads(line)
+                except json.JSONDecodeError as err:
+                    raw = RowRejected(f'invalid json: {err}', line.rstrip('\n'))
+                yield line_number, raw
+    elif fmt == 'parquet':
+        # pyarrow is heavy and only needed for parquet, so import it on demand.
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            logger.error('Install pyarrow to import parquet files.')
+            raise
+        line_number = 0
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            for raw in batch.to_pylist():
+                line_number += 1
+                yield line_number, raw
+    else:
+        raise ValueError(f'Unknown format {fmt}, expected one of {FORMATS}.')
+
+
+def coerce_value(value: typing.Any, field_type: type) -> typing.Any:
+    """Convert a raw value to the model field type, only strings and integral floats are converted.
+
+    Types are checked exactly, so bool is not an int and a datetime is not a date.
+    """
+    if type(value) is field_type:
+        return value
+    if field_type is date and isinstance(value, str):
+        return date.fromisoformat(value.strip())
+    if field_type is int and type(value) in (str, float):
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError(f'{value!r} is not an integer')
+        return int(value)
+    raise TypeError(f'expected {field_type.__name__}, got {type(value).__name__}')
+
+
+def coerce_row(
+        raw: dict | RowRejected,
+        model: type[Person],
+        limits: typing.Optional[dict[str, int]] = None,
+) -> tuple:
+    """Validate a raw row against the model fields and column length limits and return values in fields order."""
+    if isinstance(raw, RowRejected):
+        raise raw
+    if not isinstance(raw, dict):
+        raise RowRejected(f'expected an object, got {type(raw).__name__}')
+    types = typing.get_type_hints(model)
+    limits = limits or {}
+    row = []
+    for field in fields(model):
+        value = raw.get(field.name)
+        if value is None or value == '':
+            if field.default is MISSING:
+                raise RowRejected(f'{field.name}: missing required value')
+            row.append(field.default)
+            continue
+        try:
+            value = coerce_value(value, types[field.name])
+        except (TypeError, ValueError) as err:
+            raise RowRejected(f'{field.name}: {err}') from err
+        limit = limits.get(field.name)
+        if limit is not None and isinstance(value, str) and len(value) > limit:
+            raise RowRejected(f'{field.name}: {len(value)} characters exceed the limit of {limit}')
+        row.append(value)
+    return tuple(row)
+
+
+def write_rejected(rejected_file: typing.TextIO, line_number: int, reason: str, row: typing.Any) -> None:
+    rejected_file.write(json.dumps({'line': line_number, 'reason': reason, 'row': row}, default=str))
+    rejected_file.write('\n')
+
+
+def validated_rows(
+        rows: typing.Iterable[tuple[int, dict | RowRejected]],
+        model: type[Person],
+        report: ImportReport,
+        rejected_file: typing.TextIO,
+        limits: typing.Optional[dict[str, int]] = None,
+) -> typing.Iterator[tuple[int, tuple]]:
+    """Yield line numbers and coerced rows and write rejected ones with reasons into rejected_file."""
+    for line_number, raw in rows:
+        report.read += 1
+        try:
+            yield line_number, coerce_row(raw, model, limits)
+        except RowRejected as reason:
+            report.rejected += 1
+            write_rejected(rejected_file, line_number, str(reason), raw.row if isinstance(raw, RowRejected) else raw)
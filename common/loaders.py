@@ -0,0 +1,38 @@
+import struct
+from datetime import date
+
+from psycopg.abc import AdaptContext, Buffer
+from psycopg.adapt import Loader
+from psycopg.pq import Format
+
+PG_DATE_EPOCH = date(2000, 1, 1).toordinal()
+unpack_int4 = struct.Struct('!i').unpack
+
+
+class DateOrdinalBinaryLoader(Loader):
+    """Load binary date as proleptic Gregorian ordinal int instead of `date` object."""
+
+    format = Format.BINARY
+
+    def load(self, data: Buffer) -> int:
+        return unpack_int4(data)[0] + PG_DATE_EPOCH
+
+
+class TextBytesLoader(Loader):
+    """Load text as raw utf-8 bytes, decoding is left to the caller who needs the string."""
+
+    def load(self, data: Buffer) -> bytes:
+        return bytes(data)
+
+
+class TextBytesBinaryLoader(TextBytesLoader):
+    format = Format.BINARY
+
+
+def register_raw_loaders(context: AdaptContext) -> None:
+    """Register loaders which skip building `date` and `str` objects on the context (connection or cursor)."""
+    adapters = context.adapters
+    adapters.register_loader('date', DateOrdinalBinaryLoader)
+    for type_name in ('text', 'varchar', 'bpchar'):
+        adapters.register_loader(type_name, TextBytesLoader)
+        adapters.register_loader(type_name, TextBytesBinaryLoader)
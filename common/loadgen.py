@@ -0,0 +1,286 @@
+"""Load generator which replays mixed Persons/BetterPersons workloads.
+
+Example:
+    python -m common.loadgen --dsn "host=localhost port=5432 dbname=test_db user=test_user password=test_password" \
+        --table persons --keys 100000 --prepare --mix select=80,update=15,insert=3,delete=2 \
+        --qps 2000 --concurrency 16 --duration 60
+"""
+import argparse
+import collections
+import itertools
+import logging
+import math
+import queue
+import random
+import threading
+import time
+import typing
+from datetime import date, timedelta
+
+from common.db_client import DataBaseClient
+from common.logger import get_logger
+from common.models import BetterPerson, Person, PersonField
+from common.tables import BetterPersons, ModelTable, Persons
+
+logger = get_logger('loadgen')
+
+TABLES = {'persons': Persons, 'better_persons': BetterPersons}
+OPERATIONS = ('select', 'insert', 'update', 'delete')
+
+
+class Histogram:
+    """Latency histogram with logarithmic buckets, 5% relative precision."""
+
+    base = 1.05
+
+    def __init__(self):
+        self.buckets = collections.Counter()
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.buckets[int(math.log(max(seconds * 1e6, 1), self.base))] += 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: 'Histogram') -> None:
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent: float) -> float:
+        """Return latency in seconds below which percent of records fall."""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.base ** (bucket + 1) / 1e6, self.max)
+        return self.max
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = collections.defaultdict(Histogram)
+        self.errors = collections.Counter()
+        self.dropped = 0
+
+    def record(self, operation: str, seconds: float, error: typing.Optional[BaseException] = None) -> None:
+        with self.lock:
+            self.histograms[operation].record(seconds)
+            if error is not None:
+                self.errors[f'{operation}: {type(error).__name__}'] += 1
+
+    def swap(self) -> 'Stats':
+        """Return collected stats and start collecting from scratch."""
+        with self.lock:
+            stats = Stats()
+            stats.histograms, self.histograms = self.histograms, stats.histograms
+            stats.errors, self.errors = self.errors, stats.errors
+            stats.dropped, self.dropped = self.dropped, 0
+        return stats
+
+    def merge(self, other: 'Stats') -> None:
+        for operation, histogram in other.histograms.items():
+            self.histograms[operation].merge(histogram)
+        self.errors.update(other.errors)
+        self.dropped += other.dropped
+
+    def total(self) -> Histogram:
+        total = Histogram()
+        for histogram in self.histograms.values():
+            total.merge(histogram)
+        return total
+
+
+def key_sampler(distribution: str, keys: int, skew: float, rnd: random.Random) -> typing.Callable[[], int]:
+    """Return a function which draws person_id from 1..keys with uniform or Zipfian distribution."""
+    if distribution == 'uniform':
+        return lambda: rnd.randint(1, keys)
+    cum_weights = list(itertools.accumulate(1 / rank ** skew for rank in range(1, keys + 1)))
+    population = range(1, keys + 1)
+    return lambda: rnd.choices(population, cum_weights=cum_weights)[0]
+
+
+def make_person(model: type[Person], person_id: int, rnd: random.Random) -> Person:
+    birthday = date(1950, 1, 1) + timedelta(days=rnd.randrange(25_000))
+    first_name = f'Person {rnd.randrange(1_000_000)}'
+    if model is BetterPerson:
+        return BetterPerson(person_id, first_name, birthday, 'Earthrealm', 'Loadgen', 'Tester', 'Load')
+    return model(person_id, first_name, birthday)
+
+
+class Worker(threading.Thread):
+    def __init__(self, args: argparse.Namespace, stats: Stats, tasks: typing.Optional[queue.Queue], seed: int):
+        super().__init__(daemon=True)
+        self.args = args
+        self.stats = stats
+        self.tasks = tasks
+        self.rnd = random.Random(seed)
+        self.stop = threading.Event()
+        self.operations, weights = zip(*args.mix.items())
+        self.cum_weights = list(itertools.accumulate(weights))
+        self.next_key = key_sampler(args.distribution, args.keys, args.skew, self.rnd)
+
+    def run(self) -> None:
+        db_client = DataBaseClient(self.args.dsn, self.args.replica, statement_timeout=self.args.statement_timeout)
+        table = TABLES[self.args.table](db_client)
+        try:
+            while not self.stop.is_set():
+                if self.tasks is None:
+                    scheduled = time.perf_counter()
+                else:
+                    try:
+                        scheduled = self.tasks.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                self.execute(table, scheduled)
+        finally:
+            db_client.close()
+
+    def execute(self, table: ModelTable, scheduled: float) -> None:
+        """Run one operation, latency is counted from its scheduled time to account for queueing."""
+        operation = self.rnd.choices(self.operations, cum_weights=self.cum_weights)[0]
+        person = make_person(table.model, self.next_key(), self.rnd)
+        error = None
+        try:
+            if operation == 'select':
+                table.select(person, by=PersonField.person_id)
+            elif operation == 'insert':
+                table.insert(person)
+            elif operation == 'update':
+                table.update(person.person_id, [PersonField.first_name], [person.first_name])
+            else:
+                table.delete_many([person.person_id])
+            table.db_client.connection.commit()
+        except Exception as err:
+            error = err
+            table.db_client.connection.rollback()
+        self.stats.record(operation, time.perf_counter() - scheduled, error)
+
+
+def prepare(args: argparse.Namespace) -> None:
+    """Fill the key space 1..keys with fresh rows."""
+    db_client = DataBaseClient(args.dsn)
+    table = TABLES[args.table](db_client)
+    rnd = random.Random(args.seed)
+    for start in range(1, args.keys + 1, 10_000):
+        ids = range(start, min(start + 10_000, args.keys + 1))
+        table.delete_many(ids)
+        table.insert_many(make_person(table.model, person_id, rnd) for person_id in ids)
+        db_client.connection.commit()
+    logger.info(f'Prepare {args.keys} rows in {args.table}.')
+    db_client.close()
+
+
+def format_stats(stats: Stats, seconds: float) -> str:
+    total = stats.total()
+    return (
+        f'{total.count / seconds:10.1f} ops/s'
+        f'  p50 {total.percentile(50) * 1000:8.2f}ms'
+        f'  p99 {total.percentile(99) * 1000:8.2f}ms'
+        f'  max {total.max * 1000:8.2f}ms'
+        f'  errors {sum(stats.errors.values())}'
+        f'  dropped {stats.dropped}'
+    )
+
+
+def report(stats: Stats, seconds: float) -> None:
+    print(f'\nTotal {format_stats(stats, seconds)}')
+    print(f'{"operation":>10} {"count":>10} {"ops/s":>10} {"p50":>9} {"p90":>9} {"p99":>9} {"p99.9":>9} {"max":>9}')
+    for operation, histogram in sorted(stats.histograms.items()):
+        percentiles = ' '.join(f'{histogram.percentile(p) * 1000:7.2f}ms' for p in (50, 90, 99, 99.9))
+        print(
+            f'{operation:>10} {histogram.count:>10} {histogram.count / seconds:>10.1f}'
+            f' {percentiles} {histogram.max * 1000:7.2f}ms',
+        )
+    for error, count in stats.errors.most_common():
+        print(f'error {error}: {count}')
+
+
+def run(args: argparse.Namespace) -> Stats:
+    stats = Stats()
+    # Open loop: a scheduler issues operations at the target rate regardless of response times.
+    tasks = queue.Queue(maxsize=args.concurrency * 100) if args.qps else None
+    workers = [Worker(args, stats, tasks, args.seed + number) for number in range(args.concurrency)]
+    for worker in workers:
+        worker.start()
+
+    started = time.perf_counter()
+    total = Stats()
+    last_report = started
+    issued = 0
+    while (now := time.perf_counter()) - started < args.duration:
+        if tasks is not None:
+            scheduled = started + issued / args.qps
+            if scheduled <= now:
+                try:
+                    tasks.put_nowait(scheduled)
+                except queue.Full:
+                    with stats.lock:
+                        stats.dropped += 1
+                issued += 1
+                continue
+            time.sleep(min(scheduled - now, 0.01))
+        else:
+            time.sleep(0.01)
+        if now - last_report >= args.interval:
+            interval = stats.swap()
+            total.merge(interval)
+            print(f'[{now - started:6.1f}s] {format_stats(interval, now - last_report)}', flush=True)
+            last_report = now
+
+    for worker in workers:
+        worker.stop.set()
+    for worker in workers:
+        worker.join()
+    total.merge(stats.swap())
+    report(total, time.perf_counter() - started)
+    return total
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    mix = {}
+    for item in value.split(','):
+        operation, _, weight = item.partition('=')
+        if operation not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f'Unknown operation {operation}, expected one of {OPERATIONS}.')
+        mix[operation] = float(weight)
+    return mix
+
+
+def parse_args(argv: typing.Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m common.loadgen', description=__doc__.splitlines()[0])
+    parser.add_argument('--dsn', required=True, help='Primary connection info.')
+    parser.add_argument('--replica', action='append', default=[], help='Replica connection info, can be repeated.')
+    parser.add_argument('--table', choices=TABLES, default='persons')
+    parser.add_argument('--mix', type=parse_mix, default='select=80,update=15,insert=3,delete=2',
+                        help='Operation weights.')
+    parser.add_argument('--keys', type=int, default=100_000, help='Key space size, person_id is in 1..keys.')
+    parser.add_argument('--distribution', choices=('uniform', 'zipf'), default='uniform')
+    parser.add_argument('--skew', type=float, default=1.0, help='Zipfian exponent.')
+    parser.add_argument('--qps', type=float, default=0, help='Open loop target rate, 0 runs closed loop.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Number of connections.')
+    parser.add_argument('--duration', type=float, default=30, help='Run time in seconds.')
+    parser.add_argument('--interval', type=float, default=1, help='Live report interval in seconds.')
+    parser.add_argument('--statement-timeout', type=float, default=None, help='Statement timeout in seconds.')
+    parser.add_argument('--prepare', action='store_true', help='Fill the key space before the run.')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv: typing.Optional[list[str]] = None) -> None:
+    args = parse_args(argv)
+    # Tables log every query, which would dominate the load.
+    logging.getLogger('tables').setLevel(logging.WARNING)
+    logging.getLogger('db_client').setLevel(logging.WARNING)
+    if args.prepare:
+        prepare(args)
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
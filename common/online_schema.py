@@ -0,0 +1,420 @@
+import json
+import threading
+import time
+import typing
+from dataclasses import dataclass
+
+from psycopg import Cursor, sql
+from psycopg.errors import LockNotAvailable
+
+from common.db_client import DataBaseClient
+from common.logger import get_logger
+
+logger = get_logger('online_schema')
+
+STATE_SQL = """
+CREATE TABLE IF NOT EXISTS online_schema_changes (
+    table_name text PRIMARY KEY,
+    shadow_name text NOT NULL,
+    alter_sql text NOT NULL,
+    renames jsonb NOT NULL,
+    position bigint,
+    copied bigint NOT NULL DEFAULT 0
+);
+"""
+
+SHADOW_SQL = """
+CREATE TABLE {shadow} (LIKE {table} INCLUDING ALL);
+ALTER TABLE {shadow} {alter};
+"""
+
+# Every change of the original row is applied to the shadow table in the same transaction.
+TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM {shadow} WHERE {shadow_key} = OLD.{key};
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO {shadow} ({shadow_columns}) VALUES ({new_columns})
+        ON CONFLICT ({shadow_key}) DO UPDATE SET ({shadow_columns}) = ROW({excluded_columns});
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER {trigger} AFTER INSERT OR UPDATE OR DELETE ON {table}
+    FOR EACH ROW EXECUTE FUNCTION {function}();
+"""
+
+# FOR SHARE keeps the batch rows from being changed or deleted until the copy commits,
+# so a concurrent delete cannot be resurrected by the backfill. Rows already written
+# by the trigger are newer than the batch and are not overwritten.
+BACKFILL_SQL = """
+WITH batch AS (
+    SELECT {columns} FROM {table} WHERE {key} > %s ORDER BY {key} LIMIT %s FOR SHARE
+), copied AS (
+    INSERT INTO {shadow} ({shadow_columns}) SELECT {columns} FROM batch ON CONFLICT ({shadow_key}) DO NOTHING
+)
+SELECT max({key}), count(*) FROM batch;
+"""
+
+# LIKE INCLUDING ALL does not copy triggers, so other triggers of the table (change feed, summary
+# aggregates) are created again on the shadow at swap. Their definitions name the table, which
+# refers to the shadow after the rename. They are not created earlier, because the backfill would fire them.
+TRIGGERS_SQL = """
+SELECT tgname, pg_get_triggerdef(oid) FROM pg_trigger
+WHERE tgrelid = to_regclass(%s) AND NOT tgisinternal AND tgname <> %s
+ORDER BY tgname;
+"""
+
+# Views keep referring to the renamed table after the swap and cannot be moved to the shadow.
+VIEWS_SQL = """
+SELECT DISTINCT r.ev_class::regclass::text FROM pg_depend d
+JOIN pg_rewrite r ON r.oid = d.objid
+WHERE d.classid = 'pg_rewrite'::regclass AND d.refobjid = to_regclass(%s) AND r.ev_class <> d.refobjid
+ORDER BY 1;
+"""
+
+# LIKE INCLUDING ALL names the shadow indexes after the shadow table. They are matched with the
+# indexes of the table by their definition after USING and take over their names at swap.
+INDEXES_SQL = """
+SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i
+JOIN pg_class c ON c.oid = i.indexrelid
+WHERE i.indrelid = to_regclass(%s)
+ORDER BY c.relname;
+"""
+
+# Defaults of the shadow columns still call sequences owned by the table (serial columns),
+# so the ownership is moved at swap and the old table can be dropped.
+OWNED_SEQUENCES_SQL = """
+SELECT n.nspname, s.relname, a.attname FROM pg_depend d
+JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+JOIN pg_namespace n ON n.oid = s.relnamespace
+JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+WHERE d.classid = 'pg_class'::regclass AND d.refobjid = to_regclass(%s) AND d.deptype = 'a'
+ORDER BY s.relname;
+"""
+
+SWAP_SQL = """
+DROP TRIGGER {trigger} ON {table};
+DROP FUNCTION {function}();
+ALTER TABLE {table} RENAME TO {old};
+ALTER TABLE {shadow} RENAME TO {table};
+"""
+
+ABORT_SQL = """
+DROP TRIGGER IF EXISTS {trigger} ON {table};
+DROP FUNCTION IF EXISTS {function}();
+DROP TABLE IF EXISTS {shadow};
+"""
+
+ProgressCallback = typing.Callable[['SchemaChangeProgress'], None]
+
+
+class SchemaChangeCancelled(Exception):
+    """Raised by `OnlineSchemaChange.run` when it is cancelled, the change can be resumed later."""
+
+
+@dataclass
+class SchemaChangeProgress:
+    table_name: str
+    copied: int
+    total: int
+    position: typing.Optional[int]
+    rows_per_second: float
+
+    @property
+    def percent(self) -> float:
+        return min(100.0, 100 * self.copied / self.total) if self.total else 100.0
+
+
+class OnlineSchemaChange:
+    """Alter a large table without holding an exclusive lock for the rewrite.
+
+    The change creates a shadow table with the new schema, installs a trigger which mirrors every
+    change of the table into the shadow, backfills existing rows in throttled batches by primary key
+    and finally swaps the table names in one short transaction. The original table is kept
+    as `<table>_old` unless drop_old is set, so the change refuses to start while `<table>_old` exists.
+    Triggers, index names and owned sequences of the table are moved to the new table at swap,
+    indexes of a kept `<table>_old` get the `_old` suffix. Tables with dependent views
+    (like materialized aggregates) are refused, because views cannot be moved.
+
+    Backfill position is committed with every batch into `online_schema_changes`, so a cancelled
+    or interrupted change continues where it stopped when `run` is called again with the same alter.
+    Columns of the shadow table are filled from columns with the same name or from their old name
+    in renames, values are converted by assignment casts.
+    """
+
+    def __init__(
+            self,
+            db_client: DataBaseClient,
+            table_name: str,
+            alter: str,
+            renames: typing.Optional[dict[str, str]] = None,
+            batch_size: int = 10_000,
+            pause: float = 0.05,
+            lock_timeout: float = 2.0,
+            swap_attempts: int = 10,
+            drop_old: bool = False,
+            progress: typing.Optional[ProgressCallback] = None,
+    ):
+        self.db_client = db_client
+        self.table_name = table_name
+        self.alter = alter
+        self.renames = renames or {}
+        self.batch_size = batch_size
+        self.pause = pause
+        self.lock_timeout = lock_timeout
+        self.swap_attempts = swap_attempts
+        self.drop_old = drop_old
+        self.progress = progress
+        self.shadow_name = f'{table_name}_shadow'
+        self._cancelled = threading.Event()
+
+    def _format(self, q: str, **kwargs: sql.Composable) -> sql.Composed:
+        return sql.SQL(q).format(
+            table=sql.Identifier(self.table_name),
+            shadow=sql.Identifier(self.shadow_name),
+            old=sql.Identifier(f'{self.table_name}_old'),
+            function=sql.Identifier(f'{self.table_name}_online_change'),
+            trigger=sql.Identifier(f'{self.table_name}_online_change'),
+            **kwargs,
+        )
+
+    def _execute(self, q: str | sql.Composed, params: typing.Optional[tuple] = None) -> list[tuple]:
+        connection = self.db_client.connection
+        try:
+            with connection.cursor() as cur:
+                cur.execute(q, params)
+                result = cur.fetchall() if cur.description else []
+        except BaseException:
+            connection.rollback()
+            raise
+        connection.commit()
+        return result
+
+    def _columns(self, cur: Cursor, table_name: str) -> list[str]:
+        q = """SELECT column_name FROM information_schema.columns WHERE table_name = %s ORDER BY ordinal_position;"""
+        return [row[0] for row in cur.execute(q, (table_name,)).fetchall()]
+
+    def _primary_key(self, cur: Cursor) -> str:
+        q = """
+        SELECT a.attname FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = to_regclass(%s) AND i.indisprimary;
+        """
+        return cur.execute(q, (sql.Identifier(self.table_name).as_string(cur),)).fetchone()[0]
+
+    def _mapping(self, cur: Cursor) -> dict[str, str]:
+        """Return shadow column for every table column which is copied."""
+        shadow_columns = set(self._columns(cur, self.shadow_name))
+        mapping = {}
+        for column in self._columns(cur, self.table_name):
+            shadow_column = self.renames.get(column, column)
+            if shadow_column in shadow_columns:
+                mapping[column] = shadow_column
+        return mapping
+
+    def _check(self) -> None:
+        old = f'{self.table_name}_old'
+        with self.db_client.connection.cursor() as cur:
+            old_exists = cur.execute("""SELECT to_regclass(%s);""", (sql.Identifier(old).as_string(cur),)).fetchone()
+            views = [row[0] for row in cur.execute(VIEWS_SQL, (sql.Identifier(self.table_name).as_string(cur),))]
+        self.db_client.connection.commit()
+        if old_exists[0] is not None:
+            raise ValueError(f'Table {old} of a previous schema change exists, drop it before the change.')
+        if views:
+            raise ValueError(f'Views {views} depend on {self.table_name}, drop them before the change.')
+
+    def _state(self) -> typing.Optional[tuple]:
+        self._execute(STATE_SQL)
+        q = """SELECT alter_sql, renames, position, copied FROM online_schema_changes WHERE table_name = %s;"""
+        rows = self._execute(q, (self.table_name,))
+        return rows[0] if rows else None
+
+    def start(self) -> None:
+        """Create the shadow table and the sync trigger, or check the saved change if it was started before."""
+        self._check()
+        state = self._state()
+        if state is not None:
+            if (state[0], state[1]) != (self.alter, self.renames):
+                raise ValueError(f'Another schema change of {self.table_name} is in progress: {state[0]}.')
+            logger.info(f'Resume schema change of {self.table_name} from position {state[2]}.')
+            return
+
+        self.db_client.mark_write()
+        connection = self.db_client.connection
+        try:
+            with connection.cursor() as cur:
+                cur.execute(self._format(SHADOW_SQL, alter=sql.SQL(self.alter)))
+                mapping = self._mapping(cur)
+                key = self._primary_key(cur)
+                cur.execute(self._format(
+                    TRIGGER_SQL,
+                    key=sql.Identifier(key),
+                    shadow_key=sql.Identifier(mapping[key]),
+                    shadow_columns=sql.SQL(', ').join(map(sql.Identifier, mapping.values())),
+                    new_columns=sql.SQL(', ').join(sql.SQL('NEW.{}').format(sql.Identifier(c)) for c in mapping),
+                    excluded_columns=sql.SQL(', ').join(
+                        sql.SQL('EXCLUDED.{}').format(sql.Identifier(c)) for c in mapping.values()
+                    ),
+                ))
+                # Backfill starts below the current minimum key, later rows are copied by the trigger.
+                position = cur.execute(self._format('SELECT min({key}) - 1 FROM {table};', key=sql.Identifier(key)))
+                position = position.fetchone()[0]
+                q = """
+                INSERT INTO online_schema_changes (table_name, shadow_name, alter_sql, renames, position)
+                VALUES (%s, %s, %s, %s, %s);
+                """
+                cur.execute(q, (self.table_name, self.shadow_name, self.alter, json.dumps(self.renames), position))
+        except BaseException as err:
+            logger.error(f'Cannot start schema change of {self.table_name}.')
+            logger.error(err)
+            connection.rollback()
+            raise
+        connection.commit()
+        logger.info(f'Start schema change of {self.table_name}: {self.alter}.')
+
+    def backfill(self) -> SchemaChangeProgress:
+        """Copy rows into the shadow table batch by batch until all rows are copied or the change is cancelled."""
+        _, _, position, copied = self._state()
+        with self.db_client.connection.cursor() as cur:
+            mapping = self._mapping(cur)
+            key = self._primary_key(cur)
+            q = """SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s);"""
+            total = max(cur.execute(q, (sql.Identifier(self.table_name).as_string(cur),)).fetchone()[0], 0)
+        self.db_client.connection.commit()
+        query = self._format(
+            BACKFILL_SQL,
+            key=sql.Identifier(key),
+            shadow_key=sql.Identifier(mapping[key]),
+            columns=sql.SQL(', ').join(map(sql.Identifier, mapping)),
+            shadow_columns=sql.SQL(', ').join(map(sql.Identifier, mapping.values())),
+        )
+        save = """UPDATE online_schema_changes SET position = %s, copied = %s WHERE table_name = %s;"""
+
+        started = time.perf_counter()
+        copied_now = 0
+        progress = SchemaChangeProgress(self.table_name, copied, total, position, 0.0)
+        while position is not None and not self._cancelled.is_set():
+            self.db_client.mark_write()
+            connection = self.db_client.connection
+            try:
+                with connection.cursor() as cur:
+                    last, count = cur.execute(query, (position, self.batch_size)).fetchone()
+                    if last is not None:
+                        cur.execute(save, (last, copied + count, self.table_name))
+            except BaseException:
+                connection.rollback()
+                raise
+            connection.commit()
+            if not count:
+                break
+
+            position, copied = last, copied + count
+            copied_now += count
+            progress = SchemaChangeProgress(
+                self.table_name, copied, max(total, copied), position, copied_now / (time.perf_counter() - started),
+            )
+            if self.progress:
+                self.progress(progress)
+            self._throttle()
+        return progress
+
+    def _throttle(self) -> None:
+        """Pause between batches and wait for replicas to catch up, so the backfill does not starve traffic."""
+        self._cancelled.wait(self.pause)
+        for replica in self.db_client.replicas:
+            self.db_client._check_replica(replica)
+            while replica.connection is not None and not replica.healthy and not self._cancelled.is_set():
+                logger.warning(f'Pause schema change of {self.table_name}, replica lags {replica.lag:.1f}s.')
+                self._cancelled.wait(self.db_client.check_interval)
+                self.db_client._check_replica(replica)
+
+    def _indexes(self, cur: Cursor, table_name: str) -> dict[tuple[bool, str], str]:
+        """Return index names by uniqueness and definition without index and table names."""
+        rows = cur.execute(INDEXES_SQL, (sql.Identifier(table_name).as_string(cur),)).fetchall()
+        return {(definition.startswith('CREATE UNIQUE'), definition.split(' USING ', 1)[1]): name
+                for name, definition in rows}
+
+    def _move_sequences(self, cur: Cursor) -> None:
+        old = sql.Identifier(f'{self.table_name}_old').as_string(cur)
+        for schema, name, column in cur.execute(OWNED_SEQUENCES_SQL, (old,)).fetchall():
+            q = 'ALTER SEQUENCE {sequence} OWNED BY {table}.{column};'
+            cur.execute(self._format(q, sequence=sql.Identifier(schema, name), column=sql.Identifier(column)))
+            logger.info(f'Move sequence {name} to the new {self.table_name}.')
+
+    def _rename_indexes(self, cur: Cursor, old_indexes: dict[tuple[bool, str], str]) -> None:
+        """Give the new table indexes the names of the matching indexes of the old table."""
+        new_indexes = self._indexes(cur, self.table_name)
+        for key, name in old_indexes.items():
+            shadow_index = new_indexes.get(key)
+            if shadow_index is None or shadow_index == name:
+                continue
+            rename = sql.SQL('ALTER INDEX {} RENAME TO {};')
+            if not self.drop_old:
+                cur.execute(rename.format(sql.Identifier(name), sql.Identifier(f'{name}_old')))
+            cur.execute(rename.format(sql.Identifier(shadow_index), sql.Identifier(name)))
+            logger.info(f'Rename index {shadow_index} to {name}.')
+
+    def swap(self) -> None:
+        """Rename the shadow table into the table in one short transaction and forget the change."""
+        attempts = 0
+        while True:
+            attempts += 1
+            self.db_client.mark_write()
+            try:
+                with self.db_client.timeouts(lock_timeout=self.lock_timeout):
+                    connection = self.db_client.connection
+                    with connection.cursor() as cur:
+                        cur.execute(self._format('LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE;'))
+                        table = sql.Identifier(self.table_name).as_string(cur)
+                        triggers = cur.execute(TRIGGERS_SQL, (table, f'{self.table_name}_online_change')).fetchall()
+                        old_indexes = self._indexes(cur, self.table_name)
+                        cur.execute(self._format(SWAP_SQL))
+                        for name, definition in triggers:
+                            cur.execute(self._format('DROP TRIGGER {name} ON {old};', name=sql.Identifier(name)))
+                            cur.execute(definition)
+                            logger.info(f'Move trigger {name} to the new {self.table_name}.')
+                        self._move_sequences(cur)
+                        # Names of the dropped indexes are free, kept indexes are renamed out of the way first.
+                        if self.drop_old:
+                            cur.execute(self._format('DROP TABLE {old};'))
+                        self._rename_indexes(cur, old_indexes)
+                        cur.execute("""DELETE FROM online_schema_changes WHERE table_name = %s;""", (self.table_name,))
+                    connection.commit()
+                break
+            except LockNotAvailable:
+                self.db_client.connection.rollback()
+                if attempts >= self.swap_attempts:
+                    logger.error(f'Cannot lock {self.table_name} for swap after {attempts} attempts.')
+                    raise
+                logger.warning(f'Lock timeout on swap of {self.table_name}, retry.')
+                self._cancelled.wait(self.pause)
+            except BaseException:
+                self.db_client.connection.rollback()
+                raise
+        logger.info(f'Swap {self.shadow_name} into {self.table_name}.')
+
+    def run(self) -> SchemaChangeProgress:
+        """Start or resume the change, backfill and swap tables."""
+        self._cancelled.clear()
+        self.start()
+        progress = self.backfill()
+        if self._cancelled.is_set():
+            logger.warning(f'Schema change of {self.table_name} is cancelled at position {progress.position}.')
+            raise SchemaChangeCancelled(f'Schema change of {self.table_name} is cancelled.')
+        self.swap()
+        return progress
+
+    def cancel(self) -> None:
+        """Stop the backfill after the current batch, it can be called from another thread."""
+        self._cancelled.set()
+
+    def abort(self) -> None:
+        """Drop the shadow table and the trigger and forget the change."""
+        self._execute(self._format(ABORT_SQL))
+        self._execute(STATE_SQL)
+        self._execute("""DELETE FROM online_schema_changes WHERE table_name = %s;""", (self.table_name,))
+        logger.info(f'Abort schema change of {self.table_name}.')
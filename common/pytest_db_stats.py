@@ -0,0 +1,219 @@
+"""pytest plugin which counts statements, round trips and database time per test and per fixture.
+
+Enabled in pytest.ini with `-p common.pytest_db_stats`. Every `DataBaseClient` returned by a fixture
+is instrumented. Tests are counted per phase (setup, call and teardown), fixtures are counted
+on their own with their setup and teardown.
+Tests can limit the statements of their call phase with `@pytest.mark.max_queries(n)` or
+the `assert_max_queries` fixture to catch N+1 regressions.
+"""
+import collections
+import contextlib
+import functools
+import json
+import threading
+import time
+import typing
+from dataclasses import asdict, dataclass
+
+import pytest
+from _pytest.config import Config
+from _pytest.config.argparsing import Parser
+from psycopg import Cursor
+
+from common.db_client import DataBaseClient
+
+try:
+    import allure
+except ImportError:
+    allure = None
+
+
+@dataclass
+class QueryStats:
+    statements: int = 0
+    round_trips: int = 0
+    db_time: float = 0.0
+
+    def add(self, other: 'QueryStats') -> None:
+        self.statements += other.statements
+        self.round_trips += other.round_trips
+        self.db_time += other.db_time
+
+    def __str__(self) -> str:
+        return f'{self.db_time:8.3f}s {self.statements:6} statements {self.round_trips:6} round trips'
+
+
+class Recorder:
+    """Adds statements executed by instrumented cursors to every active scope."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.scopes: list[QueryStats] = []
+
+    def record(self, statements: int, round_trips: int, db_time: float) -> None:
+        with self.lock:
+            for scope in self.scopes:
+                scope.add(QueryStats(statements, round_trips, db_time))
+
+    def start(self, stats: QueryStats) -> None:
+        with self.lock:
+            self.scopes.append(stats)
+
+    def stop(self, stats: QueryStats) -> None:
+        with self.lock:
+            # Stats are dataclasses equal by value, so the scope is found by identity.
+            self.scopes = [scope for scope in self.scopes if scope is not stats]
+
+    @contextlib.contextmanager
+    def scope(self, stats: QueryStats) -> typing.Iterator[QueryStats]:
+        self.start(stats)
+        try:
+            yield stats
+        finally:
+            self.stop(stats)
+
+
+RECORDER = Recorder()
+
+
+class StatsCursor(Cursor):
+    def execute(self, query, params=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            RECORDER.record(1, 1, time.perf_counter() - started)
+
+    def executemany(self, query, params_seq, **kwargs):
+        params_seq = list(params_seq)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, params_seq, **kwargs)
+        finally:
+            # executemany is pipelined, all its statements share one round trip.
+            RECORDER.record(len(params_seq), 1, time.perf_counter() - started)
+
+    @contextlib.contextmanager
+    def copy(self, statement, params=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            with super().copy(statement, params, **kwargs) as copy:
+                yield copy
+        finally:
+            RECORDER.record(1, 1, time.perf_counter() - started)
+
+
+def instrument(db_client: DataBaseClient) -> DataBaseClient:
+    """Make connections of the client create cursors which report to the recorder."""
+    db_client.connection.cursor_factory = StatsCursor
+    for replica in db_client.replicas:
+        if replica.connection is not None:
+            replica.connection.cursor_factory = StatsCursor
+    return db_client
+
+
+class DataBaseStatsPlugin:
+    def __init__(self, config: Config):
+        self.config = config
+        self.tests: dict[str, dict[str, QueryStats]] = collections.defaultdict(dict)
+        self.fixtures: dict[str, QueryStats] = collections.defaultdict(QueryStats)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        # Finalizers run in reverse order, so these two enclose the teardown of the fixture registered in setup.
+        teardown = QueryStats()
+        fixturedef.addfinalizer(functools.partial(self._fixture_teardown_done, fixturedef.argname, teardown))
+        with RECORDER.scope(QueryStats()) as stats:
+            outcome = yield
+        fixturedef.addfinalizer(functools.partial(RECORDER.start, teardown))
+        self.fixtures[fixturedef.argname].add(stats)
+        result = outcome.get_result() if outcome.excinfo is None else None
+        if isinstance(result, DataBaseClient):
+            instrument(result)
+
+    def _fixture_teardown_done(self, name: str, stats: QueryStats) -> None:
+        RECORDER.stop(stats)
+        self.fixtures[name].add(stats)
+
+    def _phase(self, item: pytest.Item, phase: str) -> typing.ContextManager[QueryStats]:
+        return RECORDER.scope(self.tests[item.nodeid].setdefault(phase, QueryStats()))
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_setup(self, item):
+        with self._phase(item, 'setup'):
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        with self._phase(item, 'call'):
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_teardown(self, item):
+        with self._phase(item, 'teardown'):
+            yield
+        if allure is not None:
+            # Attached after teardown, so the report has every phase of the test.
+            phases = {phase: asdict(stats) for phase, stats in self.tests[item.nodeid].items()}
+            allure.attach(
+                json.dumps(phases, indent=2), name='database stats', attachment_type=allure.attachment_type.JSON,
+            )
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item, call):
+        outcome = yield
+        report = outcome.get_result()
+        stats = self.tests[item.nodeid].get(call.when)
+        if stats is None:
+            return
+
+        marker = item.get_closest_marker('max_queries')
+        if call.when == 'call' and marker and report.passed and stats.statements > marker.args[0]:
+            report.outcome = 'failed'
+            report.longrepr = f'Test executed {stats.statements} statements, max_queries is {marker.args[0]}.'
+
+    def pytest_terminal_summary(self, terminalreporter):
+        limit = self.config.getoption('--db-durations')
+        if not limit or not self.tests:
+            return
+
+        totals = {}
+        for nodeid, phases in self.tests.items():
+            totals[nodeid] = QueryStats()
+            for stats in phases.values():
+                totals[nodeid].add(stats)
+        terminalreporter.write_sep('=', f'slowest {limit} database tests')
+        for nodeid, stats in sorted(totals.items(), key=lambda item: -item[1].db_time)[:limit]:
+            terminalreporter.write_line(f'{stats} {nodeid}')
+        terminalreporter.write_sep('-', f'slowest {limit} database fixtures (setup and teardown)')
+        for name, stats in sorted(self.fixtures.items(), key=lambda item: -item[1].db_time)[:limit]:
+            if stats.statements:
+                terminalreporter.write_line(f'{stats} {name}')
+
+
+def pytest_addoption(parser: Parser):
+    parser.addoption(
+        '--db-durations',
+        type=int,
+        action='store',
+        default=10,
+        help='Show N slowest database tests and fixtures, 0 disables the summary.',
+    )
+
+
+def pytest_configure(config: Config):
+    config.addinivalue_line('markers', 'max_queries(n): fail the test if its call executes more than n statements.')
+    config.pluginmanager.register(DataBaseStatsPlugin(config), 'db_stats')
+
+
+@pytest.fixture
+def assert_max_queries() -> typing.Callable[[int], typing.ContextManager[QueryStats]]:
+    """Return a context manager which fails if its block executes more than n statements."""
+
+    @contextlib.contextmanager
+    def check(limit: int) -> typing.Iterator[QueryStats]:
+        with RECORDER.scope(QueryStats()) as stats:
+            yield stats
+        assert stats.statements <= limit, f'Block executed {stats.statements} statements, expected at most {limit}.'
+
+    return check
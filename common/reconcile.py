@@ -0,0 +1,247 @@
+"""Checksum based reconciliation of two copies of a model table.
+
+Both sides are split into primary key ranges and the server computes md5 of every range,
+so only hashes travel over the wire. Mismatching ranges are split further and only rows
+of mismatching leaf ranges are loaded and compared with `Person.compare`.
+"""
+import bisect
+import dataclasses
+import hashlib
+import typing
+from dataclasses import MISSING, dataclass, field
+from datetime import date
+from pathlib import Path
+
+from psycopg import sql
+
+from common.importer import RowRejected, coerce_row, read_rows
+from common.logger import get_logger
+from common.models import Person
+from common.tables import ModelTable
+
+logger = get_logger('reconcile')
+
+# Every row is hashed as its text values joined by the unit separator, NULL is \N as in COPY.
+# Chunk hash is md5 of row hashes concatenated in primary key order.
+# Files cannot tell NULL from an empty value, so NULL of a field with a default is compared as the default,
+# the same way `coerce_row` imports empty values.
+SEPARATOR = '\x1f'
+NULL = '\\N'
+
+CHUNKS_SQL = """
+SELECT r.start + ({key}::bigint - r.start) / %s * %s, count(*),
+       md5(string_agg(md5(concat_ws(E'\\x1f', {values})), '' ORDER BY {key}))
+FROM unnest(%s::bigint[]) AS r(start)
+JOIN {table} ON {key} >= r.start AND {key} < r.start + %s
+GROUP BY 1;
+"""
+
+ROWS_SQL = """
+SELECT {columns}
+FROM unnest(%s::bigint[]) AS r(start)
+JOIN {table} ON {key} >= r.start AND {key} < r.start + %s
+ORDER BY {key};
+"""
+
+Chunks = dict[int, tuple[int, str]]
+
+
+def value_text(value: typing.Any) -> str:
+    return NULL if value is None else value.isoformat() if isinstance(value, date) else str(value)
+
+
+def row_digest(row: typing.Iterable[typing.Any]) -> str:
+    """Return md5 of the row which is equal to the one computed by the server."""
+    return hashlib.md5(SEPARATOR.join(map(value_text, row)).encode()).hexdigest()
+
+
+def defaults(model: type[Person]) -> dict[str, typing.Any]:
+    return {f.name: f.default for f in dataclasses.fields(model) if f.default is not MISSING}
+
+
+@dataclass
+class ReconcileReport:
+    chunks: int = 0
+    mismatched_chunks: int = 0
+    missing: list[Person] = field(default_factory=list)
+    extra: list[Person] = field(default_factory=list)
+    different: list[tuple[Person, Person, list[str]]] = field(default_factory=list)
+    # Line numbers and reasons of file rows which cannot be read as the model, they are not compared.
+    errors: list[tuple[int, str]] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not (self.missing or self.extra or self.different or self.errors)
+
+    def __str__(self) -> str:
+        return (
+            f'{self.chunks} chunks compared, {self.mismatched_chunks} mismatched: {len(self.missing)} missing, '
+            f'{len(self.extra)} extra, {len(self.different)} different rows, {len(self.errors)} file errors'
+        )
+
+
+class TableSide:
+    def __init__(self, table: ModelTable):
+        self.table = table
+        self.model = table.model
+        types = typing.get_type_hints(table.model)
+        self.defaults = defaults(table.model)
+        key = sql.Identifier(table.primary_key)
+        values = []
+        for name in table.columns:
+            if types[name] is date:
+                # Date text depends on DateStyle, so it is formatted explicitly.
+                value = sql.SQL("""to_char({}, 'YYYY-MM-DD')""").format(sql.Identifier(name))
+            else:
+                value = sql.SQL('{}::text').format(sql.Identifier(name))
+            null = value_text(self.defaults[name]) if name in self.defaults else NULL
+            values.append(sql.SQL("""coalesce({}, {})""").format(value, sql.Literal(null)))
+
+        table_name = sql.Identifier(table.table_name)
+        self._bounds_sql = sql.SQL("""SELECT min({}), max({}) FROM {};""").format(key, key, table_name)
+        self._chunks_sql = sql.SQL(CHUNKS_SQL).format(key=key, table=table_name, values=sql.SQL(', ').join(values))
+        self._rows_sql = sql.SQL(ROWS_SQL).format(
+            key=key, table=table_name, columns=sql.SQL(', ').join(map(sql.Identifier, table.columns)),
+        )
+
+    def bounds(self) -> tuple[typing.Optional[int], typing.Optional[int]]:
+        return self.table.db_client.read_connection.execute(self._bounds_sql).fetchone()
+
+    def chunks(self, starts: list[int], parent: int, size: int) -> Chunks:
+        """Return count and hash of every non empty chunk of size in the ranges [start, start + parent)."""
+        rows = self.table.db_client.read_connection.execute(self._chunks_sql, (size, size, starts, parent)).fetchall()
+        return {start: (count, digest) for start, count, digest in rows}
+
+    def rows(self, starts: list[int], size: int) -> dict[int, Person]:
+        connection = self.table.db_client.read_connection
+        with connection.cursor(row_factory=self.table.row_factory) as cur:
+            rows = cur.execute(self._rows_sql, (starts, size)).fetchall()
+        return {getattr(row, self.table.primary_key): self._with_defaults(row) for row in rows}
+
+    def _with_defaults(self, row: Person) -> Person:
+        nulls = {name: default for name, default in self.defaults.items() if getattr(row, name) is None}
+        return dataclasses.replace(row, **nulls) if nulls else row
+
+
+class FileSide:
+    """csv/ndjson/parquet file with model rows sorted by primary key.
+
+    The file is streamed once per compared level, only hashes of the requested chunks are kept in memory.
+    Rows which cannot be read as the model are collected into errors and skipped.
+    """
+
+    def __init__(self, path: str | Path, model: type[Person], fmt: str = 'csv'):
+        self.path = Path(path)
+        self.model = model
+        self.fmt = fmt
+        self.errors: dict[int, str] = {}
+
+    def _read(self) -> typing.Iterator[tuple]:
+        """Yield rows in primary key order or raise ValueError if the file is not sorted."""
+        last = None
+        for line_number, raw in read_rows(self.path, self.fmt):
+            try:
+                row = coerce_row(raw, self.model)
+            except RowRejected as reason:
+                self.errors[line_number] = str(reason)
+                continue
+            if last is not None and row[0] <= last:
+                raise ValueError(f'{self.path} line {line_number}: key {row[0]} after {last}, sort the file by key.')
+            last = row[0]
+            yield row
+
+    def bounds(self) -> tuple[typing.Optional[int], typing.Optional[int]]:
+        low = high = None
+        for row in self._read():
+            if low is None:
+                low = row[0]
+            high = row[0]
+        return low, high
+
+    def _requested(self, starts: list[int], parent: int, key: int) -> typing.Optional[int]:
+        """Return start of the requested range with the key or None."""
+        index = bisect.bisect_right(starts, key) - 1
+        return starts[index] if index >= 0 and key < starts[index] + parent else None
+
+    def chunks(self, starts: list[int], parent: int, size: int) -> Chunks:
+        starts = sorted(starts)
+        counts: dict[int, int] = {}
+        hashes: dict[int, typing.Any] = {}
+        for row in self._read():
+            start = self._requested(starts, parent, row[0])
+            if start is None:
+                continue
+            chunk = start + (row[0] - start) // size * size
+            if chunk not in hashes:
+                counts[chunk], hashes[chunk] = 0, hashlib.md5()
+            counts[chunk] += 1
+            hashes[chunk].update(row_digest(row).encode())
+        return {chunk: (counts[chunk], hashes[chunk].hexdigest()) for chunk in hashes}
+
+    def rows(self, starts: list[int], size: int) -> dict[int, Person]:
+        starts = sorted(starts)
+        return {row[0]: self.model(*row) for row in self._read() if self._requested(starts, size, row[0]) is not None}
+
+
+Source = ModelTable | str | Path
+
+
+def reconcile(
+        source: Source,
+        target: Source,
+        leaf_size: int = 1_000,
+        fanout: int = 64,
+        fmt: str = 'csv',
+) -> ReconcileReport:
+    """Compare two tables or a table and a file of the same model and report differences by primary key.
+
+    Ranges of the key space are compared level by level, every level splits mismatching ranges
+    into fanout chunks until chunks have leaf_size keys, then rows of mismatching chunks are compared.
+    """
+    tables = [side for side in (source, target) if isinstance(side, ModelTable)]
+    if not tables:
+        raise ValueError('At least one side of reconciliation has to be a table.')
+    model = tables[0].model
+    sides = [
+        TableSide(side) if isinstance(side, ModelTable) else FileSide(side, model, fmt) for side in (source, target)
+    ]
+    if sides[0].model is not sides[1].model:
+        raise ValueError(f'Cannot reconcile {sides[0].model.__name__} with {sides[1].model.__name__}.')
+
+    report = ReconcileReport()
+    bounds = [bound for side in sides for bound in side.bounds() if bound is not None]
+    # Bounds read the whole file, so every file error is known here.
+    for side in sides:
+        if isinstance(side, FileSide):
+            report.errors = sorted(side.errors.items())
+    if not bounds:
+        return report
+    base, high = min(bounds), max(bounds) + 1
+    size = leaf_size
+    while high - base > size * fanout:
+        size *= fanout
+
+    starts, parent = [base], size * fanout
+    while True:
+        source_chunks, target_chunks = (side.chunks(starts, parent, size) for side in sides)
+        chunks = source_chunks.keys() | target_chunks.keys()
+        report.chunks += len(chunks)
+        starts = sorted(chunk for chunk in chunks if source_chunks.get(chunk) != target_chunks.get(chunk))
+        logger.info(f'Compare {len(chunks)} chunks of {size} keys, {len(starts)} mismatched.')
+        if size == leaf_size or not starts:
+            break
+        parent, size = size, size // fanout
+
+    report.mismatched_chunks = len(starts)
+    if starts:
+        source_rows, target_rows = (side.rows(starts, size) for side in sides)
+        for key in sorted(source_rows.keys() | target_rows.keys()):
+            source_row, target_row = source_rows.get(key), target_rows.get(key)
+            if target_row is None:
+                report.missing.append(source_row)
+            elif source_row is None:
+                report.extra.append(target_row)
+            elif differences := source_row.compare(target_row):
+                report.different.append((source_row, target_row, differences))
+    logger.info(f'Reconcile: {report}.')
+    return report
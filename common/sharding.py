@@ -0,0 +1,235 @@
+import collections
+import heapq
+import itertools
+import operator
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg import sql
+
+from common.db_client import DataBaseClient
+from common.logger import get_logger
+from common.models import Person, PersonField
+from common.tables import Persons
+
+logger = get_logger('sharding')
+
+SLOT_BITS = 10
+SLOTS = 1 << SLOT_BITS
+
+# Multiplicative (Fibonacci) hash which is computed the same way in Python and in SQL,
+# so rebalancing can select the rows of a slot on the server. The slot is taken from the high bits
+# of the 32 bit product, the low bits of a multiplicative hash are poorly mixed.
+HASH_MULTIPLIER = 2654435761
+HASH_MASK = 0xFFFFFFFF
+HASH_SHIFT = 32 - SLOT_BITS
+SLOT_SQL = """((person_id::bigint * {}) & {}) >> {}"""
+
+
+def slot_of(person_id: int) -> int:
+    return ((person_id * HASH_MULTIPLIER) & HASH_MASK) >> HASH_SHIFT
+
+
+class ShardedPersons:
+    """Persons hash-sharded by person_id across several databases.
+
+    person_id is hashed into one of SLOTS slots and `slots` maps each slot to a shard index.
+    The map has to be persisted by the caller when shards are added, see `add_shard`.
+    """
+
+    def __init__(
+            self,
+            db_clients: list[DataBaseClient],
+            table_name: str = 'persons',
+            slots: typing.Optional[list[int]] = None,
+    ):
+        self.table_name = table_name
+        self.shards = [Persons(db_client, table_name) for db_client in db_clients]
+        self.slots = slots or [slot % len(self.shards) for slot in range(SLOTS)]
+        self.executor = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix='shard')
+
+    def shard_for(self, person_id: int) -> Persons:
+        return self.shards[self.slots[slot_of(person_id)]]
+
+    def _fan_out(self, call: typing.Callable[[Persons, list], typing.Any], keys: typing.Iterable) -> list:
+        """Run call for every shard with its part of keys in parallel and return results in shards order."""
+        groups = collections.defaultdict(list)
+        for key in keys:
+            groups[self.slots[slot_of(key)]].append(key)
+        futures = [self.executor.submit(call, self.shards[shard], group) for shard, group in groups.items()]
+        return [future.result() for future in futures]
+
+    def _all_shards(self, call: typing.Callable[[Persons], typing.Any]) -> list:
+        futures = [self.executor.submit(call, shard) for shard in self.shards]
+        return [future.result() for future in futures]
+
+    def select(self, person: Person, *, by: PersonField) -> typing.Optional[Person]:
+        if by is PersonField.person_id:
+            return self.shard_for(person.person_id).select(person, by=by)
+        results = self._all_shards(lambda shard: shard.select(person, by=by))
+        return next((result for result in results if result), None)
+
+    def insert(self, person: Person) -> typing.Optional[Person]:
+        return self.shard_for(person.person_id).insert(person)
+
+    def update(
+            self,
+            person_id: int,
+            person_fields: list[PersonField],
+            person_values: list[typing.Any],
+    ) -> typing.Optional[Person]:
+        shard = self.shard_for(person_id)
+        changes = dict(zip(Persons.search_columns(person_fields), person_values))
+        new_shard = self.shard_for(changes.get(Persons.primary_key, person_id))
+        if new_shard is shard:
+            return shard.update(person_id, person_fields, person_values)
+
+        # The new person_id belongs to another shard, so the row moves there.
+        person = shard.get(person_id)
+        if person is None:
+            return None
+        for name, value in changes.items():
+            setattr(person, name, value)
+        updated_person = new_shard.insert(person)
+        if updated_person is not None:
+            shard.delete_many([person_id])
+        return updated_person
+
+    def delete(self, person: Person, *, by: PersonField) -> typing.Optional[Person | list[Person]]:
+        if by is PersonField.person_id:
+            return self.shard_for(person.person_id).delete(person, by=by)
+        results = []
+        for result in self._all_shards(lambda shard: shard.delete(person, by=by)):
+            results.extend(result if isinstance(result, list) else [result])
+        if len(results) == 1:
+            return results[0]
+        return results
+
+    def select_many(self, person_ids: typing.Iterable[int]) -> list[Person]:
+        results = self._fan_out(lambda shard, keys: shard.select_many(keys), person_ids)
+        return list(heapq.merge(*results, key=operator.attrgetter('person_id')))
+
+    def insert_many(self, persons: typing.Iterable[Person]) -> int:
+        persons = list(persons)
+        by_id = {person.person_id: person for person in persons}
+        if len(by_id) != len(persons):
+            raise ValueError(f'{len(persons) - len(by_id)} duplicate person_ids in batch of {len(persons)} Persons.')
+        persons = by_id
+        results = self._fan_out(lambda shard, keys: shard.insert_many(persons[key] for key in keys), persons)
+        return sum(results)
+
+    def delete_many(self, person_ids: typing.Iterable[int]) -> list[Person]:
+        results = self._fan_out(lambda shard, keys: shard.delete_many(keys), person_ids)
+        return list(heapq.merge(*results, key=operator.attrgetter('person_id')))
+
+    def scan(self, batch_size: int = 10_000) -> typing.Iterator[Person]:
+        """Yield rows of all shards merged in person_id order."""
+        scans = [shard.scan(batch_size) for shard in self.shards]
+        return heapq.merge(*scans, key=operator.attrgetter('person_id'))
+
+    def search(self, text: str, *args, limit: int = 10, **kwargs) -> list[Person]:
+        """Run `Persons.search` on all shards and return the best limit rows of all shards."""
+        results = self._all_shards(lambda shard: shard.search_scored(text, *args, limit=limit, **kwargs))
+        # Shard results are sorted by score, ties are broken by person_id as on a single table.
+        merged = heapq.merge(*results, key=lambda scored: (-scored[0], scored[1].person_id))
+        return [person for _, person in itertools.islice(merged, limit)]
+
+    def commit(self) -> None:
+        """Commit transactions of all shards. It is not atomic across shards."""
+        for shard in self.shards:
+            shard.db_client.connection.commit()
+
+    def rollback(self) -> None:
+        for shard in self.shards:
+            shard.db_client.connection.rollback()
+
+    def add_shard(self, db_client: DataBaseClient) -> list[int]:
+        """Add a shard, move its share of slots from the other shards and return the new slots map."""
+        self.shards.append(Persons(db_client, self.table_name))
+        self.executor.shutdown()
+        self.executor = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix='shard')
+        new_shard = len(self.shards) - 1
+        target = SLOTS // len(self.shards)
+
+        slots_by_shard = collections.defaultdict(list)
+        for slot, shard in enumerate(self.slots):
+            slots_by_shard[shard].append(slot)
+        moving = collections.defaultdict(list)
+        for _ in range(target):
+            # Take a slot from the currently largest shard to keep shards even.
+            source = max(slots_by_shard, key=lambda shard: len(slots_by_shard[shard]))
+            moving[source].append(slots_by_shard[source].pop())
+        for slots in moving.values():
+            self.move_slots(slots, new_shard)
+        logger.info(f'Add shard {new_shard} with {target} slots.')
+        return self.slots
+
+    def move_slot(self, slot: int, target: int) -> int:
+        return self.move_slots([slot], target)
+
+    def move_slots(self, slots: list[int], target: int) -> int:
+        """Move rows of the slots to the target shard and switch the slots, return the number of moved rows.
+
+        Slots of one source shard are moved together, so every source is scanned twice per move:
+        rows are first copied without locks, then the source table is locked against writes,
+        rows are deleted on the source primary and only the rows changed since the copy are applied
+        to the target. The target commits before the source, so an interrupted move leaves duplicates
+        which the next move of the slots overwrites, but never loses rows. Writes routed by an old
+        slots map (other processes or calls already waiting for the lock) still land on the source shard,
+        so writers of other processes have to be stopped or reload the map.
+        """
+        by_source = collections.defaultdict(list)
+        for slot in slots:
+            if self.slots[slot] != target:
+                by_source[self.slots[slot]].append(slot)
+        return sum(self._move_slots(source, slots, target) for source, slots in by_source.items())
+
+    def _move_slots(self, source: int, slots: list[int], target: int) -> int:
+        source_shard, target_shard = self.shards[source], self.shards[target]
+        table = sql.Identifier(self.table_name)
+        slot_sql = sql.SQL(SLOT_SQL).format(HASH_MULTIPLIER, HASH_MASK, HASH_SHIFT)
+        select = sql.SQL("""SELECT * FROM {} WHERE {} = ANY(%s);""").format(table, slot_sql)
+        clear = sql.SQL("""DELETE FROM {} WHERE {} = ANY(%s);""").format(table, slot_sql)
+        lock = sql.SQL("""LOCK TABLE {} IN SHARE ROW EXCLUSIVE MODE;""").format(table)
+        delete = sql.SQL("""DELETE FROM {} WHERE {} = ANY(%s) RETURNING *;""").format(table, slot_sql)
+
+        source_shard.db_client.mark_write()
+        target_shard.db_client.mark_write()
+        connection, target_connection = source_shard.db_client.connection, target_shard.db_client.connection
+        try:
+            with connection.cursor(row_factory=source_shard.row_factory) as cur:
+                copied = {person.person_id: person for person in cur.execute(select, (slots,))}
+            connection.commit()
+            # Rows of the slots on the target are leftovers of an interrupted move.
+            target_connection.execute(clear, (slots,))
+            target_shard.insert_many(copied.values())
+            target_connection.commit()
+
+            with connection.cursor(row_factory=source_shard.row_factory) as cur:
+                cur.execute(lock)
+                persons = cur.execute(delete, (slots,)).fetchall()
+            changed = [person for person in persons if copied.get(person.person_id) != person]
+            removed = copied.keys() - {person.person_id for person in persons}
+            if removed:
+                target_shard.delete_many(removed)
+            if changed:
+                target_shard.upsert_many(changed)
+            target_connection.commit()
+        except BaseException:
+            target_connection.rollback()
+            connection.rollback()
+            raise
+
+        for slot in slots:
+            self.slots[slot] = target
+        connection.commit()
+        logger.info(
+            f'Move {len(slots)} slots with {len(persons)} rows from shard {source} to shard {target}, '
+            f'{len(changed) + len(removed)} rows changed during the copy.',
+        )
+        return len(persons)
+
+    def close(self) -> None:
+        self.executor.shutdown()
+        for shard in self.shards:
+            shard.close()
@@ -0,0 +1,217 @@
+"""Memory-mapped read-only snapshots of model tables.
+
+File layout: magic, header length (u32), JSON header, then 8-byte aligned sections for every column
+in model fields order. int columns are int32 arrays, date columns are int32 ordinals (0 is NULL),
+str columns are a null flags array, int64 offsets array (count + 1) and a utf-8 heap.
+Rows are sorted by the primary key (the first column), so lookups are binary searches.
+"""
+import bisect
+import contextlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import typing
+from array import array
+from dataclasses import fields
+from datetime import date
+from pathlib import Path
+
+from psycopg import sql
+
+from common import models
+from common.logger import get_logger
+from common.models import Person
+from common.tables import ModelTable
+
+logger = get_logger('snapshot')
+
+MAGIC = b'PSNP'
+VERSION = 1
+ALIGNMENT = 8
+PG_TYPES = {int: 'int4', str: 'text', date: 'date'}
+
+
+def _column_types(model: type[Person]) -> dict[str, type]:
+    types = typing.get_type_hints(model)
+    return {name: types[name] for name in (field.name for field in fields(model))}
+
+
+def build_snapshot(table: ModelTable, path: str | Path) -> int:
+    """Dump the table via COPY into a snapshot file, replace the file atomically and return the rows count."""
+    path = Path(path)
+    column_types = _column_types(table.model)
+    fixed = {name: array('i') for name, column_type in column_types.items() if column_type is not str}
+    nulls = {name: bytearray() for name, column_type in column_types.items() if column_type is str}
+    offsets = {name: array('q', [0]) for name in nulls}
+    heaps = {name: tempfile.TemporaryFile(dir=path.parent) for name in nulls}
+
+    q = """COPY (SELECT {} FROM {} ORDER BY {}) TO STDOUT (FORMAT BINARY);"""
+    query = sql.SQL(q).format(
+        sql.SQL(', ').join(map(sql.Identifier, column_types)),
+        sql.Identifier(table.table_name),
+        sql.Identifier(table.primary_key),
+    )
+    count = 0
+    temporary: typing.Optional[str] = None
+    try:
+        with table.db_client.read_connection.cursor() as cur:
+            with cur.copy(query) as copy:
+                copy.set_types([PG_TYPES[column_type] for column_type in column_types.values()])
+                for row in copy.rows():
+                    for name, value in zip(column_types, row):
+                        if name in fixed:
+                            fixed[name].append(value.toordinal() if isinstance(value, date) else value or 0)
+                            continue
+                        nulls[name].append(value is None)
+                        if value is not None:
+                            heaps[name].write(value.encode())
+                        offsets[name].append(heaps[name].tell())
+                    count += 1
+
+        header = {
+            'version': VERSION,
+            'model': table.model.__name__,
+            'table': table.table_name,
+            'count': count,
+            'sections': {},
+        }
+        sections = []
+        for name, column_type in column_types.items():
+            if name in fixed:
+                sections.append((f'{name}', fixed[name].tobytes()))
+            else:
+                heaps[name].seek(0)
+                sections.append((f'{name}.nulls', bytes(nulls[name])))
+                sections.append((f'{name}.offsets', offsets[name].tobytes()))
+                sections.append((f'{name}.heap', heaps[name]))
+
+        # Section offsets depend on header length, so lay them out relative to data start first.
+        position = 0
+        for name, data in sections:
+            length = len(data) if isinstance(data, bytes) else offsets[name.split('.')[0]][-1]
+            header['sections'][name] = [position, length]
+            position += length + -length % ALIGNMENT
+        header_bytes = json.dumps(header).encode()
+        data_start = 8 + len(header_bytes) + -(8 + len(header_bytes)) % ALIGNMENT
+
+        with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f'.{path.name}.', delete=False) as file:
+            temporary = file.name
+            file.write(MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes)
+            for name, data in sections:
+                start = data_start + header['sections'][name][0]
+                file.write(b'\0' * (start - file.tell()))
+                if isinstance(data, bytes):
+                    file.write(data)
+                else:
+                    shutil.copyfileobj(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+        # Readers keep the old file mapped until they refresh, replacing the name is atomic.
+        os.replace(temporary, path)
+        temporary = None
+    finally:
+        for heap in heaps.values():
+            heap.close()
+        # A failed write leaves the previous snapshot in place and no partial file next to it.
+        if temporary is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(temporary)
+    logger.info(f'Build snapshot {path} of {table.table_name} with {count} rows.')
+    return count
+
+
+class SnapshotReader:
+    """Lookups of model objects by primary key in a memory-mapped snapshot.
+
+    The file is mapped read-only and shared, so processes reading the same snapshot share its pages.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._stat = None
+        self._mmap = None
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """Map the snapshot again if the file was replaced since the last refresh."""
+        stat = os.stat(self.path)
+        if self._stat is not None and (stat.st_ino, stat.st_mtime_ns) == (self._stat.st_ino, self._stat.st_mtime_ns):
+            return False
+        with open(self.path, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header_length = struct.unpack_from('<I', mapped, 4)[0]
+        header = json.loads(mapped[8:8 + header_length]) if mapped[:4] == MAGIC else {}
+        if header.get('version') != VERSION:
+            mapped.close()
+            raise ValueError(f'{self.path} is not a snapshot file of version {VERSION}.')
+        data_start = 8 + header_length + -(8 + header_length) % ALIGNMENT
+
+        view = memoryview(mapped)
+        sections = {}
+        for name, (offset, length) in header['sections'].items():
+            section = view[data_start + offset:data_start + offset + length]
+            if name.endswith('.offsets'):
+                section = section.cast('q')
+            elif not name.endswith(('.nulls', '.heap')):
+                section = section.cast('i')
+            sections[name] = section
+
+        # The previous map is not closed explicitly, it is unmapped when no view of it is left.
+        self._mmap, self._view, self._sections = mapped, view, sections
+        self._stat = stat
+        self.model = getattr(models, header['model'])
+        self.table_name = header['table']
+        self.count = header['count']
+        self.column_types = _column_types(self.model)
+        self.primary_key = next(iter(self.column_types))
+        self._keys = sections[self.primary_key]
+        logger.info(f'Map snapshot {self.path} of {self.table_name} with {self.count} rows.')
+        return True
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, key: int) -> bool:
+        return self._index(key) is not None
+
+    def _index(self, key: int) -> typing.Optional[int]:
+        index = bisect.bisect_left(self._keys, key)
+        if index < self.count and self._keys[index] == key:
+            return index
+        return None
+
+    def _row(self, index: int) -> Person:
+        values = {}
+        for name, column_type in self.column_types.items():
+            if column_type is str:
+                if self._sections[f'{name}.nulls'][index]:
+                    values[name] = None
+                    continue
+                offsets = self._sections[f'{name}.offsets']
+                values[name] = bytes(self._sections[f'{name}.heap'][offsets[index]:offsets[index + 1]]).decode()
+            elif column_type is date:
+                ordinal = self._sections[name][index]
+                values[name] = date.fromordinal(ordinal) if ordinal else None
+            else:
+                values[name] = self._sections[name][index]
+        return self.model(**values)
+
+    def get(self, key: int) -> typing.Optional[Person]:
+        index = self._index(key)
+        if index is None:
+            return None
+        return self._row(index)
+
+    def get_many(self, keys: typing.Iterable[int]) -> list[Person]:
+        """Return objects of the keys found in the snapshot, ordered by key."""
+        result = []
+        low = 0
+        for key in sorted(set(keys)):
+            # Keys are sorted, so every search starts where the previous one stopped.
+            low = bisect.bisect_left(self._keys, key, low)
+            if low < self.count and self._keys[low] == key:
+                result.append(self._row(low))
+        return result
@@ -0,0 +1,168 @@
+import math
+import typing
+from dataclasses import dataclass, field
+from datetime import datetime
+
+TABLE_STATS_SQL = """
+SELECT t.n_live_tup, t.n_dead_tup, t.n_mod_since_analyze, t.n_tup_ins, t.n_tup_upd, t.n_tup_hot_upd, t.n_tup_del,
+       t.seq_scan, t.idx_scan, t.last_vacuum, t.last_autovacuum, t.last_analyze, t.last_autoanalyze,
+       io.heap_blks_read, io.heap_blks_hit, io.idx_blks_read, io.idx_blks_hit,
+       pg_relation_size(t.relid), pg_total_relation_size(t.relid)
+FROM pg_stat_user_tables t
+JOIN pg_statio_user_tables io ON io.relid = t.relid
+WHERE t.relid = to_regclass(%s);
+"""
+
+INDEX_STATS_SQL = """
+SELECT i.indexrelname, x.indisunique, i.idx_scan, i.idx_tup_read, i.idx_tup_fetch, pg_relation_size(i.indexrelid),
+       io.idx_blks_read, io.idx_blks_hit
+FROM pg_stat_user_indexes i
+JOIN pg_statio_user_indexes io ON io.indexrelid = i.indexrelid
+JOIN pg_index x ON x.indexrelid = i.indexrelid
+WHERE i.relid = to_regclass(%s)
+ORDER BY i.indexrelname;
+"""
+
+# Inputs of the bloat estimate: pages and tuples from the last vacuum/analyze, average row width
+# from pg_stats and fillfactor. It is an estimate, use pgstattuple for exact numbers.
+BLOAT_SQL = """
+SELECT c.relpages::bigint, greatest(c.reltuples, 0)::bigint, current_setting('block_size')::int,
+       (SELECT coalesce(sum(s.avg_width), 0)::int FROM pg_stats s
+        WHERE s.schemaname = n.nspname AND s.tablename = c.relname),
+       coalesce((SELECT option_value::int FROM pg_options_to_table(c.reloptions) WHERE option_name = 'fillfactor'), 100)
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.oid = to_regclass(%s);
+"""
+
+# Page header, tuple header and item pointer sizes and alignment of a standard build.
+PAGE_HEADER = 24
+TUPLE_HEADER = 24
+ITEM_POINTER = 4
+MAXALIGN = 8
+
+
+def estimate_bloat(pages: int, tuples: int, block_size: int, row_width: int, fillfactor: int) -> int:
+    """Return estimated bytes of the table which are not used by live tuples."""
+    if not pages or not row_width:
+        return 0
+    tuple_size = math.ceil((TUPLE_HEADER + row_width) / MAXALIGN) * MAXALIGN + ITEM_POINTER
+    usable = (block_size - PAGE_HEADER) * fillfactor / 100
+    expected_pages = math.ceil(tuples * tuple_size / usable)
+    return max(pages - expected_pages, 0) * block_size
+
+
+def hit_ratio(read: typing.Optional[int], hit: typing.Optional[int]) -> float:
+    total = (read or 0) + (hit or 0)
+    return (hit or 0) / total if total else 1.0
+
+
+@dataclass
+class IndexStats:
+    name: str
+    unique: bool
+    scans: int
+    tuples_read: int
+    tuples_fetched: int
+    size: int
+    blocks_read: int
+    blocks_hit: int
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        return hit_ratio(self.blocks_read, self.blocks_hit)
+
+
+@dataclass
+class TableStats:
+    table_name: str
+    live_tuples: int
+    dead_tuples: int
+    modified_since_analyze: int
+    inserted: int
+    updated: int
+    hot_updated: int
+    deleted: int
+    seq_scans: int
+    index_scans: typing.Optional[int]
+    last_vacuum: typing.Optional[datetime]
+    last_autovacuum: typing.Optional[datetime]
+    last_analyze: typing.Optional[datetime]
+    last_autoanalyze: typing.Optional[datetime]
+    heap_blocks_read: int
+    heap_blocks_hit: int
+    index_blocks_read: typing.Optional[int]
+    index_blocks_hit: typing.Optional[int]
+    size: int
+    total_size: int
+    bloat: int = 0
+    indexes: list[IndexStats] = field(default_factory=list)
+
+    @property
+    def dead_ratio(self) -> float:
+        total = self.live_tuples + self.dead_tuples
+        return self.dead_tuples / total if total else 0.0
+
+    @property
+    def modified_ratio(self) -> float:
+        if not self.live_tuples:
+            return float(self.modified_since_analyze > 0)
+        return self.modified_since_analyze / self.live_tuples
+
+    @property
+    def bloat_ratio(self) -> float:
+        return self.bloat / self.size if self.size else 0.0
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        return hit_ratio(self.heap_blocks_read, self.heap_blocks_hit)
+
+    @property
+    def analyzed(self) -> bool:
+        return self.last_analyze is not None or self.last_autoanalyze is not None
+
+
+@dataclass
+class TableHealth:
+    stats: TableStats
+    recommendations: list[str] = field(default_factory=list)
+
+    @property
+    def healthy(self) -> bool:
+        return not self.recommendations
+
+
+def recommend(
+        stats: TableStats,
+        max_dead_ratio: float = 0.2,
+        max_modified_ratio: float = 0.1,
+        max_bloat_ratio: float = 0.3,
+        min_size: int = 1024 * 1024,
+) -> TableHealth:
+    """Compare table stats with thresholds and recommend maintenance.
+
+    Bloat and unused indexes are reported only for tables larger than min_size bytes,
+    where the estimate is meaningful and the space is worth reclaiming.
+    """
+    health = TableHealth(stats)
+    if stats.dead_ratio > max_dead_ratio:
+        health.recommendations.append(
+            f'VACUUM: {stats.dead_tuples} dead tuples are {stats.dead_ratio:.0%} of the table.',
+        )
+    if not stats.analyzed and stats.live_tuples:
+        health.recommendations.append('ANALYZE: the table has never been analyzed.')
+    elif stats.modified_ratio > max_modified_ratio:
+        health.recommendations.append(
+            f'ANALYZE: {stats.modified_since_analyze} rows ({stats.modified_ratio:.0%}) changed since last analyze.',
+        )
+    if stats.size >= min_size:
+        if stats.bloat_ratio > max_bloat_ratio:
+            health.recommendations.append(
+                f'VACUUM FULL or pg_repack: about {stats.bloat} bytes ({stats.bloat_ratio:.0%}) are bloat, '
+                f'plain VACUUM makes the space reusable but does not return it.',
+            )
+        for index in stats.indexes:
+            # Unique indexes enforce constraints even when queries do not use them.
+            if not index.scans and not index.unique:
+                health.recommendations.append(f'Index {index.name} of {index.size} bytes is never scanned.')
+    return health
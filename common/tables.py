@@ -1,30 +1,75 @@
+import contextlib
 import functools
+import operator
+import re
 import typing
-from dataclasses import astuple
+import warnings
+from dataclasses import fields
+from pathlib import Path
 
-from psycopg import Cursor, sql
+from psycopg import Connection, Cursor, OperationalError, sql
 from psycopg.abc import Params
-from psycopg.errors import (InFailedSqlTransaction, SyntaxError,
-                            UndefinedColumn, UndefinedObject, UniqueViolation)
-from psycopg.rows import class_row, dict_row
-
-from common.db_client import DataBaseClient
+from psycopg.errors import (InFailedSqlTransaction, LockNotAvailable,
+                            QueryCanceled, SyntaxError, UndefinedColumn,
+                            UndefinedObject, UniqueViolation)
+from psycopg.rows import class_row, dict_row, tuple_row
+
+from common.aggregates import (COLUMN_TYPE_SQL, DROP_SQL, KIND_SQL,
+                               MATERIALIZED_VIEW_SQL, MATERIALIZED_VIEWS_SQL,
+                               SUMMARY_TABLE_SQL, aggregate_name,
+                               format_aggregate, value_expression)
+from common.changes import ChangeFeed
+from common.db_client import DataBaseClient, DataBaseTimeout
+from common.importer import (COLUMN_LENGTHS_SQL, COPY_STAGING_SQL,
+                             INSERT_STAGED_SQL, REJECT_REPEATED_SQL,
+                             STAGING_SQL, ImportReport, ProgressCallback,
+                             read_rows, validated_rows, write_rejected)
+from common.loaders import register_raw_loaders
 from common.logger import get_logger
-from common.models import Person, PersonField
+from common.models import BetterPerson, Person, PersonField
+from common.online_schema import OnlineSchemaChange
+from common.table_stats import (BLOAT_SQL, INDEX_STATS_SQL, TABLE_STATS_SQL,
+                                IndexStats, TableHealth, TableStats,
+                                estimate_bloat, recommend)
 
 logger = get_logger('tables')
 
+# Type names with optional modifiers and array brackets, e.g. `varchar(256)`, `numeric(10, 2)`,
+# `timestamp with time zone`, `integer[]`. Types cannot be passed as parameters or identifiers.
+COLUMN_TYPE = re.compile(
+    r'[a-z_][a-z0-9_]*( [a-z_][a-z0-9_]*)*(\(\d+( ?, ?\d+)?\))?( [a-z_]+)*(\[\d*\])*',
+    re.IGNORECASE,
+)
+
+
+def column_type_sql(column_type: str) -> sql.SQL:
+    """Return the column type as SQL or raise ValueError if it is not a type name."""
+    if not COLUMN_TYPE.fullmatch(column_type):
+        raise ValueError(f'Invalid column type {column_type!r}.')
+    return sql.SQL(column_type)
+
 
 def on_transaction_failed(method: typing.Callable):
     @functools.wraps(method)
     def wrapper(*args, **kwargs):
         try:
-            return method(*args, **kwargs)
+            with args[0].db_client.cancel_on_deadline():
+                return method(*args, **kwargs)
+        except (QueryCanceled, LockNotAvailable) as error:
+            logger.warning(f'Timeout for {method}.')
+            args[0].db_client.connection.rollback()
+            raise DataBaseTimeout(str(error)) from error
         except InFailedSqlTransaction as error:
             logger.warning(f'Transaction failed for {method}.')
             logger.warning(error)
             # TODO: add full check for presence db_client in args
             args[0].db_client.connection.rollback()
+        except OperationalError:
+            # A read routed to a replica which went down is retried on another replica or the primary.
+            if not args[0].db_client.discard_broken_replicas():
+                raise
+            logger.warning(f'Replica failed for {method}, retry.')
+            return wrapper(*args, **kwargs)
 
     return wrapper
 
@@ -84,6 +129,268 @@ class TableManager:
             self.db_client.connection.rollback()
             raise
 
+    @contextlib.contextmanager
+    def _autocommit(self) -> typing.Iterator[None]:
+        # Some statements (CREATE INDEX CONCURRENTLY, VACUUM) cannot run inside a transaction block.
+        self.db_client.connection.commit()
+        self.db_client.connection.autocommit = True
+        try:
+            yield
+        finally:
+            self.db_client.connection.autocommit = False
+
+    def create_search_index(
+            self,
+            table: 'ModelTable',
+            search_fields: typing.Iterable[PersonField | str] = (PersonField.first_name,),
+            concurrently: bool = False,
+    ) -> None:
+        """Create pg_trgm GiST indexes which back `ModelTable.search` on the fields."""
+        with self._autocommit() if concurrently else contextlib.nullcontext():
+            try:
+                with self.db_client.connection.cursor() as cursor:
+                    cursor.execute("""CREATE EXTENSION IF NOT EXISTS pg_trgm;""")
+                    for column in table.search_columns(search_fields):
+                        # GiST, unlike GIN, returns rows ordered by distance, so search does not rank every match.
+                        q = """CREATE INDEX {} IF NOT EXISTS {} ON {} USING gist ({} gist_trgm_ops);"""
+                        query = sql.SQL(q).format(
+                            sql.SQL('CONCURRENTLY' if concurrently else ''),
+                            sql.Identifier(f'{table.table_name}_{column}_trgm_idx'),
+                            sql.Identifier(table.table_name),
+                            sql.Identifier(column),
+                        )
+                        cursor.execute(query)
+                        logger.info(f'Create trigram index on {table.table_name}.{column}.')
+            except BaseException as err:
+                logger.error(f'Cannot create search index on {table.table_name}.')
+                logger.error(err)
+                self.db_client.connection.rollback()
+                raise
+            else:
+                self.db_client.connection.commit()
+
+    def delete_search_index(
+            self,
+            table: 'ModelTable',
+            search_fields: typing.Iterable[PersonField | str] = (PersonField.first_name,),
+    ) -> None:
+        """Drop pg_trgm indexes of the fields."""
+        try:
+            with self.db_client.connection.cursor() as cursor:
+                for column in table.search_columns(search_fields):
+                    q = """DROP INDEX IF EXISTS {};"""
+                    cursor.execute(sql.SQL(q).format(sql.Identifier(f'{table.table_name}_{column}_trgm_idx')))
+                    logger.info(f'Delete trigram index on {table.table_name}.{column}.')
+        except BaseException as err:
+            logger.error(f'Cannot delete search index on {table.table_name}.')
+            logger.error(err)
+            self.db_client.connection.rollback()
+            raise
+        else:
+            self.db_client.connection.commit()
+
+    def stats(self, table: 'ModelTable') -> TableStats:
+        """Return activity, IO, size and estimated bloat of the table and usage of its indexes."""
+        name = sql.Identifier(table.table_name).as_string(self.db_client.connection)
+        try:
+            with self.db_client.connection.cursor() as cursor:
+                # Statistics are cached for the transaction, so read a fresh snapshot.
+                cursor.execute("""SELECT pg_stat_clear_snapshot();""")
+                row = cursor.execute(TABLE_STATS_SQL, (name,)).fetchone()
+                if row is None:
+                    raise ValueError(f'No statistics for table {table.table_name}.')
+                stats = TableStats(table.table_name, *row)
+                stats.indexes = [IndexStats(*index) for index in cursor.execute(INDEX_STATS_SQL, (name,)).fetchall()]
+                stats.bloat = estimate_bloat(*cursor.execute(BLOAT_SQL, (name,)).fetchone())
+        except BaseException as err:
+            logger.error(f'Cannot get stats of {table.table_name}.')
+            logger.error(err)
+            self.db_client.connection.rollback()
+            raise
+        else:
+            self.db_client.connection.commit()
+        return stats
+
+    def health(self, table: 'ModelTable', **thresholds: typing.Any) -> TableHealth:
+        """Check table stats against thresholds (see `recommend`) and return maintenance recommendations."""
+        health = recommend(self.stats(table), **thresholds)
+        for recommendation in health.recommendations:
+            logger.warning(f'{table.table_name}: {recommendation}')
+        return health
+
+    def analyze(self, table: 'ModelTable') -> None:
+        """Update planner statistics of the table."""
+        try:
+            with self.db_client.connection.cursor() as cursor:
+                cursor.execute(sql.SQL("""ANALYZE {};""").format(sql.Identifier(table.table_name)))
+        except BaseException as err:
+            logger.error(f'Cannot analyze {table.table_name}.')
+            logger.error(err)
+            self.db_client.connection.rollback()
+            raise
+        else:
+            self.db_client.connection.commit()
+            logger.info(f'Analyze {table.table_name}.')
+
+    def vacuum(self, table: 'ModelTable', analyze: bool = True, full: bool = False) -> None:
+        """Vacuum the table. FULL rewrites it under an exclusive lock and returns bloat to the OS."""
+        options = [sql.SQL(option) for option, enabled in (('FULL', full), ('ANALYZE', analyze)) if enabled]
+        q = """VACUUM {} {};"""
+        query = sql.SQL(q).format(
+            sql.SQL('({})').format(sql.SQL(', ').join(options)) if options else sql.SQL(''),
+            sql.Identifier(table.table_name),
+        )
+        with self._autocommit():
+            try:
+                with self.db_client.connection.cursor() as cursor:
+                    cursor.execute(query)
+            except BaseException as err:
+                logger.error(f'Cannot vacuum {table.table_name}.')
+                logger.error(err)
+                raise
+        logger.info(f'Vacuum {table.table_name}{" full" if full else ""}.')
+
+    def create_aggregate(
+            self,
+            table: 'ModelTable',
+            by: PersonField | str,
+            bucket: typing.Optional[str] = None,
+            incremental: bool = False,
+    ) -> None:
+        """Create the aggregate which backs `ModelTable.count_by`.
+
+        By default it is a materialized view, which is refreshed by `refresh_aggregates`.
+        Incremental aggregates are summary tables kept up to date by triggers, they are always current
+        but add a little work to every write. Incremental aggregates need PostgreSQL 15.
+        """
+        column = table.search_columns([by])[0]
+        try:
+            with self.db_client.connection.cursor() as cursor:
+                if incremental:
+                    name = sql.Identifier(table.table_name).as_string(cursor)
+                    column_type = 'date' if bucket else cursor.execute(COLUMN_TYPE_SQL, (name, column)).fetchone()[0]
+                    q = format_aggregate(SUMMARY_TABLE_SQL, table.table_name, column, bucket, type=sql.SQL(column_type))
+                    cursor.execute(q)
+                else:
+                    cursor.execute(format_aggregate(MATERIALIZED_VIEW_SQL, table.table_name, column, bucket))
+        except BaseException as err:
+            logger.error(f'Cannot create aggregate {aggregate_name(table.table_name, column, bucket)}.')
+            logger.error(err)
+            self.db_client.connection.rollback()
+            raise
+        else:
+            self.db_client.connection.commit()
+            logger.info(f'Create aggregate {aggregate_name(table.table_name, column, bucket)}.')
+
+    def delete_aggregate(self, table: 'ModelTable', by: PersonField | str, bucket: typing.Optional[str] = None) -> None:
+        column = table.search_columns([by])[0]
+        try:
+            with self.db_client.connection.cursor() as cursor:
+                cursor.execute(format_aggregate(DROP_SQL, table.table_name, column, bucket))
+        except BaseException as err:
+            logger.error(f'Cannot delete aggregate {aggregate_name(table.table_name, column, bucket)}.')
+            logger.error(err)
+            self.db_client.connection.rollback()
+            raise
+        else:
+            self.db_client.connection.commit()
+            logger.info(f'Delete aggregate {aggregate_name(table.table_name, column, bucket)}.')
+
+    def refresh_aggregates(self, table: 'ModelTable', concurrently: bool = True) -> list[str]:
+        """Refresh materialized aggregates of the table and return their names.
+
+        CONCURRENTLY keeps the views readable during the refresh, every view is committed separately.
+        """
+        pattern = aggregate_name(table.table_name, '').replace('_', '\\_') + '%'
+        views = [row[0] for row in self.db_client.connection.execute(MATERIALIZED_VIEWS_SQL, (pattern,)).fetchall()]
+        for view in views:
+            q = """REFRESH MATERIALIZED VIEW {} {};"""
+            query = sql.SQL(q).format(sql.SQL('CONCURRENTLY' if concurrently else ''), sql.Identifier(view))
+            try:
+                with self.db_client.connection.cursor() as cursor:
+                    cursor.execute(query)
+            except BaseException as err:
+                logger.error(f'Cannot refresh aggregate {view}.')
+                logger.error(err)
+                self.db_client.connection.rollback()
+                raise
+            else:
+                self.db_client.connection.commit()
+                logger.info(f'Refresh aggregate {view}.')
+        self.db_client.connection.commit()
+        return views
+
+    def import_file(
+            self,
+            table: 'ModelTable',
+            path: str | Path,
+            fmt: str = 'csv',
+            rejected_path: typing.Optional[str | Path] = None,
+            progress: typing.Optional[ProgressCallback] = None,
+            progress_every: int = 100_000,
+    ) -> ImportReport:
+        """Stream rows from a csv/ndjson/parquet file into the table via COPY FROM STDIN.
+
+        Rows with a primary key repeated in the file or already in the table are rejected like invalid rows.
+        """
+        path = Path(path)
+        rejected_path = Path(rejected_path) if rejected_path else path.with_name(f'{path.name}.rejected.ndjson')
+        staging = sql.Identifier(f'{table.table_name}_import')
+
+        def format_staging(q: str) -> sql.Composed:
+            return sql.SQL(q).format(
+                table=sql.Identifier(table.table_name),
+                staging=staging,
+                columns=sql.SQL(', ').join(map(sql.Identifier, table.columns)),
+                staged_columns=sql.SQL(', ').join(sql.Identifier('s', column) for column in table.columns),
+                key=sql.Identifier(table.primary_key),
+                staged_key=sql.Identifier('s', table.primary_key),
+                first_key=sql.Identifier('f', table.primary_key),
+                inserted_key=sql.Identifier('i', table.primary_key),
+            )
+
+        self.db_client.mark_write()
+        report = ImportReport()
+        next_progress = progress_every
+        try:
+            with open(rejected_path, 'w', encoding='utf-8') as rejected_file, \
+                    self.db_client.connection.cursor() as cur:
+                name = sql.Identifier(table.table_name).as_string(cur)
+                # Too long strings are rejected per row, otherwise they would fail the whole COPY.
+                limits = dict(cur.execute(COLUMN_LENGTHS_SQL, (name,)).fetchall())
+                cur.execute(format_staging(STAGING_SQL))
+                with cur.copy(format_staging(COPY_STAGING_SQL)) as copy:
+                    rows = validated_rows(read_rows(path, fmt), table.model, report, rejected_file, limits)
+                    for line_number, row in rows:
+                        copy.write_row((*row, line_number))
+                        report.copied += 1
+                        if progress and report.read >= next_progress:
+                            progress(report)
+                            next_progress += progress_every
+                # Temporary tables are not analyzed automatically, the joins below need row estimates.
+                cur.execute(sql.SQL('ANALYZE {};').format(staging))
+                repeated = cur.execute(format_staging(REJECT_REPEATED_SQL)).fetchall()
+                existing = cur.execute(format_staging(INSERT_STAGED_SQL)).fetchall()
+                duplicates = [(line_number, 'file', row) for line_number, *row in repeated]
+                duplicates.extend((line_number, 'table', row) for line_number, *row in existing)
+                for line_number, where, row in sorted(duplicates):
+                    reason = f'{table.primary_key}: duplicate key {row[0]} in {where}'
+                    write_rejected(rejected_file, line_number, reason, dict(zip(table.columns, row)))
+                report.copied -= len(duplicates)
+                report.rejected += len(duplicates)
+        except BaseException as err:
+            logger.error(f'Cannot import {path} into {table.table_name}.')
+            logger.error(err)
+            self.db_client.connection.rollback()
+            raise
+        else:
+            self.db_client.connection.commit()
+
+        if progress:
+            progress(report)
+        logger.info(f'Import {path} into {table.table_name}: {report}.')
+        return report
+
 
 class Table:
     # TODO: is Table abstract class which provides interfaces?
@@ -93,83 +400,402 @@ class Table:
         self.db_client = db_client
 
 
-class Persons(Table):
-    def __init__(self, db_client: DataBaseClient):
+T = typing.TypeVar('T', bound=Person)
+
+
+class ModelTable(Table, typing.Generic[T]):
+    """Table mapped to a dataclass model.
+
+    Columns, primary key (the first model field), row factory and params getter are derived
+    from the model once at class creation, queries are compiled once per table name.
+    """
+    model: type[T]
+    columns: tuple[str, ...]
+    primary_key: str
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for base in cls.__dict__.get('__orig_bases__', ()):
+            if typing.get_origin(base) is ModelTable:
+                cls.model = typing.get_args(base)[0]
+        if 'model' not in cls.__dict__:
+            return
+        cls.columns = tuple(field.name for field in fields(cls.model))
+        cls.primary_key = cls.columns[0]
+        cls.row_factory = staticmethod(class_row(cls.model))
+        cls.get_params = staticmethod(operator.attrgetter(*cls.columns))
+
+    def __init__(self, db_client: DataBaseClient, table_name: str, binary: bool = False):
         super().__init__(db_client)
-        self.table_name = 'persons'
+        self.binary = binary
+        self._cursors: dict[tuple[int, bool], Cursor] = {}
+        self.table_name = table_name
+
+    @property
+    def table_name(self) -> str:
+        return self._table_name
+
+    @table_name.setter
+    def table_name(self, name: str) -> None:
+        self._table_name = name
+        self._compile()
+
+    def _compile(self) -> None:
+        table = sql.Identifier(self.table_name)
+        columns = sql.SQL(', ').join(map(sql.Identifier, self.columns))
+        placeholders = sql.SQL(', ').join(sql.Placeholder() * len(self.columns))
+        primary_key = sql.Identifier(self.primary_key)
+
+        def render(q: str, *args: sql.Composable) -> str:
+            return sql.SQL(q).format(*args).as_string(self.db_client.connection)
+
+        self._insert_sql = render("""INSERT INTO {} ({}) VALUES ({}) RETURNING *;""", table, columns, placeholders)
+        self._copy_sql = render("""COPY {} ({}) FROM STDIN;""", table, columns)
+        self._get_many_sql = render(
+            """SELECT * FROM {} WHERE {} = ANY(%s) ORDER BY {};""", table, primary_key, primary_key,
+        )
+        self._get_many_raw_sql = render(
+            """SELECT {} FROM {} WHERE {} = ANY(%s) ORDER BY {};""", columns, table, primary_key, primary_key,
+        )
+        self._delete_many_sql = render("""DELETE FROM {} WHERE {} = ANY(%s) RETURNING *;""", table, primary_key)
+        self._scan_first_sql = render("""SELECT * FROM {} ORDER BY {} LIMIT %s;""", table, primary_key)
+        self._scan_sql = render(
+            """SELECT * FROM {} WHERE {} > %s ORDER BY {} LIMIT %s;""", table, primary_key, primary_key,
+        )
+        staging = sql.Identifier(f'{self.table_name}_staging')
+        self._staging_sql = render(
+            """CREATE TEMPORARY TABLE IF NOT EXISTS {} (LIKE {} INCLUDING DEFAULTS); TRUNCATE {};""",
+            staging, table, staging,
+        )
+        self._copy_staging_sql = render("""COPY {} ({}) FROM STDIN;""", staging, columns)
+        self._upsert_sql = render(
+            """INSERT INTO {} ({}) SELECT {} FROM {} ON CONFLICT ({}) DO UPDATE SET {};""",
+            table, columns, columns, staging, primary_key,
+            sql.SQL(', ').join(
+                sql.SQL('{} = EXCLUDED.{}').format(sql.Identifier(column), sql.Identifier(column))
+                for column in self.columns
+            ),
+        )
+        self._select_sql = {
+            column: render("""SELECT * FROM {} WHERE {} = %s;""", table, sql.Identifier(column))
+            for column in self.columns
+        }
+        self._delete_sql = {
+            column: render("""DELETE FROM {} WHERE {} = %s RETURNING *;""", table, sql.Identifier(column))
+            for column in self.columns
+        }
+        self._update_sql = {}
+        self._search_sql = {}
+
+    def _cursor(self, connection: Connection, raw: bool = False) -> Cursor:
+        """Return a cursor of the connection which is reused across calls.
+
+        Raw cursors return tuples with dates as ordinals and strings as undecoded bytes.
+        Cursors of closed connections are dropped when a cursor is created, see also `close`.
+        """
+        key = (id(connection), raw)
+        cursor = self._cursors.get(key)
+        if cursor is None or cursor.closed or cursor.connection is not connection:
+            self._prune_cursors()
+            if raw:
+                cursor = connection.cursor(row_factory=tuple_row)
+                register_raw_loaders(cursor)
+            else:
+                cursor = connection.cursor(row_factory=self.row_factory)
+            self._cursors[key] = cursor
+        return cursor
+
+    def _prune_cursors(self) -> None:
+        for key, cursor in list(self._cursors.items()):
+            if cursor.closed or cursor.connection.closed:
+                cursor.close()
+                del self._cursors[key]
+
+    def close(self) -> None:
+        """Close the cached cursors, the table can be used again and creates new ones."""
+        for cursor in self._cursors.values():
+            cursor.close()
+        self._cursors.clear()
+
+    @classmethod
+    def search_columns(cls, search_fields: typing.Iterable[PersonField | str]) -> tuple[str, ...]:
+        """Return column names of the fields, which may be given as PersonField or str."""
+        columns = tuple(getattr(field, 'name', field) for field in search_fields)
+        unknown = set(columns) - set(cls.columns)
+        if unknown:
+            raise ValueError(f'{cls.model.__name__} has no fields {sorted(unknown)}.')
+        return columns
+
+    def _search_query(self, mode: str, columns: tuple[str, ...]) -> str:
+        # Search queries are compiled lazily, once for each mode and set of columns.
+        key = (mode, columns)
+        if key not in self._search_sql:
+            if mode == 'prefix':
+                match = sql.SQL('{} ILIKE %(pattern)s')
+            elif mode == 'similar':
+                match = sql.SQL('{} %% %(text)s')
+            else:
+                raise ValueError(f'Unknown search mode {mode}, expected prefix or similar.')
+            # Every column takes its nearest limit matches by kNN order of its GiST index,
+            # candidates of all columns are ranked by their best distance.
+            candidates = """
+                (SELECT {}, {} <-> %(text)s AS distance FROM {} WHERE {} ORDER BY distance LIMIT %(limit)s)
+            """
+            q = """
+            SELECT {columns}, 1 - distance FROM (
+                SELECT DISTINCT ON ({key}) {columns}, distance FROM ({candidates}) c ORDER BY {key}, distance
+            ) best ORDER BY distance, {key} LIMIT %(limit)s;
+            """
+            table_columns = sql.SQL(', ').join(map(sql.Identifier, self.columns))
+            query = sql.SQL(q).format(
+                columns=table_columns,
+                key=sql.Identifier(self.primary_key),
+                candidates=sql.SQL(' UNION ALL ').join(
+                    sql.SQL(candidates).format(
+                        table_columns,
+                        sql.Identifier(column),
+                        sql.Identifier(self.table_name),
+                        match.format(sql.Identifier(column)),
+                    )
+                    for column in columns
+                ),
+            )
+            self._search_sql[key] = query.as_string(self.db_client.connection)
+        return self._search_sql[key]
+
+    def _update_query(self, columns: tuple[str, ...]) -> str:
+        # Updates are compiled lazily, once for each set of updated columns.
+        if columns not in self._update_sql:
+            q = """UPDATE {} SET {} WHERE {} = %s RETURNING *;"""
+            assignments = sql.SQL(', ').join(
+                sql.SQL('{} = {}').format(sql.Identifier(column), sql.Placeholder()) for column in columns
+            )
+            query = sql.SQL(q).format(sql.Identifier(self.table_name), assignments, sql.Identifier(self.primary_key))
+            self._update_sql[columns] = query.as_string(self.db_client.connection)
+        return self._update_sql[columns]
 
     @on_transaction_failed
-    def select(self, person: Person, *, by: PersonField) -> typing.Optional[Person]:
-        q = """SELECT * FROM {} WHERE {} = {value};"""
-        query = sql.SQL(q).format(
-            sql.Identifier(self.table_name),
-            sql.Identifier(by.name),
-            value=getattr(person, by.name),
-        )
+    def get(self, key: typing.Any) -> typing.Optional[T]:
+        cur = self._cursor(self.db_client.read_connection)
+        result = cur.execute(self._select_sql[self.primary_key], (key,), binary=self.binary).fetchone()
+        logger.info(f'Get {self.model.__name__} by {self.primary_key}: {key}.')
+        return result
 
-        with self.db_client.connection.cursor(row_factory=class_row(person.__class__)) as cur:
-            result = cur.execute(query).fetchone()
-        logger.info(f'Select {person} by {by.name}.')
+    @on_transaction_failed
+    def select(self, obj: T, *, by: PersonField | str) -> typing.Optional[T]:
+        column, = self.search_columns([by])
+        cur = self._cursor(self.db_client.read_connection)
+        result = cur.execute(self._select_sql[column], (getattr(obj, column),), binary=self.binary).fetchone()
+        logger.info(f'Select {obj} by {column}.')
         return result
 
     @on_transaction_failed
-    def insert(self, person: Person) -> typing.Optional[Person]:
-        q = """INSERT INTO {} VALUES (%s, %s, %s) RETURNING *;"""
-        params = astuple(person)
-        query = sql.SQL(q).format(
-            sql.Identifier(self.table_name),
-        )
+    def select_many(self, keys: typing.Iterable[typing.Any]) -> list[T]:
+        keys = list(keys)
+        cur = self._cursor(self.db_client.read_connection)
+        result = cur.execute(self._get_many_sql, (keys,), binary=self.binary).fetchall()
+        logger.info(f'Select {len(result)} of {len(keys)} rows from {self.table_name}.')
+        return result
+
+    def scan(self, batch_size: int = 10_000, after: typing.Optional[typing.Any] = None) -> typing.Iterator[T]:
+        """Yield all rows ordered by primary key, fetching them in pages of batch_size."""
+        cur = self._cursor(self.db_client.read_connection)
+        while True:
+            if after is None:
+                rows = cur.execute(self._scan_first_sql, (batch_size,), binary=self.binary).fetchall()
+            else:
+                rows = cur.execute(self._scan_sql, (after, batch_size), binary=self.binary).fetchall()
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            after = getattr(rows[-1], self.primary_key)
+
+    @on_transaction_failed
+    def select_many_raw(self, keys: typing.Iterable[typing.Any]) -> list[tuple]:
+        """Select rows as tuples in columns order without building model objects.
+
+        Dates are loaded as ordinals and strings as utf-8 bytes, which is the cheapest decoding
+        for callers which need only ids or pass values through.
+        """
+        keys = list(keys)
+        cur = self._cursor(self.db_client.read_connection, raw=True)
+        result = cur.execute(self._get_many_raw_sql, (keys,), binary=True).fetchall()
+        logger.info(f'Select {len(result)} of {len(keys)} raw rows from {self.table_name}.')
+        return result
+
+    def search(
+            self,
+            text: str,
+            fields: typing.Iterable[PersonField | str] = (PersonField.first_name,),
+            limit: int = 10,
+            mode: str = 'prefix',
+    ) -> list[T]:
+        """Find rows whose fields start with text (prefix) or are similar to it (similar), best matches first.
+
+        Both modes are served by pg_trgm GiST indexes, see `TableManager.create_search_index`.
+        """
+        return [row for _, row in self.search_scored(text, fields, limit, mode)]
+
+    @on_transaction_failed
+    def search_scored(
+            self,
+            text: str,
+            fields: typing.Iterable[PersonField | str] = (PersonField.first_name,),
+            limit: int = 10,
+            mode: str = 'prefix',
+    ) -> list[tuple[float, T]]:
+        """Same as `search`, but every row comes with its trigram similarity to text."""
+        columns = self.search_columns(fields)
+        pattern = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        params = {'text': text, 'pattern': pattern, 'limit': limit}
+        with self.db_client.read_connection.cursor(row_factory=tuple_row) as cur:
+            rows = cur.execute(self._search_query(mode, columns), params, binary=self.binary).fetchall()
+        logger.info(f'Search {text!r} in {list(columns)} of {self.table_name}: {len(rows)} rows.')
+        return [(row[-1], self.model(*row[:-1])) for row in rows]
+
+    @on_transaction_failed
+    def count_by(self, by: PersonField | str, bucket: typing.Optional[str] = None) -> dict[typing.Any, int]:
+        """Return row counts grouped by the column, dates can be truncated to a bucket: year, month or day.
+
+        Counts are read from the aggregate created by `TableManager.create_aggregate` if it exists,
+        otherwise they are computed by a full scan of the table.
+        """
+        column = self.search_columns([by])[0]
+        name = aggregate_name(self.table_name, column, bucket)
+        connection = self.db_client.read_connection
+        with connection.cursor(row_factory=tuple_row) as cur:
+            if cur.execute(KIND_SQL, (sql.Identifier(name).as_string(cur),)).fetchone():
+                q = """SELECT value, count FROM {} ORDER BY value;"""
+                query = sql.SQL(q).format(sql.Identifier(name))
+            else:
+                logger.warning(f'No aggregate {name}, count rows of {self.table_name}.')
+                q = """SELECT {}, count(*) FROM {} GROUP BY 1 ORDER BY 1;"""
+                query = sql.SQL(q).format(value_expression(column, bucket), sql.Identifier(self.table_name))
+            result = dict(cur.execute(query).fetchall())
+        logger.info(f'Count {self.table_name} by {column}: {len(result)} values.')
+        return result
+
+    @on_transaction_failed
+    def insert(self, obj: T) -> typing.Optional[T]:
+        self.db_client.mark_write()
         try:
-            with self.db_client.connection.cursor(row_factory=class_row(person.__class__)) as cur:
-                res = cur.execute(query, params).fetchone()
-                logger.info(f'INSERT {person} INTO {self.table_name}.')
-                return res
+            cur = self._cursor(self.db_client.connection)
+            res = cur.execute(self._insert_sql, self.get_params(obj), binary=self.binary).fetchone()
+            logger.info(f'INSERT {obj} INTO {self.table_name}.')
+            return res
         except UniqueViolation:
-            logger.warning(f'Failed to insert {person}!')
+            logger.warning(f'Failed to insert {obj}!')
             self.db_client.connection.rollback()
 
     @on_transaction_failed
-    def update(
+    def insert_many(self, objs: typing.Iterable[T]) -> int:
+        """Insert objects via COPY and return the number of inserted rows."""
+        self.db_client.mark_write()
+        count = 0
+        try:
+            with self.db_client.connection.cursor() as cur:
+                with cur.copy(self._copy_sql) as copy:
+                    for obj in objs:
+                        copy.write_row(self.get_params(obj))
+                        count += 1
+        except BaseException as err:
+            logger.error(f'Failed to insert batch into {self.table_name}!')
+            logger.error(err)
+            self.db_client.connection.rollback()
+            raise
+        logger.info(f'INSERT {count} rows INTO {self.table_name}.')
+        return count
+
+    @on_transaction_failed
+    def upsert_many(self, objs: typing.Iterable[T]) -> int:
+        """Insert or overwrite objects by primary key via COPY into a staging table and return their number."""
+        self.db_client.mark_write()
+        count = 0
+        try:
+            with self.db_client.connection.cursor() as cur:
+                cur.execute(self._staging_sql)
+                with cur.copy(self._copy_staging_sql) as copy:
+                    for obj in objs:
+                        copy.write_row(self.get_params(obj))
+                        count += 1
+                cur.execute(self._upsert_sql)
+        except BaseException as err:
+            logger.error(f'Failed to upsert batch into {self.table_name}!')
+            logger.error(err)
+            self.db_client.connection.rollback()
+            raise
+        logger.info(f'UPSERT {count} rows INTO {self.table_name}.')
+        return count
+
+    @on_transaction_failed
+    def update_many(
             self,
-            person_id: int,
-            person_fields: list[PersonField],
-            person_values: list[typing.Any],
-    ) -> typing.Optional[Person | list[Person]]:
-        q = """UPDATE {} SET ({}) = ({}) WHERE person_id = {value} RETURNING *;"""
+            obj_fields: list[PersonField | str],
+            rows: typing.Iterable[tuple[typing.Any, list[typing.Any]]],
+    ) -> None:
+        """Update the same fields of many rows, rows are (key, values) pairs, in one pipelined batch."""
+        self.db_client.mark_write()
+        columns = tuple(getattr(field, 'name', field) for field in obj_fields)
+        with self.db_client.connection.cursor() as cur:
+            cur.executemany(self._update_query(columns), [(*values, key) for key, values in rows])
+        logger.info(f'Update {self.model.__name__} fields: {list(columns)} of {cur.rowcount} rows.')
 
-        person_fields_as_str = [field.name for field in person_fields]
-        query = sql.SQL(q).format(
-            sql.Identifier(self.table_name),
-            sql.SQL(', ').join(map(sql.Identifier, person_fields_as_str)),
-            sql.SQL(', ').join(sql.Placeholder() * len(person_values)),
-            value=person_id,
-        )
-        with self.db_client.connection.cursor(row_factory=class_row(Person)) as cur:
-            result = cur.execute(query, params=person_values).fetchone()
-        logger.info(f'Update person fields: {person_fields_as_str} by id: {person_id}.')
+    @on_transaction_failed
+    def update(
+            self,
+            key: typing.Any,
+            obj_fields: list[PersonField | str],
+            obj_values: list[typing.Any],
+    ) -> typing.Optional[T]:
+        columns = self.search_columns(obj_fields)
+        self.db_client.mark_write()
+        cur = self._cursor(self.db_client.connection)
+        result = cur.execute(self._update_query(columns), (*obj_values, key), binary=self.binary).fetchone()
+        logger.info(f'Update {self.model.__name__} fields: {list(columns)} by {self.primary_key}: {key}.')
         return result
 
     @on_transaction_failed
-    def delete(self, person: Person, *, by: PersonField) -> typing.Optional[Person | list[Person]]:
-        q = """DELETE from {} WHERE {} = {value} RETURNING *;"""
-        query = sql.SQL(q).format(
-            sql.Identifier(self.table_name),
-            sql.Identifier(by.name),
-            value=getattr(person, by.name),
-        )
-
-        with self.db_client.connection.cursor(row_factory=class_row(person.__class__)) as cur:
-            result = cur.execute(query).fetchall()
-            logger.info(f'Delete {person} from {self.table_name} by {by.name}.')
+    def delete(self, obj: T, *, by: PersonField | str) -> typing.Optional[T | list[T]]:
+        column, = self.search_columns([by])
+        self.db_client.mark_write()
+        cur = self._cursor(self.db_client.connection)
+        result = cur.execute(self._delete_sql[column], (getattr(obj, column),), binary=self.binary).fetchall()
+        logger.info(f'Delete {obj} from {self.table_name} by {column}.')
         if len(result) == 1:
             return result[0]
         return result
 
+    @on_transaction_failed
+    def delete_many(self, keys: typing.Iterable[typing.Any]) -> list[T]:
+        self.db_client.mark_write()
+        keys = list(keys)
+        cur = self._cursor(self.db_client.connection)
+        result = cur.execute(self._delete_many_sql, (keys,), binary=self.binary).fetchall()
+        logger.info(f'Delete {len(result)} of {len(keys)} rows from {self.table_name}.')
+        return result
 
-class BetterPersons(Table):
-    def __init__(self, db_client: DataBaseClient):
-        super().__init__(db_client)
-        self.table_name = 'better_persons'
+
+class Persons(ModelTable[Person]):
+    def __init__(self, db_client: DataBaseClient, table_name: str = 'persons', binary: bool = False):
+        super().__init__(db_client, table_name, binary)
+
+    def changes(
+            self,
+            watermark: int = 0,
+            seen: typing.Iterable[int] = (),
+            install: bool = True,
+            timeout: typing.Optional[float] = None,
+    ) -> ChangeFeed:
+        """Return a feed of changes after watermark, which can be iterated both sync and async."""
+        feed = ChangeFeed(self.db_client, self.table_name, watermark, seen, timeout)
+        if install:
+            feed.install()
+        return feed
+
+
+class BetterPersons(ModelTable[BetterPerson]):
+    def __init__(self, db_client: DataBaseClient, table_name: str = 'better_persons', binary: bool = False):
+        super().__init__(db_client, table_name, binary)
 
     @on_transaction_failed
     def get_table_name(self) -> typing.Optional[str]:
@@ -225,17 +851,49 @@ class BetterPersons(Table):
     @on_transaction_failed
     def add_column(self, name: str, column_type: str) -> None:
         q = """ALTER TABLE {} ADD COLUMN {} {};"""
-        query = sql.SQL(q).format(
-            sql.Identifier(self.table_name),
-            sql.Identifier(name),
-            sql.Identifier(column_type),
-        )
         with self.db_client.connection.cursor() as cur:
             try:
+                query = sql.SQL(q).format(
+                    sql.Identifier(self.table_name),
+                    sql.Identifier(name),
+                    column_type_sql(column_type),
+                )
                 cur.execute(query)
                 logger.info(f'Add column:{name}, type:{column_type} into {self.table_name}')
-            except UndefinedObject as und_obj_error:
-                logger.warning(*und_obj_error.args)
+            except (ValueError, UndefinedObject, SyntaxError) as error:
+                logger.warning(*error.args)
+                self.db_client.connection.rollback()
+
+    @on_transaction_failed
+    def change_column_type(self, name: str, column_type: str) -> None:
+        """Change the column type in place, it rewrites the table under an exclusive lock, see `online_change`."""
+        q = """ALTER TABLE {} ALTER COLUMN {} TYPE {};"""
+        with self.db_client.connection.cursor() as cur:
+            try:
+                query = sql.SQL(q).format(
+                    sql.Identifier(self.table_name),
+                    sql.Identifier(name),
+                    column_type_sql(column_type),
+                )
+                cur.execute(query)
+                logger.info(f'Change column: {name} type to {column_type} in {self.table_name}')
+            except (ValueError, UndefinedColumn, UndefinedObject, SyntaxError) as error:
+                logger.warning(*error.args)
+                self.db_client.connection.rollback()
+
+    def online_change(
+            self,
+            alter: str | sql.Composable,
+            renames: typing.Optional[dict[str, str]] = None,
+            **kwargs,
+    ) -> OnlineSchemaChange:
+        """Return an online change which applies ALTER TABLE actions without blocking the table.
+
+        Example: `table.online_change(sql.SQL('ALTER COLUMN hobby TYPE text')).run()`.
+        """
+        if isinstance(alter, sql.Composable):
+            alter = alter.as_string(self.db_client.connection)
+        return OnlineSchemaChange(self.db_client, self.table_name, alter, renames, **kwargs)
 
     @on_transaction_failed
     def get_column(self, name: str) -> typing.Optional[dict]:
@@ -259,15 +917,32 @@ class BetterPersons(Table):
                 logger.warning(f'Cannot delete column: {name} from {self.table_name}.')
                 self.db_client.connection.rollback()
 
+    def delete(
+            self,
+            obj: typing.Optional[BetterPerson] = None,
+            *,
+            by: typing.Optional[PersonField | str] = None,
+    ) -> typing.Optional[BetterPerson | list[BetterPerson]]:
+        """Delete rows like `ModelTable.delete`, without arguments drop the table as before (deprecated)."""
+        if obj is None and by is None:
+            warnings.warn(
+                'BetterPersons.delete() without arguments is deprecated, use BetterPersons.drop().',
+                DeprecationWarning,
+                stacklevel=2,
+            )
+            return self.drop()
+        return super().delete(obj, by=by)
+
     @on_transaction_failed
-    def delete(self) -> None:
+    def drop(self) -> None:
+        """Drop the table, rows are deleted by `delete` and `delete_many`."""
         q = 'DROP TABLE {};'
         query = sql.SQL(q).format(
             sql.Identifier(self.table_name),
         )
         with self.db_client.connection.cursor() as cur:
             cur.execute(query)
-            logger.info(f'Delete table: {self.table_name}.')
+            logger.info(f'Drop table: {self.table_name}.')
 
     @on_transaction_failed
     def is_table_alive(self) -> bool:
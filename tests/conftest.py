@@ -6,7 +6,7 @@ from psycopg import OperationalError
 
 from common.db_client import DataBaseClient
 from common.logger import get_logger
-from common.tables import TableManager
+from common.tables import BetterPersons, Persons, TableManager
 
 logger = get_logger('root conftest.py')
 
@@ -48,6 +48,13 @@ def pytest_addoption(parser: Parser):
         help='User password for auth.',
         required=True,
     )
+    parser.addoption(
+        '--replica',
+        type=str,
+        action='append',
+        default=[],
+        help='Read replica host:port, can be repeated.',
+    )
 
 
 @pytest.fixture(scope='session')
@@ -59,9 +66,13 @@ def db_client(request) -> DataBaseClient:
     password = request.config.getoption('--password')
 
     connect_info = f'{host=} {port=} {dbname=} {user=} {password=}'
+    replicas = []
+    for replica in request.config.getoption('--replica'):
+        host, port = replica.split(':')
+        replicas.append(f'{host=} {port=} {dbname=} {user=} {password=}')
     # TODO: make db clients factory
     try:
-        db_client = DataBaseClient(connect_info)
+        db_client = DataBaseClient(connect_info, replicas)
     except OperationalError:
         logger.error('Check the connection to database.')
         sys.exit(2)
@@ -101,6 +112,16 @@ def create_table_better_persons(
     table_manager.delete_table(table_name, delete_table_better_persons_row_sql)
 
 
+@pytest.fixture(scope='class')
+def persons_table(db_client: DataBaseClient, create_table_persons: None) -> Persons:
+    return Persons(db_client)
+
+
+@pytest.fixture(scope='class')
+def better_persons_table(db_client: DataBaseClient, create_table_better_persons: None) -> BetterPersons:
+    return BetterPersons(db_client)
+
+
 @pytest.fixture(scope='class')
 def create_table_persons_row_sql() -> str:
     return """
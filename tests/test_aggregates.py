@@ -0,0 +1,192 @@
+import time
+from datetime import date
+
+import pytest
+
+from common.aggregates import RefreshScheduler
+from common.datagen import PersonsGenerator
+from common.db_client import DataBaseClient
+from common.models import BetterPerson, PersonField
+from common.tables import BetterPersons, TableManager
+
+
+@pytest.fixture
+def fill_better_persons(db_client, better_persons_table):
+    PersonsGenerator(BetterPerson, seed=5, null_rate=0.1).copy_into(better_persons_table, 1_000)
+    yield
+    db_client.connection.execute("""TRUNCATE TABLE better_persons;""")
+    db_client.connection.commit()
+
+
+def live_counts(db_client, value: str) -> dict:
+    q = f"""SELECT {value}, count(*) FROM better_persons GROUP BY 1;"""
+    return dict(db_client.connection.execute(q).fetchall())
+
+
+@pytest.mark.usefixtures('fill_better_persons')
+class TestAggregates:
+
+    def test_materialized_view(self, db_client, table_manager, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+        3. Generate 1000 BetterPersons into better_persons
+
+        test:
+        1. Create materialized aggregate by birthplace
+        2. Insert BetterPerson from a new birthplace
+        3. Refresh aggregates of better_persons
+
+        result: counts match the table, the new birthplace appears only after refresh
+
+        teardown:
+        1. Delete aggregate
+        2. Truncate better_persons
+        3. Delete better_persons
+        4. Disconnect from test_db
+        """
+        table_manager.create_aggregate(better_persons_table, 'birthplace')
+        try:
+            counts = better_persons_table.count_by('birthplace')
+            assert counts == live_counts(db_client, 'birthplace'), 'Aggregate counts differ from table!'
+
+            better_persons_table.insert(BetterPerson(5_000, 'Shinnok', date(1000, 1, 1), 'Netherrealm Depths'))
+            db_client.connection.commit()
+            assert 'Netherrealm Depths' not in better_persons_table.count_by('birthplace'), 'View is not stale!'
+
+            refreshed = table_manager.refresh_aggregates(better_persons_table)
+            assert refreshed == ['better_persons_count_by_birthplace'], f'Wrong refreshed views {refreshed}!'
+            counts = better_persons_table.count_by('birthplace')
+            assert counts['Netherrealm Depths'] == 1, 'Refresh did not update counts!'
+        finally:
+            table_manager.delete_aggregate(better_persons_table, 'birthplace')
+
+    def test_incremental_summary(self, db_client, table_manager, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+        3. Generate 1000 BetterPersons into better_persons
+
+        test:
+        1. Create incremental aggregate by birth year
+        2. Insert, update and delete BetterPersons
+        3. Count BetterPersons by birth year
+
+        result: counts match the table after every change without refresh
+
+        teardown:
+        1. Delete aggregate
+        2. Truncate better_persons
+        3. Delete better_persons
+        4. Disconnect from test_db
+        """
+        year = """date_trunc('year', birthday)::date"""
+        table_manager.create_aggregate(better_persons_table, PersonField.birthday, bucket='year', incremental=True)
+        try:
+            counts = better_persons_table.count_by(PersonField.birthday, bucket='year')
+            assert counts == live_counts(db_client, year), 'Aggregate counts differ from table!'
+
+            better_persons_table.insert(BetterPerson(5_000, 'Shinnok', date(1000, 6, 1), 'Netherrealm'))
+            better_persons_table.update(1, [PersonField.birthday], [date(1000, 1, 1)])
+            better_persons_table.delete_many(range(2, 100))
+            db_client.connection.commit()
+
+            counts = better_persons_table.count_by(PersonField.birthday, bucket='year')
+            assert counts[date(1000, 1, 1)] == 2, 'Insert or update is not counted!'
+            assert counts == live_counts(db_client, year), 'Aggregate counts differ from table after changes!'
+        finally:
+            table_manager.delete_aggregate(better_persons_table, PersonField.birthday, bucket='year')
+
+    def test_count_without_aggregate(self, db_client, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+        3. Generate 1000 BetterPersons into better_persons
+
+        test:
+        1. Count BetterPersons by occupation without aggregate
+
+        result: counts are computed from the table, NULL occupations are counted too
+
+        teardown:
+        1. Truncate better_persons
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        counts = better_persons_table.count_by('occupation')
+        assert counts == live_counts(db_client, 'occupation'), 'Counts differ from table!'
+        assert None in counts, 'NULL occupations are not counted!'
+
+    def test_truncate_with_summary(self, db_client, table_manager, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+        3. Generate 1000 BetterPersons into better_persons
+
+        test:
+        1. Create incremental aggregate by birthplace
+        2. Truncate better_persons
+        3. Insert BetterPerson
+
+        result: the summary is emptied by the truncate and counts only the new BetterPerson
+
+        teardown:
+        1. Delete aggregate
+        2. Truncate better_persons
+        3. Delete better_persons
+        4. Disconnect from test_db
+        """
+        table_manager.create_aggregate(better_persons_table, 'birthplace', incremental=True)
+        try:
+            db_client.connection.execute("""TRUNCATE TABLE better_persons;""")
+            db_client.connection.commit()
+            assert better_persons_table.count_by('birthplace') == {}, 'Summary is not truncated!'
+
+            better_persons_table.insert(BetterPerson(5_000, 'Shinnok', date(1000, 1, 1), 'Netherrealm'))
+            db_client.connection.commit()
+            counts = better_persons_table.count_by('birthplace')
+            assert counts == {'Netherrealm': 1}, f'Wrong counts after truncate {counts}!'
+        finally:
+            table_manager.delete_aggregate(better_persons_table, 'birthplace')
+
+    def test_refresh_scheduler(self, db_client, table_manager, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+        3. Generate 1000 BetterPersons into better_persons
+
+        test:
+        1. Create materialized aggregate by birthplace
+        2. Start RefreshScheduler with its own connection
+        3. Insert BetterPerson from a new birthplace
+        4. Wait for the next refresh
+
+        result: the new birthplace appears in the aggregate without an explicit refresh
+
+        teardown:
+        1. Stop RefreshScheduler
+        2. Delete aggregate
+        3. Truncate better_persons
+        4. Delete better_persons
+        5. Disconnect from test_db
+        """
+        table_manager.create_aggregate(better_persons_table, 'birthplace')
+        refresh_client = DataBaseClient(db_client.connection_info)
+        try:
+            with RefreshScheduler(TableManager(refresh_client), [BetterPersons(refresh_client)], interval=0.1):
+                better_persons_table.insert(BetterPerson(5_000, 'Shinnok', date(1000, 1, 1), 'Netherrealm Depths'))
+                db_client.connection.commit()
+                deadline = time.monotonic() + 10
+                while 'Netherrealm Depths' not in better_persons_table.count_by('birthplace'):
+                    db_client.connection.rollback()
+                    assert time.monotonic() < deadline, 'Scheduler did not refresh the aggregate!'
+                    time.sleep(0.1)
+                db_client.connection.rollback()
+        finally:
+            refresh_client.close()
+            table_manager.delete_aggregate(better_persons_table, 'birthplace')
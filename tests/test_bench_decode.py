@@ -0,0 +1,24 @@
+from common.bench_decode import run
+
+
+class TestBenchDecode:
+
+    def test_raw_decoding_is_cheaper(self, db_client):
+        """
+        setup:
+        1. Connect to test_db
+
+        test:
+        1. Run decoding benchmark on 20000 rows
+
+        result: every mode is measured, raw tuples cost less client CPU per row than Person objects
+
+        teardown:
+        1. Drop the benchmark table
+        2. Disconnect from test_db
+        """
+        measurements = run(db_client, rows=20_000, repeat=3, gets=100)
+        assert len(measurements) == 5, f'Wrong measured modes {list(measurements)}!'
+        raw = measurements['binary, raw tuples'].cpu_us_per_row
+        objects = measurements['text, Person objects'].cpu_us_per_row
+        assert raw < objects, f'Raw tuples ({raw:.3f} us/row) are not cheaper than objects ({objects:.3f} us/row)!'
@@ -0,0 +1,167 @@
+from datetime import date
+
+import pytest
+
+from common.buffered_writer import BufferedPersonsWriter, BufferFull
+from common.db_client import DataBaseClient
+from common.models import Person, PersonField
+from common.tables import Persons
+
+
+@pytest.fixture
+def writer_table(db_client, persons_table):
+    writer_client = DataBaseClient(db_client.connection_info)
+    yield Persons(writer_client)
+    writer_client.close()
+    db_client.connection.execute("""TRUNCATE TABLE persons;""")
+    db_client.connection.commit()
+
+
+@pytest.mark.usefixtures('persons_table')
+class TestBufferedPersonsWriter:
+
+    def test_coalesced_flush(self, persons_table, writer_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+
+        test:
+        1. Insert, update and delete Persons via buffered writer
+        2. Flush buffered writer
+        3. Select Persons from persons
+
+        result: persons has only the last state of every Person
+
+        teardown:
+        1. Close buffered writer
+        2. Truncate persons
+        3. Delete persons
+        4. Disconnect from test_db
+        """
+        errors = []
+        on_error = lambda *args: errors.append(args)  # noqa: E731
+        with BufferedPersonsWriter(writer_table, flush_interval=60, on_error=on_error) as writer:
+            writer.insert(Person(1, 'Goro', date(1000, 1, 1)))
+            writer.update(1, [PersonField.first_name], ['Prince Goro'])
+            writer.insert(Person(2, 'Kintaro', date(1000, 1, 1)))
+            writer.delete(2)
+            assert writer.flush(timeout=10), 'Flush timed out!'
+
+            persons_table.db_client.connection.commit()
+            assert persons_table.select_many([1, 2]) == [Person(1, 'Prince Goro', date(1000, 1, 1))], 'Wrong flush!'
+
+            writer.update(1, [PersonField.birthday], [date(1001, 1, 1)])
+        assert not errors, f'Flush failed: {errors}'
+        persons_table.db_client.connection.commit()
+        assert persons_table.get(1).birthday == date(1001, 1, 1), 'Close did not flush buffer!'
+
+    def test_backpressure(self, writer_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+
+        test:
+        1. Lock persons, so buffered writer cannot flush
+        2. Insert more Persons than buffer size with put timeout
+
+        result: BufferFull is raised
+
+        teardown:
+        1. Release lock
+        2. Close buffered writer
+        3. Truncate persons
+        4. Delete persons
+        5. Disconnect from test_db
+        """
+        locker = DataBaseClient(writer_table.db_client.connection_info)
+        locker.connection.execute("""LOCK TABLE persons IN ACCESS EXCLUSIVE MODE;""")
+        writer = BufferedPersonsWriter(writer_table, max_buffer=2, flush_size=100, put_timeout=0.2)
+        try:
+            with pytest.raises(BufferFull):
+                for person_id in range(10):
+                    writer.insert(Person(person_id, 'Baraka', date(1000, 1, 1)))
+        finally:
+            locker.connection.rollback()
+            locker.close()
+            writer.close()
+
+    def test_primary_key_update(self, writer_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+
+        test:
+        1. Update person_id via buffered writer
+
+        result: ValueError is raised
+
+        teardown:
+        1. Close buffered writer
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        with BufferedPersonsWriter(writer_table) as writer:
+            with pytest.raises(ValueError):
+                writer.update(1, [PersonField.person_id], [2])
+
+    def test_buffer_bound_includes_flushing_writes(self, writer_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+
+        test:
+        1. Lock persons, so buffered writer cannot finish a flush
+        2. Insert as many Persons as the buffer size, so they are being flushed
+        3. Insert one more Person with put timeout
+
+        result: BufferFull is raised, writes being flushed count against the buffer size
+
+        teardown:
+        1. Release lock
+        2. Close buffered writer
+        3. Truncate persons
+        4. Delete persons
+        5. Disconnect from test_db
+        """
+        locker = DataBaseClient(writer_table.db_client.connection_info)
+        locker.connection.execute("""LOCK TABLE persons IN ACCESS EXCLUSIVE MODE;""")
+        writer = BufferedPersonsWriter(writer_table, max_buffer=2, flush_size=2, put_timeout=0.2)
+        try:
+            writer.insert(Person(1, 'Kung Lao', date(1000, 1, 1)))
+            writer.insert(Person(2, 'Kung Jin', date(1000, 1, 1)))
+            with pytest.raises(BufferFull):
+                writer.insert(Person(3, 'Shujinko', date(1000, 1, 1)))
+        finally:
+            locker.connection.rollback()
+            locker.close()
+            writer.close()
+
+    def test_unknown_field_update(self, writer_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+
+        test:
+        1. Insert Person via buffered writer
+        2. Update unknown field of the Person via buffered writer
+
+        result: ValueError is raised, the insert is still flushed
+
+        teardown:
+        1. Close buffered writer
+        2. Truncate persons
+        3. Delete persons
+        4. Disconnect from test_db
+        """
+        person = Person(1, 'Kenshi', date(1000, 1, 1))
+        with BufferedPersonsWriter(writer_table) as writer:
+            writer.insert(person)
+            with pytest.raises(ValueError):
+                writer.update(person.person_id, ['nickname'], ['Blind'])
+        writer_table.db_client.connection.commit()
+        assert writer_table.get(person.person_id) == person, 'Insert was not flushed!'
@@ -0,0 +1,170 @@
+import datetime
+import threading
+
+import psycopg
+import pytest
+
+from common.models import Person, PersonField
+
+
+@pytest.fixture
+def change_feed(persons_table):
+    feed = persons_table.changes()
+    yield feed
+    feed.uninstall()
+
+
+@pytest.mark.usefixtures('persons_table')
+class TestPersonChanges:
+
+    def test_changes_replay(self, persons_table, change_feed):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+        3. Install change feed on persons
+
+        test:
+        1. Insert, update and delete Person
+        2. Read three changes from the feed
+
+        result: feed returns insert, update and delete changes in order
+
+        teardown:
+        1. Uninstall change feed
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        person = Person(1, 'Raiden', datetime.date(1000, 1, 1))
+        persons_table.insert(person)
+        persons_table.update(person.person_id, [PersonField.person_id], [2])
+        persons_table.delete(Person(2, person.first_name, person.birthday), by=PersonField.person_id)
+        persons_table.db_client.connection.commit()
+
+        changes = [change for _, change in zip(range(3), change_feed)]
+        assert [change.op for change in changes] == ['I', 'U', 'D'], 'Wrong change operations!'
+        assert changes[1].old_person_id == 1, 'Update change lost old person_id!'
+        assert changes[-1].xid in change_feed.seen or change_feed.watermark > changes[-1].xid, \
+            'Feed state was not advanced!'
+
+    def test_changes_resume(self, persons_table, change_feed):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+        3. Install change feed on persons
+
+        test:
+        1. Insert two Persons in two transactions
+        2. Read the first change
+        3. Open a new feed from the state of the first feed
+
+        result: new feed returns only the second change
+
+        teardown:
+        1. Uninstall change feed
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        persons_table.insert(Person(10, 'Jax', datetime.date(1000, 1, 1)))
+        persons_table.db_client.connection.commit()
+        persons_table.insert(Person(11, 'Sonya', datetime.date(1000, 1, 1)))
+        persons_table.db_client.connection.commit()
+        first = next(iter(change_feed))
+        assert first.person_id == 10, 'Feed did not start from the first change!'
+
+        resumed_feed = persons_table.changes(change_feed.watermark, change_feed.seen, install=False)
+        change = next(iter(resumed_feed))
+        assert change.person_id == 11, 'Feed did not resume after watermark!'
+        assert change.log_id > first.log_id, 'Resumed change is not after the first change in the log!'
+
+    def test_changes_commit_order(self, persons_table, change_feed):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+        3. Install change feed on persons
+
+        test:
+        1. Insert Person in the first transaction
+        2. Insert Person in the second transaction and commit it
+        3. Read a change and store the feed state
+        4. Commit the first transaction
+        5. Open a new feed from the stored state
+
+        result: the change of the first transaction is not lost although its log_id is smaller
+
+        teardown:
+        1. Uninstall change feed
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        q = """INSERT INTO persons (person_id, first_name, birthday) VALUES (%s, %s, %s);"""
+        info = persons_table.db_client.connection_info
+        with psycopg.connect(info) as first, psycopg.connect(info) as second:
+            first.execute(q, (20, 'Kitana', datetime.date(1000, 1, 1)))
+            second.execute(q, (21, 'Mileena', datetime.date(1000, 1, 1)))
+            second.commit()
+            change = next(iter(change_feed))
+            watermark, seen = change_feed.watermark, set(change_feed.seen)
+            first.commit()
+        assert change.person_id == 21, 'Uncommitted change was returned!'
+
+        resumed_feed = persons_table.changes(watermark, seen, install=False)
+        change = next(iter(resumed_feed))
+        assert change.person_id == 20, 'Change committed out of order was lost!'
+
+    def test_changes_timeout(self, persons_table, change_feed):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+        3. Install change feed on persons
+
+        test:
+        1. Insert two Persons
+        2. Iterate the feed with timeout until it ends
+
+        result: iteration returns both changes and ends after timeout
+
+        teardown:
+        1. Uninstall change feed
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        persons_table.insert_many([Person(30, 'Kung Lao', datetime.date(1000, 1, 1)),
+                                   Person(31, 'Liu Kang', datetime.date(1000, 1, 1))])
+        persons_table.db_client.connection.commit()
+
+        change_feed.timeout = 1
+        changes = list(change_feed)
+        assert [change.person_id for change in changes] == [30, 31], 'Wrong changes before timeout!'
+
+    def test_changes_stop(self, persons_table, change_feed):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+        3. Install change feed on persons
+
+        test:
+        1. Insert Person
+        2. Stop the feed from another thread while it waits for notifications
+
+        result: iteration returns the change and ends after stop
+
+        teardown:
+        1. Uninstall change feed
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        persons_table.insert(Person(40, 'Kenshi', datetime.date(1000, 1, 1)))
+        persons_table.db_client.connection.commit()
+
+        stopper = threading.Timer(1, change_feed.stop)
+        stopper.start()
+        try:
+            changes = list(change_feed)
+        finally:
+            stopper.cancel()
+        assert [change.person_id for change in changes] == [40], 'Wrong changes before stop!'
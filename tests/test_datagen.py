@@ -0,0 +1,121 @@
+import pytest
+
+from common.datagen import PersonsGenerator
+from common.models import BetterPerson, Person
+
+
+@pytest.fixture
+def clear_tables(db_client):
+    yield
+    db_client.connection.execute("""TRUNCATE TABLE persons, better_persons;""")
+    db_client.connection.commit()
+
+
+@pytest.mark.usefixtures('persons_table', 'better_persons_table', 'clear_tables')
+class TestDataGenerator:
+
+    def test_copy_into_persons(self, db_client, persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+
+        test:
+        1. Generate 10000 Persons into persons via binary COPY
+        2. Count rows, distinct ids and ids range
+
+        result: all rows are copied with unique consecutive ids
+
+        teardown:
+        1. Truncate persons
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        generator = PersonsGenerator(Person, seed=1, start_id=100)
+        assert generator.copy_into(persons_table, 10_000, batch_size=3_000) == 10_000, 'Generate failed!'
+        q = """SELECT count(*), count(DISTINCT person_id), min(person_id), max(person_id) FROM persons;"""
+        counts = db_client.connection.execute(q).fetchone()
+        assert counts == (10_000, 10_000, 100, 10_099), f'Wrong generated rows {counts}!'
+
+    def test_null_rate(self, db_client, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+
+        test:
+        1. Generate 10000 BetterPersons with null rate 0.5 into better_persons
+        2. Count NULL values of required and optional fields
+
+        result: required fields are never NULL, about half of optional fields are NULL
+
+        teardown:
+        1. Truncate better_persons
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        PersonsGenerator(BetterPerson, seed=1, null_rate=0.5).copy_into(better_persons_table, 10_000)
+        q = """SELECT count(*) - count(birthplace), count(*) - count(hobby) FROM better_persons;"""
+        birthplace_nulls, hobby_nulls = db_client.connection.execute(q).fetchone()
+        assert birthplace_nulls == 0, 'Required field is NULL!'
+        assert 4_500 <= hobby_nulls <= 5_500, f'Wrong number of NULL hobbies {hobby_nulls}!'
+
+    def test_csv_file_matches_copy(self, tmp_path, db_client, table_manager, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+
+        test:
+        1. Generate 1000 BetterPersons with seed 7 into csv file and import it into better_persons
+        2. Select imported rows and truncate better_persons
+        3. Generate 1000 BetterPersons with seed 7 via binary COPY and select them
+
+        result: both ways produce the same rows
+
+        teardown:
+        1. Truncate better_persons
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        path = tmp_path / 'better_persons.csv'
+        PersonsGenerator(BetterPerson, seed=7).write_file(path, 1_000, batch_size=300)
+        report = table_manager.import_file(better_persons_table, path)
+        assert report.copied == 1_000, f'Wrong import report {report}!'
+        imported = better_persons_table.select_many(range(1, 1_001))
+
+        db_client.connection.execute("""TRUNCATE TABLE better_persons;""")
+        PersonsGenerator(BetterPerson, seed=7).copy_into(better_persons_table, 1_000, batch_size=300)
+        copied = better_persons_table.select_many(range(1, 1_001))
+        assert imported == copied, 'csv file and binary COPY rows differ!'
+
+    def test_ids_out_of_int4(self, db_client, persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+
+        test:
+        1. Generate 10 Persons via binary COPY with ids up to 2^31 - 1
+        2. Try to generate 11 Persons starting at the same id as batch, chunks and COPY
+
+        result: ids up to 2^31 - 1 are copied, one more id raises ValueError and nothing is copied
+
+        teardown:
+        1. Truncate persons
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        start_id = 2 ** 31 - 10
+        assert PersonsGenerator(Person, start_id=start_id).copy_into(persons_table, 10) == 10, 'Generate failed!'
+        db_client.connection.execute("""TRUNCATE TABLE persons;""")
+
+        generator = PersonsGenerator(Person, start_id=start_id)
+        with pytest.raises(ValueError):
+            generator.batch(11)
+        with pytest.raises(ValueError):
+            next(generator.chunks(11))
+        with pytest.raises(ValueError):
+            generator.copy_into(persons_table, 11)
+        count, = db_client.connection.execute("""SELECT count(*) FROM persons;""").fetchone()
+        assert count == 0, f'Rows copied with out of range ids {count}!'
@@ -0,0 +1,87 @@
+import pytest
+
+
+@pytest.fixture
+def select_on_teardown(db_client):
+    yield
+    db_client.connection.execute('SELECT 1;')
+    db_client.connection.execute('SELECT 2;')
+    db_client.connection.commit()
+
+
+class TestDataBaseStats:
+
+    def test_assert_max_queries(self, db_client, assert_max_queries):
+        """
+        setup:
+        1. Connect to test_db
+
+        test:
+        1. Execute three statements inside assert_max_queries block
+        2. Execute more statements than allowed inside assert_max_queries block
+
+        result: statements are counted, exceeding the limit fails
+
+        teardown:
+        1. Disconnect from test_db
+        """
+        with assert_max_queries(3) as stats:
+            for _ in range(3):
+                db_client.connection.execute('SELECT 1;')
+        assert stats.statements == 3, f'Wrong statements count: {stats.statements}'
+        assert stats.db_time > 0, 'Database time was not recorded!'
+
+        with pytest.raises(AssertionError):
+            with assert_max_queries(1):
+                db_client.connection.execute('SELECT 1;')
+                db_client.connection.execute('SELECT 2;')
+
+    @pytest.mark.max_queries(2)
+    def test_max_queries_marker(self, db_client):
+        """
+        setup:
+        1. Connect to test_db
+
+        test:
+        1. Execute two statements in test limited by max_queries marker
+
+        result: test passes
+
+        teardown:
+        1. Disconnect from test_db
+        """
+        db_client.connection.execute('SELECT 1;')
+        db_client.connection.execute('SELECT 2;')
+
+    def test_fixture_with_teardown(self, select_on_teardown):
+        """
+        setup:
+        1. Connect to test_db
+
+        test:
+        1. Use fixture which executes two statements on teardown
+
+        result: test passes, its teardown is checked by test_teardown_counted
+
+        teardown:
+        1. Execute two statements
+        2. Disconnect from test_db
+        """
+
+    def test_teardown_counted(self, request):
+        """
+        setup:
+        1. Connect to test_db
+
+        test:
+        1. Get stats of test_fixture_with_teardown from the plugin
+
+        result: statements of the fixture teardown are counted for the test teardown and for the fixture
+
+        teardown:
+        1. Disconnect from test_db
+        """
+        plugin = request.config.pluginmanager.get_plugin('db_stats')
+        nodeid = request.node.nodeid.replace('test_teardown_counted', 'test_fixture_with_teardown')
+        assert plugin.tests[nodeid]['teardown'].statements == 2, 'Test teardown statements are not counted!'
+        assert plugin.fixtures['select_on_teardown'].statements == 2, 'Fixture teardown statements are not counted!'
@@ -208,6 +208,33 @@ class TestDDL:
         result = better_persons_table.get_column(column_name)
         assert not result, f'Create column {column_name} with invalid type {column_type}!'
 
+    def test_add_column_with_type_modifier(self, better_persons_table, delete_column):
+        """
+        setup:
+        1. Connect to  test_db
+        2. Create better_persons
+
+        test:
+        1. Add `new_column` with type `varchar(64)` into better_persons
+        2. Change type of `new_column` to `numeric(10, 2)`
+        3. Select column with name `new_column`
+
+        result: column has type numeric with precision 10 and scale 2
+
+        teardown:
+        1. Delete column `new_column`
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        column_name = 'new_column'
+        better_persons_table.add_column(column_name, 'varchar(64)')
+        assert better_persons_table.get_column(column_name)['character_maximum_length'] == 64, \
+            'Column was not added with varchar(64)!'
+        better_persons_table.change_column_type(column_name, 'numeric(10, 2)')
+        result = better_persons_table.get_column(column_name)
+        assert (result['data_type'], result['numeric_precision'], result['numeric_scale']) == ('numeric', 10, 2), \
+            f'Type of {column_name} is not changed to numeric(10, 2)!'
+
     def test_delete_column(self, better_persons_table):
         """
         setup:
@@ -267,5 +294,5 @@ class TestDDL:
         2. Delete better_persons
         3. Disconnect from test_db
         """
-        better_persons_table.delete()
+        better_persons_table.drop()
         assert not better_persons_table.is_table_alive()
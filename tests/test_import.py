@@ -0,0 +1,191 @@
+import json
+from datetime import date
+
+import pytest
+
+from common.models import Person, PersonField
+
+
+@pytest.fixture
+def clear_tables(db_client):
+    yield
+    db_client.connection.execute("""TRUNCATE TABLE persons, better_persons;""")
+    db_client.connection.commit()
+
+
+@pytest.mark.usefixtures('persons_table', 'better_persons_table', 'clear_tables')
+class TestImportFile:
+
+    def test_import_csv(self, tmp_path, table_manager, persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+
+        test:
+        1. Write csv file with two valid rows and one invalid row
+        2. Import csv file into persons
+        3. Select imported Person from persons
+
+        result: valid rows are copied, invalid row is written into rejected file with reason
+
+        teardown:
+        1. Truncate persons
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        path = tmp_path / 'persons.csv'
+        path.write_text(
+            'person_id,first_name,birthday\n'
+            '1,Shao Kahn,1998-11-05\n'
+            '2,Sub-Zero,2007-12-04\n'
+            'three,Smoke,1000-05-02\n',
+        )
+        rejected_path = tmp_path / 'rejected.ndjson'
+        report = table_manager.import_file(persons_table, path, rejected_path=rejected_path)
+
+        assert (report.read, report.copied, report.rejected) == (3, 2, 1), f'Wrong import report {report}!'
+        person = Person(1, 'Shao Kahn', date(1998, 11, 5))
+        selected_person = persons_table.select(person, by=PersonField.person_id)
+        assert person == selected_person, f'Import failed on: {person.compare(selected_person)}'
+        rejected = [json.loads(line) for line in rejected_path.read_text().splitlines()]
+        assert len(rejected) == 1, 'Wrong number of rejected rows!'
+        assert rejected[0]['reason'].startswith('person_id'), 'Wrong reject reason!'
+        assert rejected[0]['line'] == 4, 'Rejected row has wrong line number!'
+
+    def test_import_ndjson_with_defaults(self, tmp_path, table_manager, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+
+        test:
+        1. Write ndjson file with BetterPerson rows without optional fields
+        2. Import ndjson file into better_persons with progress callback
+
+        result: all rows are copied, progress callback gets the final report
+
+        teardown:
+        1. Truncate better_persons
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        path = tmp_path / 'better_persons.ndjson'
+        rows = [
+            {'person_id': 1, 'first_name': 'Liu', 'birthday': '1000-05-02', 'birthplace': 'Earthrealm'},
+            {'person_id': 2, 'first_name': 'Kung', 'birthday': '0999-12-12', 'birthplace': 'Earthrealm',
+             'family_name': 'Lao'},
+        ]
+        path.write_text('\n'.join(map(json.dumps, rows)))
+        reports = []
+        report = table_manager.import_file(better_persons_table, path, fmt='ndjson', progress=reports.append)
+
+        assert (report.copied, report.rejected) == (2, 0), f'Wrong import report {report}!'
+        assert reports and reports[-1] is report, 'Progress callback was not called!'
+        cur = better_persons_table.db_client.connection.execute("""SELECT family_name FROM better_persons;""")
+        assert ('Lao',) in cur.fetchall(), 'Optional field was not imported!'
+
+    def test_import_unknown_format(self, tmp_path, table_manager, persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+
+        test:
+        1. Import file with unknown format
+
+        result: ValueError is raised
+
+        teardown:
+        1. Delete persons
+        2. Disconnect from test_db
+        """
+        path = tmp_path / 'persons.xml'
+        path.write_text('<persons/>')
+        with pytest.raises(ValueError):
+            table_manager.import_file(persons_table, path, fmt='xml')
+
+    def test_import_ndjson_rejects(self, tmp_path, table_manager, persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+
+        test:
+        1. Write ndjson file with a valid row, a broken line, a non-object line, a too long first_name,
+           a boolean person_id and an object first_name
+        2. Import ndjson file into persons
+
+        result: valid row is copied, other lines are written into rejected file with their reasons
+
+        teardown:
+        1. Truncate persons
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        path = tmp_path / 'persons.ndjson'
+        lines = [
+            '{"person_id": 1, "first_name": "Kano", "birthday": "1000-01-01"}',
+            '{"person_id": 2, "first_name": "Jade",',
+            '[3, "Reptile", "1000-01-01"]',
+            json.dumps({'person_id': 4, 'first_name': 'K' * 129, 'birthday': '1000-01-01'}),
+            '',
+            json.dumps({'person_id': True, 'first_name': 'Baraka', 'birthday': '1000-01-01'}),
+            json.dumps({'person_id': 7, 'first_name': {'name': 'Sindel'}, 'birthday': '1000-01-01'}),
+        ]
+        path.write_text('\n'.join(lines))
+        rejected_path = tmp_path / 'rejected.ndjson'
+        report = table_manager.import_file(persons_table, path, fmt='ndjson', rejected_path=rejected_path)
+
+        assert (report.read, report.copied, report.rejected) == (6, 1, 5), f'Wrong import report {report}!'
+        rejected = [json.loads(line) for line in rejected_path.read_text().splitlines()]
+        assert [row['line'] for row in rejected] == [2, 3, 4, 6, 7], 'Rejected rows have wrong line numbers!'
+        reasons = [row['reason'] for row in rejected]
+        assert reasons[0].startswith('invalid json'), 'Broken line was not rejected!'
+        assert rejected[0]['row'] == '{"person_id": 2, "first_name": "Jade",', 'Broken line was not kept!'
+        assert reasons[1] == 'expected an object, got list', 'Non-object line was not rejected!'
+        assert reasons[2].startswith('first_name: 129 characters'), 'Too long first_name was not rejected!'
+        assert reasons[3] == 'person_id: expected int, got bool', 'Boolean person_id was not rejected!'
+        assert reasons[4] == 'first_name: expected str, got dict', 'Object first_name was not rejected!'
+
+    def test_import_duplicates(self, tmp_path, table_manager, persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+
+        test:
+        1. Insert Person
+        2. Write csv file with the key of the inserted Person, a new row and a repeated key
+        3. Import csv file into persons
+
+        result: the new row is copied, duplicates of the table and of the file are rejected per row
+
+        teardown:
+        1. Truncate persons
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        persons_table.insert(Person(1, 'Goro', date(1000, 1, 1)))
+        persons_table.db_client.connection.commit()
+        path = tmp_path / 'persons.csv'
+        path.write_text(
+            'person_id,first_name,birthday\n'
+            '1,Kintaro,1000-01-01\n'
+            '2,Sheeva,1000-01-01\n'
+            '2,Motaro,1000-01-01\n',
+        )
+        rejected_path = tmp_path / 'rejected.ndjson'
+        report = table_manager.import_file(persons_table, path, rejected_path=rejected_path)
+
+        assert (report.read, report.copied, report.rejected) == (3, 1, 2), f'Wrong import report {report}!'
+        assert persons_table.select(Person(1, '', date(1000, 1, 1)), by=PersonField.person_id).first_name == 'Goro', \
+            'Existing row was overwritten!'
+        assert persons_table.select(Person(2, '', date(1000, 1, 1)), by=PersonField.person_id).first_name == 'Sheeva', \
+            'First row of a repeated key was not imported!'
+        rejected = [json.loads(line) for line in rejected_path.read_text().splitlines()]
+        assert [(row['line'], row['reason']) for row in rejected] == [
+            (2, 'person_id: duplicate key 1 in table'),
+            (4, 'person_id: duplicate key 2 in file'),
+        ], f'Wrong rejected duplicates {rejected}!'
+        assert rejected[1]['row']['first_name'] == 'Motaro', 'Rejected duplicate row was not kept!'
@@ -0,0 +1,59 @@
+import pytest
+
+from common import loadgen
+
+
+@pytest.mark.usefixtures('create_table_persons')
+class TestLoadgen:
+
+    def test_closed_loop_run(self, db_client):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+
+        test:
+        1. Prepare key space in persons
+        2. Run closed loop mixed workload for one second
+
+        result: all operations of the mix were executed without errors
+
+        teardown:
+        1. Delete persons
+        2. Disconnect from test_db
+        """
+        args = loadgen.parse_args([
+            '--dsn', db_client.connection_info,
+            '--keys', '100',
+            '--concurrency', '2',
+            '--duration', '1',
+            '--distribution', 'zipf',
+        ])
+        loadgen.prepare(args)
+        stats = loadgen.run(args)
+        assert set(stats.histograms) == set(loadgen.OPERATIONS), 'Not all operations were executed!'
+        assert not stats.errors, f'Load run had errors: {stats.errors}'
+
+    def test_open_loop_rate(self, db_client):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+
+        test:
+        1. Run open loop select workload with target rate 50 ops/s for two seconds
+
+        result: executed operations count is close to target rate
+
+        teardown:
+        1. Delete persons
+        2. Disconnect from test_db
+        """
+        args = loadgen.parse_args([
+            '--dsn', db_client.connection_info,
+            '--mix', 'select=1',
+            '--qps', '50',
+            '--duration', '2',
+        ])
+        stats = loadgen.run(args)
+        assert 80 <= stats.total().count <= 101, f'Wrong number of operations: {stats.total().count}'
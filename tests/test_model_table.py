@@ -0,0 +1,223 @@
+from datetime import date
+
+import pytest
+
+from common.models import BetterPerson, PersonField
+from common.tables import BetterPersons
+
+
+@pytest.fixture
+def clear_table_better_persons(better_persons_table):
+    yield
+    q = """TRUNCATE TABLE better_persons;"""
+    better_persons_table.db_client.connection.execute(q)
+
+
+@pytest.mark.usefixtures('better_persons_table', 'clear_table_better_persons')
+class TestBetterPersonDML:
+
+    def test_insert_better_person(self, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+
+        test:
+        1. Insert BetterPerson into better_persons with RETURNING *
+        2. Get BetterPerson by person_id
+
+        result: BetterPerson in table with correct data
+
+        teardown:
+        1. Truncate better_persons
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        person = BetterPerson(1, 'Johnny', date(1970, 1, 1), 'Hollywood', 'Cage', 'Actor', 'Karate')
+        inserted_person = better_persons_table.insert(person)
+        assert person == inserted_person, f'Insert failed on {person.compare(inserted_person)}!'
+        selected_person = better_persons_table.get(person.person_id)
+        assert person == selected_person, f'Get failed on {person.compare(selected_person)}!'
+
+    def test_update_better_person(self, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+
+        test:
+        1. Insert BetterPerson into better_persons
+        2. Update single field birthplace by id
+
+        result: BetterPerson has a new birthplace
+
+        teardown:
+        1. Truncate better_persons
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        person = BetterPerson(1, 'Kitana', date(1000, 1, 1), 'Edenia')
+        better_persons_table.insert(person)
+        updated_person = better_persons_table.update(person.person_id, ['birthplace'], ['Outworld'])
+        assert updated_person, 'Failed to update BetterPerson!'
+        assert updated_person.birthplace == 'Outworld', 'Update birthplace failed.'
+
+    def test_delete_better_person(self, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+
+        test:
+        1. Insert BetterPerson into better_persons
+        2. Delete BetterPerson by person_id
+
+        result: deleted BetterPerson is returned, better_persons still exists without it
+
+        teardown:
+        1. Truncate better_persons
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        person = BetterPerson(1, 'Jax', date(1000, 1, 1), 'Earthrealm', 'Briggs')
+        better_persons_table.insert(person)
+        deleted_person = better_persons_table.delete(person, by=PersonField.person_id)
+        assert person == deleted_person, f'Delete failed on {person.compare(deleted_person)}!'
+        # get fails with UndefinedTable if delete dropped the table.
+        assert better_persons_table.get(person.person_id) is None, 'BetterPerson was not deleted!'
+
+    def test_batch_operations(self, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+
+        test:
+        1. Insert batch of BetterPersons into better_persons
+        2. Select batch by ids
+        3. Delete batch by ids
+
+        result: all batch operations return all BetterPersons
+
+        teardown:
+        1. Truncate better_persons
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        persons = [BetterPerson(i, f'Tarkatan {i}', date(1000, 1, 1), 'Outworld') for i in range(1, 101)]
+        assert better_persons_table.insert_many(persons) == len(persons), 'Batch insert failed!'
+
+        ids = [person.person_id for person in persons]
+        assert better_persons_table.select_many(ids) == persons, 'Batch select failed!'
+        assert len(better_persons_table.delete_many(ids)) == len(persons), 'Batch delete failed!'
+        selected_person = better_persons_table.select(persons[0], by=PersonField.person_id)
+        assert not selected_person, 'Select deleted BetterPerson!'
+
+    def test_binary_and_raw_select(self, db_client, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+
+        test:
+        1. Insert BetterPerson into better_persons
+        2. Select it via binary cursor
+        3. Select it as raw tuple
+
+        result: binary select returns the same BetterPerson, raw tuple has ordinal date and bytes strings
+
+        teardown:
+        1. Truncate better_persons
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        person = BetterPerson(1, 'Jade', date(1000, 1, 1), 'Edenia', 'Assassin')
+        better_persons_table.insert(person)
+        binary_table = BetterPersons(db_client, binary=True)
+
+        assert binary_table.select_many([person.person_id]) == [person], 'Binary select failed!'
+        raw_row = binary_table.select_many_raw([person.person_id])[0]
+        assert raw_row[:4] == (1, b'Jade', person.birthday.toordinal(), b'Edenia'), 'Raw select failed!'
+
+    def test_fields_by_name(self, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+
+        test:
+        1. Insert BetterPerson into better_persons
+        2. Select, update and delete BetterPerson by field names
+        3. Update unknown field
+
+        result: field names work like PersonField, unknown field raises ValueError
+
+        teardown:
+        1. Truncate better_persons
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        person = BetterPerson(1, 'Ermac', date(1000, 1, 1), 'Outworld')
+        better_persons_table.insert(person)
+        assert better_persons_table.select(person, by='first_name') == person, 'Select by field name failed!'
+        with pytest.raises(ValueError):
+            better_persons_table.update(person.person_id, ['nickname'], ['Ermac'])
+        updated_person = better_persons_table.update(person.person_id, [PersonField.birthplace], ['Netherrealm'])
+        assert updated_person.birthplace == 'Netherrealm', 'Update by PersonField failed!'
+        assert better_persons_table.delete(updated_person, by='birthplace') == updated_person, \
+            'Delete by field name failed!'
+
+    def test_deprecated_delete_drops(self, db_client, table_manager):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+        3. Create table better_persons_legacy like better_persons
+
+        test:
+        1. Call BetterPersons.delete without arguments
+
+        result: DeprecationWarning is emitted and better_persons_legacy is dropped
+
+        teardown:
+        1. Delete better_persons_legacy if it exists
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        q = """CREATE TABLE better_persons_legacy (LIKE better_persons INCLUDING ALL);"""
+        table_manager.create_table('better_persons_legacy', q)
+        try:
+            with pytest.warns(DeprecationWarning):
+                BetterPersons(db_client, 'better_persons_legacy').delete()
+            db_client.connection.commit()
+            q = """SELECT to_regclass('better_persons_legacy');"""
+            assert db_client.connection.execute(q).fetchone() == (None,), 'Legacy delete did not drop the table!'
+        finally:
+            db_client.connection.rollback()
+            table_manager.delete_table('better_persons_legacy', """DROP TABLE IF EXISTS better_persons_legacy;""")
+
+    def test_close_cursors(self, db_client, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+
+        test:
+        1. Get BetterPerson to cache a cursor
+        2. Close the table
+        3. Get BetterPerson again
+
+        result: the cached cursor is closed and a new one is created on the next call
+
+        teardown:
+        1. Truncate better_persons
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        table = BetterPersons(db_client)
+        table.get(1)
+        cursor, = table._cursors.values()
+        table.close()
+        assert cursor.closed and not table._cursors, 'Cached cursor was not closed!'
+        assert table.get(1) is None, 'Closed table cannot be used again!'
+        assert len(table._cursors) == 1, 'New cursor was not cached!'
@@ -0,0 +1,212 @@
+from datetime import date
+
+import pytest
+
+from common.changes import ChangeFeed
+from common.models import BetterPerson, PersonField
+from common.online_schema import SchemaChangeCancelled
+from common.tables import BetterPersons
+
+
+@pytest.fixture
+def better_persons_table(db_client, table_manager, create_table_better_persons_row_sql):
+    table = BetterPersons(db_client)
+    table_manager.create_table(table.table_name, create_table_better_persons_row_sql)
+    persons = [BetterPerson(i, f'Tarkatan {i}', date(1000, 1, 1), 'Outworld', hobby='Blades') for i in range(1, 101)]
+    table.insert_many(persons)
+    db_client.connection.commit()
+    yield table
+    table.online_change('').abort()
+    q = """DROP TABLE IF EXISTS better_persons, better_persons_old;"""
+    table_manager.delete_table(table.table_name, q)
+
+
+def hobby_type(db_client) -> tuple:
+    q = """
+    SELECT data_type FROM information_schema.columns WHERE table_name = 'better_persons' AND column_name = 'hobby';
+    """
+    return db_client.connection.execute(q).fetchone()
+
+
+class TestOnlineSchemaChange:
+
+    def test_change_column_type_online(self, db_client, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons with 100 BetterPersons
+
+        test:
+        1. Change type of hobby to text online in batches of 10
+        2. Insert, update and delete BetterPersons while the backfill is running
+
+        result: hobby has type text, better_persons has all rows with changes made during the backfill
+
+        teardown:
+        1. Delete better_persons and better_persons_old
+        2. Disconnect from test_db
+        """
+        inserted = BetterPerson(1000, 'Baraka', date(1000, 1, 1), 'Outworld', hobby='Blades')
+
+        def change_rows(progress):
+            if progress.position == 10:
+                better_persons_table.insert(inserted)
+                better_persons_table.update(50, [PersonField.first_name], ['Mileena'])
+                better_persons_table.delete_many([90])
+                db_client.connection.commit()
+
+        change = better_persons_table.online_change('ALTER COLUMN hobby TYPE text', batch_size=10, pause=0,
+                                                    progress=change_rows)
+        progress = change.run()
+        assert progress.position == 1000, f'Backfill stopped at {progress.position}!'
+        assert hobby_type(db_client) == ('text',), 'Column type is not changed!'
+
+        persons = list(better_persons_table.scan())
+        assert len(persons) == 100, f'Wrong number of rows {len(persons)} after swap!'
+        assert better_persons_table.get(50).first_name == 'Mileena', 'Update during backfill is lost!'
+        assert better_persons_table.get(90) is None, 'Delete during backfill is lost!'
+        assert better_persons_table.get(1000) == inserted, 'Insert during backfill is lost!'
+
+    def test_cancel_and_resume(self, db_client, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons with 100 BetterPersons
+
+        test:
+        1. Start online change of hobby type and cancel it after the first batch
+        2. Run the same change again
+
+        result: first run is cancelled without swap, second run resumes from the saved position and swaps tables
+
+        teardown:
+        1. Delete better_persons and better_persons_old
+        2. Disconnect from test_db
+        """
+        alter = 'ALTER COLUMN hobby TYPE text'
+        change = better_persons_table.online_change(alter, batch_size=10, pause=0)
+        change.progress = lambda progress: change.cancel()
+        with pytest.raises(SchemaChangeCancelled):
+            change.run()
+        assert hobby_type(db_client) == ('character varying',), 'Cancelled change swapped tables!'
+
+        positions = []
+        resumed = better_persons_table.online_change(alter, batch_size=10, pause=0,
+                                                     progress=lambda progress: positions.append(progress.position))
+        progress = resumed.run()
+        assert positions[0] == 20, f'Change is not resumed, first batch ends at {positions[0]}!'
+        assert progress.copied == 100, f'Wrong number of copied rows {progress.copied}!'
+        assert hobby_type(db_client) == ('text',), 'Column type is not changed!'
+
+    def test_old_table_exists(self, db_client, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons with 100 BetterPersons
+
+        test:
+        1. Change type of hobby to text online and keep better_persons_old
+        2. Start another online change of better_persons
+
+        result: second change is refused before the shadow table is created
+
+        teardown:
+        1. Delete better_persons and better_persons_old
+        2. Disconnect from test_db
+        """
+        better_persons_table.online_change('ALTER COLUMN hobby TYPE text', pause=0).run()
+        change = better_persons_table.online_change('ALTER COLUMN occupation TYPE text', pause=0)
+        with pytest.raises(ValueError):
+            change.run()
+        q = """SELECT to_regclass('better_persons_shadow');"""
+        assert db_client.connection.execute(q).fetchone() == (None,), 'Shadow table is created!'
+        db_client.connection.commit()
+
+    def test_triggers_moved(self, db_client, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons with 100 BetterPersons
+        3. Install change feed on better_persons
+
+        test:
+        1. Change type of hobby to text online
+        2. Insert BetterPerson into better_persons
+
+        result: change feed trigger is moved to the new better_persons and logs the insert
+
+        teardown:
+        1. Uninstall change feed
+        2. Delete better_persons and better_persons_old
+        3. Disconnect from test_db
+        """
+        feed = ChangeFeed(db_client, better_persons_table.table_name)
+        feed.install()
+        try:
+            better_persons_table.online_change('ALTER COLUMN hobby TYPE text', pause=0, drop_old=True).run()
+            better_persons_table.insert(BetterPerson(1000, 'Kabal', date(1000, 1, 1), 'Earthrealm'))
+            db_client.connection.commit()
+            q = """SELECT op, person_id FROM better_persons_changes;"""
+            assert db_client.connection.execute(q).fetchall() == [('I', 1000)], 'Change feed trigger is lost!'
+            db_client.connection.commit()
+        finally:
+            feed.uninstall()
+
+    def test_indexes_renamed(self, db_client, table_manager, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons with 100 BetterPersons
+
+        test:
+        1. Create search index on first_name
+        2. Change type of hobby to text online and keep better_persons_old
+
+        result: indexes of the new better_persons have the original names, old indexes are suffixed with _old
+
+        teardown:
+        1. Delete better_persons and better_persons_old
+        2. Disconnect from test_db
+        """
+        table_manager.create_search_index(better_persons_table)
+        better_persons_table.online_change('ALTER COLUMN hobby TYPE text', pause=0).run()
+        q = """SELECT tablename, indexname FROM pg_indexes WHERE tablename LIKE 'better_persons%' ORDER BY 1, 2;"""
+        indexes = db_client.connection.execute(q).fetchall()
+        db_client.connection.commit()
+        assert indexes == [
+            ('better_persons', 'better_persons_first_name_trgm_idx'),
+            ('better_persons', 'better_persons_pkey'),
+            ('better_persons_old', 'better_persons_first_name_trgm_idx_old'),
+            ('better_persons_old', 'better_persons_pkey_old'),
+        ], f'Indexes are not renamed {indexes}!'
+
+    def test_serial_sequence_moved(self, db_client, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons with 100 BetterPersons
+        3. Add serial column to better_persons
+
+        test:
+        1. Change type of hobby to text online and drop better_persons_old
+        2. Insert BetterPerson into better_persons
+
+        result: the sequence is owned by the new better_persons and still fills the serial column
+
+        teardown:
+        1. Delete better_persons and better_persons_old
+        2. Disconnect from test_db
+        """
+        db_client.connection.execute("""ALTER TABLE better_persons ADD COLUMN visit serial;""")
+        db_client.connection.commit()
+        better_persons_table.online_change('ALTER COLUMN hobby TYPE text', pause=0, drop_old=True).run()
+        db_client.connection.execute(
+            """INSERT INTO better_persons (person_id, first_name, birthday, birthplace) VALUES (%s, %s, %s, %s);""",
+            (1000, 'Kabal', date(1000, 1, 1), 'Earthrealm'),
+        )
+        q = """
+        SELECT visit, pg_get_serial_sequence('better_persons', 'visit') FROM better_persons WHERE person_id = 1000;
+        """
+        row = db_client.connection.execute(q).fetchone()
+        db_client.connection.commit()
+        assert row == (101, 'public.better_persons_visit_seq'), f'Sequence was not moved {row}!'
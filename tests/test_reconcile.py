@@ -0,0 +1,173 @@
+from datetime import date
+
+import pytest
+
+from common.datagen import PersonsGenerator
+from common.models import BetterPerson, Person, PersonField
+from common.reconcile import reconcile
+from common.tables import Persons
+
+
+@pytest.fixture(scope='class')
+def persons_copy_table(db_client, table_manager, create_table_persons):
+    table_manager.create_table('persons_copy', """CREATE TABLE persons_copy (LIKE persons INCLUDING ALL);""")
+    yield Persons(db_client, 'persons_copy')
+    table_manager.delete_table('persons_copy', """DROP TABLE persons_copy;""")
+
+
+@pytest.fixture
+def fill_tables(db_client, persons_table, persons_copy_table):
+    PersonsGenerator(Person, seed=3).copy_into(persons_table, 10_000)
+    PersonsGenerator(Person, seed=3).copy_into(persons_copy_table, 10_000)
+    yield
+    db_client.connection.execute("""TRUNCATE TABLE persons, persons_copy;""")
+    db_client.connection.commit()
+
+
+@pytest.mark.usefixtures('fill_tables')
+class TestReconcile:
+
+    def test_equal_tables(self, persons_table, persons_copy_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create tables persons and persons_copy
+        3. Generate the same 10000 Persons into both tables
+
+        test:
+        1. Reconcile persons with persons_copy
+
+        result: no differences, only top level chunks are compared
+
+        teardown:
+        1. Truncate persons and persons_copy
+        2. Delete persons and persons_copy
+        3. Disconnect from test_db
+        """
+        report = reconcile(persons_table, persons_copy_table, leaf_size=100, fanout=10)
+        assert report.ok, f'Equal tables differ: {report}'
+        assert report.chunks <= 10, f'Too many chunks compared for equal tables: {report.chunks}'
+
+    def test_changed_rows(self, db_client, persons_table, persons_copy_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create tables persons and persons_copy
+        3. Generate the same 10000 Persons into both tables
+
+        test:
+        1. Delete, update and insert one Person in persons_copy
+        2. Reconcile persons with persons_copy
+
+        result: report has the missing, the extra and the different Person with changed field
+
+        teardown:
+        1. Truncate persons and persons_copy
+        2. Delete persons and persons_copy
+        3. Disconnect from test_db
+        """
+        extra = Person(20_000, 'Shao Kahn', date(1998, 11, 5))
+        persons_copy_table.delete_many([10])
+        persons_copy_table.update(5_000, [PersonField.first_name], ['Motaro'])
+        persons_copy_table.insert(extra)
+        db_client.connection.commit()
+
+        report = reconcile(persons_table, persons_copy_table, leaf_size=100, fanout=10)
+        assert [person.person_id for person in report.missing] == [10], f'Wrong missing rows {report.missing}!'
+        assert report.extra == [extra], f'Wrong extra rows {report.extra}!'
+        (source, target, differences), = report.different
+        assert (source.person_id, target.first_name) == (5_000, 'Motaro'), 'Wrong different row!'
+        assert differences == ['first_name'], f'Wrong different fields {differences}!'
+        assert report.mismatched_chunks == 3, f'Wrong number of mismatched chunks {report.mismatched_chunks}!'
+
+    def test_table_and_file(self, tmp_path, persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+        3. Generate 10000 Persons into persons
+
+        test:
+        1. Generate the same 10000 Persons into csv file and change one row of the file
+        2. Reconcile persons with the file
+
+        result: only the changed row is reported as different
+
+        teardown:
+        1. Truncate persons
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        path = tmp_path / 'persons.csv'
+        PersonsGenerator(Person, seed=3).write_file(path, 10_000)
+        lines = path.read_text().splitlines(keepends=True)
+        person_id, first_name, birthday = lines[42].strip().split(',')
+        lines[42] = f'{person_id},{first_name},1000-01-01\n'
+        path.write_text(''.join(lines))
+
+        report = reconcile(persons_table, path, leaf_size=100, fanout=10)
+        assert not report.missing and not report.extra, f'Wrong report {report}!'
+        assert [differences for *_, differences in report.different] == [['birthday']], f'Wrong report {report}!'
+
+    def test_file_with_nulls(self, tmp_path, db_client, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+
+        test:
+        1. Generate the same 1000 BetterPersons with NULL optional fields into better_persons and csv file
+        2. Reconcile better_persons with the file
+
+        result: NULL in the table and empty values in the file are equal, no differences
+
+        teardown:
+        1. Truncate better_persons
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        path = tmp_path / 'better_persons.csv'
+        PersonsGenerator(BetterPerson, seed=4, null_rate=0.5).write_file(path, 1_000)
+        PersonsGenerator(BetterPerson, seed=4, null_rate=0.5).copy_into(better_persons_table, 1_000)
+        try:
+            report = reconcile(better_persons_table, path, leaf_size=100, fanout=10)
+            assert report.ok, f'NULL and empty optional fields differ: {report}'
+        finally:
+            db_client.connection.execute("""TRUNCATE TABLE better_persons;""")
+            db_client.connection.commit()
+
+    def test_file_errors(self, tmp_path, persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+        3. Generate 10000 Persons into persons
+
+        test:
+        1. Generate the same 10000 Persons into csv file and break one row of the file
+        2. Reconcile persons with the file
+        3. Swap two rows of the file and reconcile again
+
+        result: the broken row is reported as a file error and as missing, unsorted file raises ValueError
+
+        teardown:
+        1. Truncate persons
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        path = tmp_path / 'persons.csv'
+        PersonsGenerator(Person, seed=3).write_file(path, 10_000)
+        lines = path.read_text().splitlines(keepends=True)
+        person_id, first_name, _ = lines[42].strip().split(',')
+        lines[42] = f'{person_id},{first_name},someday\n'
+        path.write_text(''.join(lines))
+
+        report = reconcile(persons_table, path, leaf_size=100, fanout=10)
+        assert [line for line, _ in report.errors] == [43], f'Broken row is not reported {report.errors}!'
+        assert [person.person_id for person in report.missing] == [int(person_id)], f'Wrong report {report}!'
+        assert not report.ok, 'Report with file errors is ok!'
+
+        lines[10], lines[11] = lines[11], lines[10]
+        path.write_text(''.join(lines))
+        with pytest.raises(ValueError):
+            reconcile(persons_table, path, leaf_size=100, fanout=10)
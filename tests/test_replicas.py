@@ -0,0 +1,130 @@
+import datetime
+
+import pytest
+
+from common.db_client import DataBaseClient
+from common.models import Person
+from common.tables import Persons
+
+
+@pytest.fixture
+def replicated_client(db_client):
+    if not db_client.replicas:
+        pytest.skip('Run with --replica host:port to test read routing.')
+    db_client.connection.commit()
+    db_client.last_write = -db_client.sticky_window
+    return db_client
+
+
+class TestReadRouting:
+
+    def test_read_from_primary_without_replicas(self, db_client):
+        """
+        setup:
+        1. Connect to test_db
+
+        test:
+        1. Get read connection from client without replicas
+
+        result: read connection is the primary connection
+
+        teardown:
+        1. Disconnect from test_db
+        """
+        if db_client.replicas:
+            pytest.skip('Client has replicas.')
+        assert db_client.read_connection is db_client.connection, 'Read is routed away from primary!'
+
+    def test_read_from_replica(self, replicated_client):
+        """
+        setup:
+        1. Connect to test_db and its replicas
+
+        test:
+        1. Get read connection without previous writes
+        2. Select pg_is_in_recovery() via read connection
+
+        result: read is served by replica
+
+        teardown:
+        1. Disconnect from test_db and its replicas
+        """
+        connection = replicated_client.read_connection
+        assert connection is not replicated_client.connection, 'Read is not routed to replica!'
+        assert connection.execute('SELECT pg_is_in_recovery();').fetchone()[0], 'Read connection is not replica!'
+
+    def test_read_your_writes(self, replicated_client):
+        """
+        setup:
+        1. Connect to test_db and its replicas
+
+        test:
+        1. Mark write in the session
+        2. Get read connection
+
+        result: read is served by primary
+
+        teardown:
+        1. Disconnect from test_db and its replicas
+        """
+        replicated_client.mark_write()
+        assert replicated_client.read_connection is replicated_client.connection, 'Read after write left primary!'
+
+    def test_unreachable_replica(self, db_client):
+        """
+        setup:
+        1. Connect to test_db
+
+        test:
+        1. Create client with a replica which refuses connections
+        2. Get read connection
+
+        result: client is created, the replica is unhealthy and reads are served by primary
+
+        teardown:
+        1. Close the client
+        2. Disconnect from test_db
+        """
+        client = DataBaseClient(db_client.connection_info, ['host=127.0.0.1 port=1 connect_timeout=1'])
+        try:
+            assert not client.replicas[0].healthy, 'Unreachable replica is healthy!'
+            assert client.read_connection is client.connection, 'Read is routed to unreachable replica!'
+        finally:
+            client.close()
+
+    def test_lost_replica_falls_back(self, db_client, persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+
+        test:
+        1. Insert Person
+        2. Create client which uses test_db as its replica
+        3. Terminate the replica connection of the client
+        4. Get Person via the client
+
+        result: the read is retried on primary and the replica is marked unhealthy
+
+        teardown:
+        1. Close the client
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        person = Person(1, 'Nightwolf', datetime.date(1000, 1, 1))
+        persons_table.insert(person)
+        db_client.connection.commit()
+        client = DataBaseClient(db_client.connection_info, [db_client.connection_info], check_interval=60)
+        try:
+            replica = client.replicas[0]
+            assert client.read_connection is replica.connection, 'Read is not routed to replica!'
+            q = """SELECT pg_terminate_backend(%s, 5000);"""
+            db_client.connection.execute(q, (replica.connection.info.backend_pid,))
+            db_client.connection.commit()
+
+            assert Persons(client).get(person.person_id) == person, 'Read did not fall back to primary!'
+            assert not replica.healthy, 'Lost replica is healthy!'
+        finally:
+            client.close()
+            persons_table.delete_many([person.person_id])
+            db_client.connection.commit()
@@ -0,0 +1,138 @@
+from datetime import date
+
+import pytest
+
+from common.models import BetterPerson, PersonField
+from common.tables import BetterPersons
+
+PERSONS = [
+    BetterPerson(1, 'Sonya', date(1970, 1, 1), 'Austin', 'Blade'),
+    BetterPerson(2, 'Sindel', date(1000, 1, 1), 'Edenia', 'Queen'),
+    BetterPerson(3, 'Sareena', date(1000, 1, 1), 'Netherrealm', 'Demon'),
+    BetterPerson(4, 'Kano', date(1960, 1, 1), 'Sydney', 'Black Dragon'),
+]
+
+
+@pytest.fixture(scope='class')
+def better_persons_table(db_client, table_manager, create_table_better_persons):
+    table = BetterPersons(db_client)
+    search_fields = (PersonField.first_name, 'family_name')
+    table_manager.create_search_index(table, search_fields)
+    table.insert_many(PERSONS)
+    db_client.connection.commit()
+    yield table
+    table_manager.delete_search_index(table, search_fields)
+
+
+@pytest.mark.usefixtures('better_persons_table')
+class TestSearch:
+
+    def test_prefix_search(self, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons with trigram indexes
+        3. Insert BetterPersons
+
+        test:
+        1. Search `si` by prefix in first_name
+
+        result: only BetterPersons with first_name starting with `si` (case insensitive) are found
+
+        teardown:
+        1. Delete trigram indexes
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        result = better_persons_table.search('si', mode='prefix')
+        assert [person.person_id for person in result] == [2], 'Wrong prefix search result!'
+
+    def test_prefix_search_by_fields(self, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons with trigram indexes
+        3. Insert BetterPersons
+
+        test:
+        1. Search `black` by prefix in family_name passed as fields keyword
+
+        result: only BetterPerson with family_name starting with `black` is found
+
+        teardown:
+        1. Delete trigram indexes
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        result = better_persons_table.search('black', fields=['family_name'])
+        assert [person.person_id for person in result] == [4], 'Wrong prefix search result by family_name!'
+
+    def test_similar_search_ranked(self, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons with trigram indexes
+        3. Insert BetterPersons
+
+        test:
+        1. Search misspelled `Sonia` among first_name and family_name
+
+        result: the most similar BetterPerson is the first one
+
+        teardown:
+        1. Delete trigram indexes
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        result = better_persons_table.search('Sonia', ['first_name', 'family_name'], limit=2, mode='similar')
+        assert result, 'Similar search found nothing!'
+        assert result[0].person_id == 1, 'Wrong similar search ranking!'
+
+    def test_search_unknown_field(self, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+
+        test:
+        1. Search in field which BetterPerson does not have
+
+        result: ValueError is raised
+
+        teardown:
+        1. Delete better_persons
+        2. Disconnect from test_db
+        """
+        with pytest.raises(ValueError):
+            better_persons_table.search('Kano', ['nickname'])
+
+    def test_search_knn_index(self, db_client, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons with trigram indexes
+        3. Insert BetterPersons
+
+        test:
+        1. Explain similar search in first_name without sequential scans
+        2. Search `b` by prefix in first_name and family_name with limit 1
+
+        result: search is served by the GiST trigram index, the best match of both fields is returned once
+
+        teardown:
+        1. Delete trigram indexes
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        q = """SELECT indexdef FROM pg_indexes WHERE indexname = 'better_persons_first_name_trgm_idx';"""
+        assert 'USING gist' in db_client.connection.execute(q).fetchone()[0], 'Search index is not GiST!'
+        db_client.connection.execute('SET enable_seqscan = off;')
+        plan = db_client.connection.execute(
+            """EXPLAIN SELECT * FROM better_persons ORDER BY first_name <-> 'Sonia' LIMIT 2;""",
+        ).fetchall()
+        db_client.connection.rollback()
+        assert 'better_persons_first_name_trgm_idx' in str(plan), 'kNN order is not served by the index!'
+
+        result = better_persons_table.search('b', ['first_name', 'family_name'], limit=1)
+        assert len(result) == 1, f'Wrong number of results {len(result)}!'
+        assert result[0].person_id in (1, 4), 'Wrong prefix search result!'
@@ -0,0 +1,206 @@
+from datetime import date
+
+import psycopg
+import pytest
+from psycopg import sql
+from psycopg.conninfo import make_conninfo
+
+from common.db_client import DataBaseClient
+from common.models import Person, PersonField
+from common.sharding import (HASH_MASK, HASH_MULTIPLIER, HASH_SHIFT,
+                             SLOT_SQL, ShardedPersons, slot_of)
+from common.tables import TableManager
+
+SHARDS = ['test_db_shard_0', 'test_db_shard_1', 'test_db_shard_2']
+
+
+@pytest.fixture(scope='class')
+def shard_clients(db_client, create_table_persons_row_sql):
+    with psycopg.connect(db_client.connection_info, autocommit=True) as connection:
+        for name in SHARDS:
+            connection.execute(sql.SQL('CREATE DATABASE {};').format(sql.Identifier(name)))
+    clients = [DataBaseClient(make_conninfo(db_client.connection_info, dbname=name)) for name in SHARDS]
+    for client in clients:
+        TableManager(client).create_table('persons', create_table_persons_row_sql)
+    yield clients
+    for client in clients:
+        client.close()
+    with psycopg.connect(db_client.connection_info, autocommit=True) as connection:
+        for name in SHARDS:
+            connection.execute(sql.SQL('DROP DATABASE {};').format(sql.Identifier(name)))
+
+
+@pytest.fixture
+def sharded_persons(shard_clients):
+    sharded = ShardedPersons(shard_clients[:2])
+    yield sharded
+    sharded.delete_many(range(1, 1001))
+    sharded.commit()
+    sharded.close()
+
+
+class TestShardedPersons:
+
+    def test_routing(self, sharded_persons):
+        """
+        setup:
+        1. Create databases for 2 shards with table persons
+
+        test:
+        1. Insert Person into sharded persons
+        2. Select Person by id
+        3. Update Person id so that it moves to another shard
+
+        result: Person is found only on its shard, update moves Person between shards
+
+        teardown:
+        1. Delete Persons from shards
+        2. Drop shard databases
+        """
+        person = Person(1, 'Ermac', date(1000, 1, 1))
+        sharded_persons.insert(person)
+        assert sharded_persons.select(person, by=PersonField.person_id) == person, 'Routed select failed!'
+        found_on = [shard for shard in sharded_persons.shards if shard.get(person.person_id)]
+        assert found_on == [sharded_persons.shard_for(person.person_id)], 'Person is stored on wrong shard!'
+
+        new_id = next(i for i in range(2, 1000) if sharded_persons.shard_for(i) is not found_on[0])
+        updated_person = sharded_persons.update(person.person_id, [PersonField.person_id], [new_id])
+        assert updated_person.person_id == new_id, 'Cross-shard update failed!'
+        assert not found_on[0].get(person.person_id), 'Old row stayed on the source shard!'
+
+    def test_batch_and_rebalance(self, sharded_persons, shard_clients):
+        """
+        setup:
+        1. Create databases for 3 shards with table persons
+
+        test:
+        1. Insert batch of Persons into 2 shards
+        2. Add the third shard
+        3. Select batch and scan all shards
+
+        result: third shard got about a third of Persons, all Persons are still found
+
+        teardown:
+        1. Delete Persons from shards
+        2. Drop shard databases
+        """
+        persons = [Person(i, f'Zombie {i}', date(1000, 1, 1)) for i in range(1, 1001)]
+        sharded_persons.insert_many(persons)
+        sharded_persons.commit()
+
+        sharded_persons.add_shard(shard_clients[2])
+        new_shard_rows = list(sharded_persons.shards[2].scan())
+        assert 250 < len(new_shard_rows) < 420, f'Rebalance moved {len(new_shard_rows)} rows!'
+        assert sharded_persons.select_many(range(1, 1001)) == persons, 'Batch select after rebalance failed!'
+        assert list(sharded_persons.scan(batch_size=100)) == persons, 'Merged scan failed!'
+
+    def test_slot_sql(self, shard_clients):
+        """
+        setup:
+        1. Create databases for 3 shards with table persons
+
+        test:
+        1. Compute slots of person ids on the server with SLOT_SQL
+
+        result: server slots are equal to slot_of
+
+        teardown:
+        1. Drop shard databases
+        """
+        person_ids = [-2 ** 31, -1, 0, 1, 2, 1000, 2 ** 31 - 1]
+        slot_sql = sql.SQL(SLOT_SQL).format(HASH_MULTIPLIER, HASH_MASK, HASH_SHIFT)
+        q = sql.SQL("""SELECT {} FROM unnest(%s::integer[]) AS person_id;""").format(slot_sql)
+        connection = shard_clients[0].connection
+        slots = [row[0] for row in connection.execute(q, (person_ids,)).fetchall()]
+        connection.rollback()
+        assert slots == list(map(slot_of, person_ids)), 'Slots computed on the server differ from slot_of!'
+
+    def test_move_slot(self, sharded_persons):
+        """
+        setup:
+        1. Create databases for 2 shards with table persons
+
+        test:
+        1. Insert Persons into sharded persons
+        2. Move the slot of the first Person to the other shard
+
+        result: Persons of the slot are only on the target shard and are routed there
+
+        teardown:
+        1. Delete Persons from shards
+        2. Drop shard databases
+        """
+        persons = [Person(i, f'Noob {i}', date(1000, 1, 1)) for i in range(1, 101)]
+        sharded_persons.insert_many(persons)
+        sharded_persons.commit()
+        slot = slot_of(persons[0].person_id)
+        source = sharded_persons.slots[slot]
+        target = 1 - source
+        in_slot = [person for person in persons if slot_of(person.person_id) == slot]
+
+        moved = sharded_persons.move_slot(slot, target)
+        assert moved == len(in_slot), f'Moved {moved} rows instead of {len(in_slot)}!'
+        person_ids = [person.person_id for person in in_slot]
+        assert not sharded_persons.shards[source].select_many(person_ids), 'Rows stayed on the source shard!'
+        assert sharded_persons.shards[target].select_many(person_ids) == in_slot, 'Rows are lost on move!'
+        assert sharded_persons.select_many(person_ids) == in_slot, 'Moved rows are routed to the source shard!'
+
+    def test_update_by_field_name_and_duplicates(self, sharded_persons):
+        """
+        setup:
+        1. Create databases for 2 shards with table persons
+
+        test:
+        1. Insert Person and move it to another shard by updating `person_id` given as str
+        2. Insert batch of Persons with duplicate person_id
+
+        result: Person is moved to the shard of the new id, batch with duplicates is refused
+
+        teardown:
+        1. Delete Persons from shards
+        2. Drop shard databases
+        """
+        person = Person(1, 'Reptile', date(1000, 1, 1))
+        sharded_persons.insert(person)
+        new_id = next(i for i in range(2, 1000) if sharded_persons.shard_for(i) is not sharded_persons.shard_for(1))
+        updated_person = sharded_persons.update(person.person_id, ['person_id'], [new_id])
+        assert updated_person.person_id == new_id, 'Cross-shard update by field name failed!'
+        assert sharded_persons.shard_for(new_id).get(new_id) == updated_person, 'Person is not on its new shard!'
+
+        with pytest.raises(ValueError):
+            sharded_persons.insert_many([Person(5, 'Rain', date(1000, 1, 1)), Person(5, 'Rain', date(1000, 1, 1))])
+
+    def test_search_merged_by_score(self, sharded_persons, shard_clients):
+        """
+        setup:
+        1. Create databases for 2 shards with table persons and trigram indexes
+
+        test:
+        1. Insert the two best matches of `Scorpion` into one shard and a weaker match into the other
+        2. Search similar to `Scorpion` with limit 2
+
+        result: the two best matches are returned although they are on the same shard
+
+        teardown:
+        1. Delete trigram indexes
+        2. Delete Persons from shards
+        3. Drop shard databases
+        """
+        managers = [TableManager(client) for client in shard_clients[:2]]
+        for manager, shard in zip(managers, sharded_persons.shards):
+            manager.create_search_index(shard, ['first_name'])
+        try:
+            shard_of = {i: sharded_persons.shards.index(sharded_persons.shard_for(i)) for i in range(1, 1000)}
+            first, second = [i for i, shard in shard_of.items() if shard == 0][:2]
+            other = next(i for i, shard in shard_of.items() if shard == 1)
+            sharded_persons.insert_many([
+                Person(first, 'Scorpion', date(1000, 1, 1)),
+                Person(second, 'Scorpions', date(1000, 1, 1)),
+                Person(other, 'Scorpi', date(1000, 1, 1)),
+            ])
+            sharded_persons.commit()
+            result = sharded_persons.search('Scorpion', limit=2, mode='similar')
+            assert [person.person_id for person in result] == [first, second], 'Search is not merged by score!'
+        finally:
+            for manager, shard in zip(managers, sharded_persons.shards):
+                manager.delete_search_index(shard, ['first_name'])
@@ -0,0 +1,116 @@
+from datetime import date
+
+import pytest
+
+from common.models import BetterPerson
+from common.snapshot import SnapshotReader, build_snapshot
+from common.tables import BetterPersons
+
+PERSONS = [
+    BetterPerson(person_id, f'Shokan {person_id}', date(1000, 1, 1 + person_id % 28), 'Outworld', None)
+    for person_id in range(1, 2001, 2)
+]
+
+
+@pytest.fixture(scope='class')
+def better_persons_table(db_client, create_table_better_persons):
+    table = BetterPersons(db_client)
+    table.insert_many(PERSONS)
+    db_client.connection.commit()
+    return table
+
+
+@pytest.mark.usefixtures('better_persons_table')
+class TestSnapshot:
+
+    def test_snapshot_lookups(self, tmp_path, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+        3. Insert BetterPersons with odd ids
+
+        test:
+        1. Build snapshot of better_persons
+        2. Get BetterPersons from snapshot by id and by batch of ids
+
+        result: snapshot returns the same BetterPersons as table, missing ids are not found
+
+        teardown:
+        1. Delete better_persons
+        2. Disconnect from test_db
+        """
+        path = tmp_path / 'better_persons.snapshot'
+        assert build_snapshot(better_persons_table, path) == len(PERSONS), 'Wrong snapshot rows count!'
+
+        reader = SnapshotReader(path)
+        assert reader.get(PERSONS[10].person_id) == PERSONS[10], 'Snapshot get failed!'
+        assert reader.get(2) is None, 'Snapshot found missing id!'
+        assert reader.get_many([5, 4, 3, 1]) == [PERSONS[0], PERSONS[1], PERSONS[2]], 'Snapshot batch get failed!'
+
+    def test_snapshot_refresh(self, tmp_path, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+        3. Insert BetterPersons with odd ids
+
+        test:
+        1. Build snapshot and open reader
+        2. Insert BetterPerson and rebuild snapshot
+        3. Refresh reader
+
+        result: reader sees the new BetterPerson only after refresh
+
+        teardown:
+        1. Delete new BetterPerson
+        2. Delete better_persons
+        3. Disconnect from test_db
+        """
+        path = tmp_path / 'better_persons.snapshot'
+        build_snapshot(better_persons_table, path)
+        reader = SnapshotReader(path)
+        assert not reader.refresh(), 'Reader refreshed unchanged snapshot!'
+
+        person = BetterPerson(2, 'Motaro', date(1000, 1, 1), 'Outworld')
+        better_persons_table.insert(person)
+        better_persons_table.db_client.connection.commit()
+        try:
+            build_snapshot(better_persons_table, path)
+            assert reader.get(2) is None, 'Reader changed before refresh!'
+            assert reader.refresh(), 'Reader did not refresh replaced snapshot!'
+            assert reader.get(2) == person, 'Refreshed reader has no new BetterPerson!'
+        finally:
+            better_persons_table.delete_many([2])
+            better_persons_table.db_client.connection.commit()
+
+    def test_snapshot_write_failure(self, tmp_path, monkeypatch, better_persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table better_persons
+        3. Insert BetterPersons with odd ids
+
+        test:
+        1. Build snapshot of better_persons
+        2. Build it again with a failing fsync
+
+        result: the error is raised, the previous snapshot is kept and no temporary file is left
+
+        teardown:
+        1. Delete better_persons
+        2. Disconnect from test_db
+        """
+        path = tmp_path / 'better_persons.snapshot'
+        build_snapshot(better_persons_table, path)
+
+        def fail(fd: int) -> None:
+            raise OSError('No space left on device')
+
+        monkeypatch.setattr('common.snapshot.os.fsync', fail)
+        with pytest.raises(OSError):
+            build_snapshot(better_persons_table, path)
+        monkeypatch.undo()
+
+        assert [file.name for file in tmp_path.iterdir()] == [path.name], 'Temporary snapshot file is left!'
+        assert len(SnapshotReader(path)) == len(PERSONS), 'Previous snapshot is broken!'
@@ -0,0 +1,100 @@
+import pytest
+
+from common.datagen import PersonsGenerator
+from common.models import Person
+from common.tables import Persons
+
+
+@pytest.fixture(scope='class')
+def persons_table(db_client, create_table_persons):
+    db_client.connection.execute("""ALTER TABLE persons SET (autovacuum_enabled = false);""")
+    db_client.connection.commit()
+    return Persons(db_client)
+
+
+@pytest.fixture
+def fill_persons(db_client, persons_table):
+    PersonsGenerator(Person).copy_into(persons_table, 50_000)
+    yield
+    db_client.connection.execute("""TRUNCATE TABLE persons;""")
+    db_client.connection.commit()
+
+
+def flush_stats(db_client) -> None:
+    # Backends report statistics at most once a second, tests need them right away.
+    db_client.connection.execute("""SELECT pg_stat_force_next_flush();""")
+    db_client.connection.commit()
+
+
+@pytest.mark.usefixtures('fill_persons')
+class TestTableStats:
+
+    def test_stats_after_analyze(self, db_client, table_manager, persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons without autovacuum
+        3. Generate 50000 Persons into persons
+
+        test:
+        1. Analyze persons
+        2. Get stats and health of persons
+
+        result: stats have live tuples, sizes and primary key index, no maintenance is recommended
+
+        teardown:
+        1. Truncate persons
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        table_manager.analyze(persons_table)
+        flush_stats(db_client)
+        stats = table_manager.stats(persons_table)
+        assert stats.live_tuples == 50_000, f'Wrong live tuples {stats.live_tuples}!'
+        assert stats.last_analyze is not None, 'Analyze is not reported!'
+        assert stats.size > 0 and stats.total_size > stats.size, 'Wrong table sizes!'
+        assert [index.name for index in stats.indexes] == ['persons_pkey'], 'Primary key index is not reported!'
+        health = table_manager.health(persons_table)
+        assert health.healthy, f'Unexpected recommendations {health.recommendations}!'
+
+    def test_vacuum_after_delete(self, db_client, table_manager, persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons without autovacuum
+        3. Generate 50000 Persons into persons
+
+        test:
+        1. Delete half of Persons and check health of persons
+        2. Vacuum persons and check health
+        3. Vacuum full persons and check health
+
+        result: VACUUM and ANALYZE are recommended after delete, VACUUM FULL after vacuum, table is healthy at the end
+
+        teardown:
+        1. Truncate persons
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        table_manager.analyze(persons_table)
+        db_client.connection.execute("""DELETE FROM persons WHERE person_id % 2 = 0;""")
+        db_client.connection.commit()
+        flush_stats(db_client)
+
+        health = table_manager.health(persons_table)
+        assert health.stats.dead_tuples == 25_000, f'Wrong dead tuples {health.stats.dead_tuples}!'
+        recommended = [recommendation.split(':')[0] for recommendation in health.recommendations]
+        assert recommended == ['VACUUM', 'ANALYZE'], f'Wrong recommendations {health.recommendations}!'
+
+        table_manager.vacuum(persons_table)
+        flush_stats(db_client)
+        health = table_manager.health(persons_table)
+        assert health.stats.dead_tuples == 0, f'Vacuum left {health.stats.dead_tuples} dead tuples!'
+        assert health.stats.last_vacuum is not None, 'Vacuum is not reported!'
+        recommended = [recommendation.split(':')[0] for recommendation in health.recommendations]
+        assert recommended == ['VACUUM FULL or pg_repack'], f'Wrong recommendations {health.recommendations}!'
+
+        table_manager.vacuum(persons_table, full=True)
+        flush_stats(db_client)
+        health = table_manager.health(persons_table)
+        assert health.healthy, f'Unexpected recommendations {health.recommendations}!'
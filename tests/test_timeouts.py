@@ -0,0 +1,175 @@
+import datetime
+
+import psycopg
+import pytest
+
+from common.db_client import DataBaseClient, DataBaseTimeout
+from common.models import Person
+
+
+@pytest.fixture
+def locked_persons(db_client, persons_table):
+    db_client.connection.commit()
+    with psycopg.connect(db_client.connection_info) as connection:
+        connection.execute("""LOCK TABLE persons IN ACCESS EXCLUSIVE MODE;""")
+        yield
+        connection.rollback()
+
+
+@pytest.mark.usefixtures('persons_table')
+class TestTimeouts:
+
+    def test_lock_timeout(self, db_client, persons_table, locked_persons):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+        3. Lock persons from another connection
+
+        test:
+        1. Insert Person into persons with lock_timeout
+
+        result: DataBaseTimeout is raised
+
+        teardown:
+        1. Release lock on persons
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        person = Person(1, 'Scorpion', datetime.date(1000, 1, 1))
+        with pytest.raises(DataBaseTimeout):
+            with db_client.timeouts(lock_timeout=0.2):
+                persons_table.insert(person)
+
+    def test_deadline(self, db_client, persons_table, locked_persons):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+        3. Lock persons from another connection
+
+        test:
+        1. Insert Person into persons with client deadline
+
+        result: query is cancelled, DataBaseTimeout is raised in time
+
+        teardown:
+        1. Release lock on persons
+        2. Delete persons
+        3. Disconnect from test_db
+        """
+        person = Person(1, 'Scorpion', datetime.date(1000, 1, 1))
+        started = datetime.datetime.now()
+        with pytest.raises(DataBaseTimeout):
+            with db_client.timeouts(deadline=0.2):
+                persons_table.insert(person)
+        elapsed = datetime.datetime.now() - started
+        assert elapsed < datetime.timedelta(seconds=5), 'Query was not cancelled on deadline!'
+
+    def test_insert_after_timeout(self, db_client, persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+        3. Lock persons from another connection
+
+        test:
+        1. Insert Person into persons with lock_timeout
+        2. Release lock on persons
+        3. Insert the same Person again
+
+        result: first insert raises DataBaseTimeout and rolls back, second insert succeeds
+
+        teardown:
+        1. Delete persons
+        2. Disconnect from test_db
+        """
+        person = Person(2, 'Sub-Zero', datetime.date(1000, 1, 1))
+        db_client.connection.commit()
+        with psycopg.connect(db_client.connection_info) as connection:
+            connection.execute("""LOCK TABLE persons IN ACCESS EXCLUSIVE MODE;""")
+            with pytest.raises(DataBaseTimeout):
+                with db_client.timeouts(lock_timeout=0.2):
+                    persons_table.insert(person)
+            connection.rollback()
+        assert db_client.connection.info.transaction_status == psycopg.pq.TransactionStatus.IDLE, \
+            'Transaction was not rolled back after timeout!'
+        assert persons_table.insert(person) == person, f'Cannot insert {person} after timeout!'
+        db_client.connection.rollback()
+
+    def test_timeouts_on_replica_reads(self, db_client):
+        """
+        setup:
+        1. Connect to test_db with test_db as its replica
+
+        test:
+        1. Show statement_timeout via read connection inside timeouts block
+        2. Show statement_timeout via read connection after the block
+
+        result: routed read has the override inside the block and the default after it
+
+        teardown:
+        1. Disconnect from test_db
+        """
+        client = DataBaseClient(db_client.connection_info, [db_client.connection_info])
+        try:
+            default = client.connection.execute('SHOW statement_timeout;').fetchone()[0]
+            client.connection.commit()
+            with client.timeouts(statement_timeout=0.5):
+                connection = client.read_connection
+                assert connection is not client.connection, 'Read is not routed to replica!'
+                inside = connection.execute('SHOW statement_timeout;').fetchone()[0]
+            outside = connection.execute('SHOW statement_timeout;').fetchone()[0]
+        finally:
+            client.close()
+        assert inside == '500ms', f'Override is not applied to replica read: {inside}!'
+        assert outside == default, f'Override is not reset on replica: {outside}!'
+
+    def test_timeouts_restored_after_error(self, db_client):
+        """
+        setup:
+        1. Connect to test_db
+
+        test:
+        1. Fail a query inside timeouts block with statement_timeout
+        2. Show statement_timeout after the block
+
+        result: error is raised, failed transaction is rolled back and statement_timeout is restored
+
+        teardown:
+        1. Disconnect from test_db
+        """
+        db_client.connection.commit()
+        default = db_client.connection.execute('SHOW statement_timeout;').fetchone()[0]
+        db_client.connection.commit()
+        with pytest.raises(psycopg.errors.DivisionByZero):
+            with db_client.timeouts(statement_timeout=0.5):
+                db_client.connection.execute('SELECT 1 / 0;')
+        restored = db_client.connection.execute('SHOW statement_timeout;').fetchone()[0]
+        db_client.connection.commit()
+        assert restored == default, f'statement_timeout {restored} is kept after the block!'
+
+    def test_timeouts_after_rollback(self, db_client, persons_table):
+        """
+        setup:
+        1. Connect to test_db
+        2. Create table persons
+        3. Open a transaction
+
+        test:
+        1. Roll back the transaction inside timeouts block with statement_timeout
+        2. Get Person and show statement_timeout inside the block
+
+        result: statement_timeout override is applied again after the rollback
+
+        teardown:
+        1. Delete persons
+        2. Disconnect from test_db
+        """
+        db_client.connection.execute('SELECT 1;')
+        with db_client.timeouts(statement_timeout=0.5):
+            db_client.connection.rollback()
+            persons_table.get(1)
+            inside = db_client.connection.execute('SHOW statement_timeout;').fetchone()[0]
+        db_client.connection.commit()
+        assert inside == '500ms', f'Override is lost after rollback: {inside}!'